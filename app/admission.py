@@ -0,0 +1,155 @@
+"""
+Admission control: Caps how many model calls a process sends upstream
+at once. Calls over the cap wait in a bounded FIFO queue; when the queue
+is full, or a call has waited too long, it is refused with an
+OverloadedError carrying a Retry-After estimate instead of piling more
+load onto the inference endpoint.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .config import Settings, get_settings
+
+log = logging.getLogger("hand2excal")
+
+# Recent queue waits kept for the stats
+_WAIT_WINDOW = 256
+
+
+class OverloadedError(Exception):
+    """The upstream concurrency limit and its queue are both full."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Counting semaphore with a bounded, fair wait queue.
+
+    `max_concurrent` of 0 disables the limit. Waiters are admitted in
+    arrival order; each waits at most `queue_timeout` seconds.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._waiters: deque[threading.Event] = deque()
+        self._active = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._waits: deque[float] = deque(maxlen=_WAIT_WINDOW)
+        # Moving average of how long a call holds its slot
+        self._call_seconds = 10.0
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a newcomer."""
+        rounds = (len(self._waiters) + 1) / max(1, self.max_concurrent)
+        return min(120, max(1, math.ceil(rounds * self._call_seconds)))
+
+    def _reject(self, reason: str) -> OverloadedError:
+        self._rejected += 1
+        retry_after = self._retry_after()
+        log.warning(f"🚦 Refused model call: {reason} (retry after {retry_after}s)")
+        return OverloadedError(f"Server is busy ({reason}). Try again later.", retry_after)
+
+    def acquire(self) -> float:
+        """Take a slot, waiting in line if needed; returns the seconds waited."""
+        if not self.max_concurrent:
+            return 0.0
+        started = time.monotonic()
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                self._waits.append(0.0)
+                return 0.0
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(f"{len(self._waiters)} calls already queued")
+            ticket = threading.Event()
+            self._waiters.append(ticket)
+
+        if not ticket.wait(self.queue_timeout):
+            with self._lock:
+                # The slot may have been handed over just after the timeout
+                if not ticket.is_set():
+                    self._waiters.remove(ticket)
+                    raise self._reject(f"queued for over {self.queue_timeout:.0f}s")
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._admitted += 1
+            self._waits.append(waited)
+        return waited
+
+    def release(self, held: float = 0.0) -> None:
+        """Free a slot, handing it straight to the next waiter if there is one."""
+        if not self.max_concurrent:
+            return
+        with self._lock:
+            if held:
+                self._call_seconds = 0.9 * self._call_seconds + 0.1 * held
+            if self._waiters:
+                # The slot passes to the waiter; the active count is unchanged
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of the block; yields the seconds spent queued."""
+        waited = self.acquire()
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """Current load and recent queue waits (ms)."""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": len(self._waiters),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+                "wait_ms_max": round(1000 * waits[-1], 1) if waits else 0.0,
+            }
+
+
+_controller: AdmissionController | None = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller(settings: Settings | None = None) -> AdmissionController:
+    """Return the process-wide admission controller, creating it on first use."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            settings = settings or get_settings()
+            limit = settings.upstream_max_concurrent + settings.upstream_max_queue
+            if settings.upstream_max_concurrent and limit >= settings.inference_workers:
+                # Calls beyond the worker pool wait in its unbounded queue before reaching us
+                log.warning(
+                    "⚠️  HAND2EXCAL_UPSTREAM_MAX_CONCURRENT + HAND2EXCAL_UPSTREAM_MAX_QUEUE should stay "
+                    "below HAND2EXCAL_INFERENCE_WORKERS, or overload waits instead of being refused"
+                )
+            _controller = AdmissionController(
+                settings.upstream_max_concurrent,
+                settings.upstream_max_queue,
+                settings.upstream_queue_timeout,
+            )
+        return _controller
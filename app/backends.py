@@ -0,0 +1,287 @@
+"""
+Inference backends: Where model calls go. Every backend answers
+chat_completion() with the response shape of huggingface_hub (the
+OpenAI one), so vision.py works the same whichever is configured by
+HAND2EXCAL_INFERENCE_BACKEND:
+
+  hf      the Hugging Face Inference API (needs HF_API_TOKEN)
+  openai  an OpenAI-compatible server at HAND2EXCAL_INFERENCE_BASE_URL,
+          such as vLLM or a llama.cpp server next to the app
+  replay  responses recorded earlier, without any model or network
+
+With HAND2EXCAL_RECORD_DIR set, the live backends save every response
+there (one JSON file per request) for replay.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from types import SimpleNamespace
+
+from .config import Settings, get_settings
+from .inference import get_client_manager
+
+log = logging.getLogger("hand2excal")
+
+BACKENDS = ("hf", "openai", "replay")
+
+# Characters per streamed chunk when replaying a recording
+_REPLAY_CHUNK = 16
+
+
+def _chat_completion(client, model: str, messages: list[dict], kwargs: dict):
+    """
+    Call client.chat_completion and close the client once the response has
+    been read; a stream keeps its client alive until the stream is consumed.
+    """
+    if not kwargs.get("stream"):
+        with client:
+            return client.chat_completion(model=model, messages=messages, **kwargs)
+
+    def consume() -> Iterator:
+        with client:
+            yield from client.chat_completion(model=model, messages=messages, **kwargs)
+
+    return consume()
+
+
+class InferenceBackend:
+    """A model provider plus the models it is asked for."""
+
+    name = ""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+    @property
+    def image_model(self) -> str:
+        return self.settings.image_model
+
+    @property
+    def text_model(self) -> str:
+        return self.settings.text_model
+
+    @property
+    def escalation_model(self) -> str:
+        """Larger image model for low-confidence results ("" when the cascade is off)."""
+        return self.settings.escalation_model
+
+    def describe(self) -> str:
+        return self.name
+
+    def chat_completion(self, *, model: str, messages: list[dict], **kwargs):
+        """
+        A chat completion, or an iterator of chunks with stream=True;
+        kwargs are max_tokens, temperature, stream and stream_options.
+        """
+        raise NotImplementedError
+
+
+class HFInferenceBackend(InferenceBackend):
+    """The Hugging Face Inference API through the shared connection pool."""
+
+    name = "hf"
+
+    def chat_completion(self, *, model: str, messages: list[dict], **kwargs):
+        return _chat_completion(get_client_manager().client(), model, messages, kwargs)
+
+
+class OpenAICompatibleBackend(InferenceBackend):
+    """Any server speaking /v1/chat/completions (vLLM, llama.cpp, TGI)."""
+
+    name = "openai"
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings)
+        if not settings.inference_base_url:
+            raise ValueError("The openai backend needs HAND2EXCAL_INFERENCE_BASE_URL.")
+
+    def describe(self) -> str:
+        return f"{self.name} ({self.settings.inference_base_url})"
+
+    def chat_completion(self, *, model: str, messages: list[dict], **kwargs):
+        client = get_client_manager().client(base_url=self.settings.inference_base_url)
+        return _chat_completion(client, model, messages, kwargs)
+
+
+def _request_key(model: str, messages: list[dict], max_tokens: int | None) -> str:
+    payload = json.dumps({"model": model, "messages": messages, "max_tokens": max_tokens}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _model_dir(root: Path, model: str) -> Path:
+    return root / model.replace("/", "--")
+
+
+def _usage_dict(usage) -> dict | None:
+    if usage is None:
+        return None
+    return {kind: getattr(usage, kind, None) for kind in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+
+class RecordingBackend(InferenceBackend):
+    """
+    Wraps a live backend and saves each finished response as
+    <record_dir>/<model>/<request hash>.json. Recording failures are
+    logged, never raised.
+    """
+
+    def __init__(self, inner: InferenceBackend, directory: Path):
+        super().__init__(inner.settings)
+        self.inner = inner
+        self.directory = directory
+        self.name = inner.name
+
+    def describe(self) -> str:
+        return f"{self.inner.describe()}, recording to {self.directory}"
+
+    def chat_completion(self, *, model: str, messages: list[dict], **kwargs):
+        key = _request_key(model, messages, kwargs.get("max_tokens"))
+        started = time.perf_counter()
+        response = self.inner.chat_completion(model=model, messages=messages, **kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream(response, model, key, started)
+        choice = response.choices[0]
+        self._save(model, key, {
+            "content": choice.message.content or "",
+            "finish_reason": choice.finish_reason,
+            "usage": _usage_dict(response.usage),
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+        return response
+
+    def _record_stream(self, stream, model: str, key: str, started: float) -> Iterator:
+        parts = []
+        finish_reason = None
+        usage = None
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                parts.append(chunk.choices[0].delta.content or "")
+            yield chunk
+        self._save(model, key, {
+            "content": "".join(parts),
+            "finish_reason": finish_reason,
+            "usage": _usage_dict(usage),
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+
+    def _save(self, model: str, key: str, record: dict) -> None:
+        path = _model_dir(self.directory, model) / f"{key}.json"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{secrets.token_hex(4)}.tmp")
+            tmp.write_text(json.dumps({"model": model, **record}), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning(f"⚠️  Could not record model response to {path}: {e}")
+
+
+class ReplayBackend(InferenceBackend):
+    """
+    Answers from recordings made by RecordingBackend. A request without
+    an exact recording fails, or with replay_any gets one of the model's
+    other recordings (picked by the request hash, so it is stable).
+    """
+
+    name = "replay"
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings)
+        directory = settings.replay_dir or settings.record_dir
+        if not directory:
+            raise ValueError("The replay backend needs HAND2EXCAL_REPLAY_DIR (or HAND2EXCAL_RECORD_DIR).")
+        self.directory = Path(directory).expanduser()
+        if not self.directory.is_dir():
+            raise ValueError(f"Replay directory {self.directory} does not exist.")
+        self._listings: dict[str, list[Path]] = {}
+        self._lock = threading.Lock()
+
+    def describe(self) -> str:
+        return f"{self.name} ({self.directory})"
+
+    def _recordings(self, model: str) -> list[Path]:
+        with self._lock:
+            if model not in self._listings:
+                self._listings[model] = sorted(_model_dir(self.directory, model).glob("*.json"))
+            return self._listings[model]
+
+    def _find(self, model: str, key: str) -> dict:
+        path = _model_dir(self.directory, model) / f"{key}.json"
+        if not path.exists() and self.settings.replay_any:
+            recordings = self._recordings(model)
+            if recordings:
+                path = recordings[int(key[:8], 16) % len(recordings)]
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise LookupError(f"No recorded response for this {model} request in {self.directory}") from None
+
+    def _pace(self, seconds: float) -> None:
+        if self.settings.replay_speed > 0 and seconds > 0:
+            time.sleep(seconds / self.settings.replay_speed)
+
+    def chat_completion(self, *, model: str, messages: list[dict], **kwargs):
+        record = self._find(model, _request_key(model, messages, kwargs.get("max_tokens")))
+        usage = SimpleNamespace(**record["usage"]) if record.get("usage") else None
+        if kwargs.get("stream"):
+            return self._replay_stream(record, usage)
+        self._pace(record.get("seconds", 0))
+        message = SimpleNamespace(role="assistant", content=record["content"])
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason=record.get("finish_reason"))],
+            usage=usage,
+        )
+
+    def _replay_stream(self, record: dict, usage) -> Iterator:
+        content = record["content"]
+        chunks = [content[i:i + _REPLAY_CHUNK] for i in range(0, len(content), _REPLAY_CHUNK)]
+        for text in chunks:
+            self._pace(record.get("seconds", 0) / len(chunks))
+            delta = SimpleNamespace(role="assistant", content=text)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)], usage=None)
+        end = SimpleNamespace(role="assistant", content=None)
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(index=0, delta=end, finish_reason=record.get("finish_reason"))], usage=None
+        )
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+def create_backend(settings: Settings | None = None) -> InferenceBackend:
+    """The backend selected by settings, wrapped for recording if record_dir is set."""
+    settings = settings or get_settings()
+    name = settings.inference_backend or ("openai" if settings.inference_base_url else "hf")
+    if name == "hf":
+        backend: InferenceBackend = HFInferenceBackend(settings)
+    elif name == "openai":
+        backend = OpenAICompatibleBackend(settings)
+    elif name == "replay":
+        return ReplayBackend(settings)
+    else:
+        raise ValueError(f"HAND2EXCAL_INFERENCE_BACKEND must be one of {', '.join(BACKENDS)}, got {name!r}")
+    if settings.record_dir:
+        backend = RecordingBackend(backend, Path(settings.record_dir).expanduser())
+    return backend
+
+
+_backend: InferenceBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> InferenceBackend:
+    """Return the process-wide inference backend, creating it on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+            log.info(f"🔌 Inference backend: {_backend.describe()}")
+        return _backend
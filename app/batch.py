@@ -0,0 +1,204 @@
+"""
+Batch conversion: Converts many images concurrently for the CLI
+(`hand2excal batch`), writing each output atomically and recording
+progress in a manifest so an interrupted run resumes where it stopped.
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .admission import OverloadedError
+from .config import get_settings
+from .excalidraw_builder import build_excalidraw_json
+from .vision import run_image_file_extraction
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".heic"}
+
+MANIFEST_NAME = ".hand2excal-batch.jsonl"
+
+
+def find_images(source: str, recursive: bool = False) -> tuple[list[Path], Path]:
+    """
+    Images named by `source` (a directory or a glob pattern), sorted,
+    plus the root that output paths are made relative to.
+    """
+    path = Path(source)
+    if path.is_dir():
+        pattern = "**/*" if recursive else "*"
+        images = [p for p in path.glob(pattern) if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS]
+        return sorted(images), path
+
+    images = sorted(Path(p) for p in glob.glob(source, recursive=True) if os.path.isfile(p))
+    if not images:
+        return [], Path(".")
+    root = Path(os.path.commonpath([str(p.parent.resolve()) for p in images]))
+    return [p.resolve() for p in images], root
+
+
+def write_atomic(path: Path, text: str) -> None:
+    """Write a file so readers only ever see the old or the complete new content."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Manifest:
+    """
+    Append-only JSON-lines log of finished items. Each line is one
+    attempt; the last line for an input wins, so re-running after a crash
+    skips everything already done.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of a crashed run
+                    self.entries[entry["input"]] = entry
+
+    def is_done(self, name: str, output: Path) -> bool:
+        entry = self.entries.get(name)
+        return entry is not None and entry.get("status") == "done" and output.exists()
+
+    def record(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[entry["input"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+@dataclass
+class BatchSummary:
+    """Outcome of a batch run; latencies are per converted item, in ms."""
+
+    total: int = 0
+    converted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    cache_hits: int = 0
+    elapsed: float = 0.0
+    latencies_ms: list[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Converted items per second of wall time."""
+        return self.converted / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _convert_one(image: Path, output: Path, pretty: bool) -> dict:
+    started = time.perf_counter()
+    budget = get_settings().upstream_retry_budget
+    deadline = time.monotonic() + budget
+    while True:
+        try:
+            extraction = run_image_file_extraction(image)
+            break
+        except OverloadedError as e:
+            # More workers than upstream slots: wait for one instead of failing the
+            # image, but record a failure rather than hang on a saturated upstream
+            wait = min(e.retry_after, deadline - time.monotonic())
+            if wait <= 0:
+                raise OverloadedError(f"Upstream still busy after {budget:g}s of retries", e.retry_after) from e
+            time.sleep(wait)
+    key = extraction.key if get_settings().deterministic_builds else None
+    write_atomic(output, build_excalidraw_json(extraction.flowchart, pretty=pretty, key=key))
+    return {
+        "status": "done",
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+        "nodes": len(extraction.flowchart.get("nodes", [])),
+        "arrows": len(extraction.flowchart.get("arrows", [])),
+        "cache_hit": extraction.cache_hit,
+        "truncated": extraction.truncated,
+    }
+
+
+def run_batch(
+    images: list[Path],
+    root: Path,
+    output_dir: Path | None = None,
+    workers: int = 8,
+    pretty: bool = True,
+    retry_failed: bool = True,
+    manifest_path: Path | None = None,
+    on_result: Callable[[str, dict], None] | None = None,
+) -> BatchSummary:
+    """
+    Convert `images` with `workers` threads. Outputs go next to each
+    image, or under `output_dir` mirroring their path below `root`.
+    Items already done according to the manifest are skipped, as are
+    previously failed ones unless `retry_failed`. `on_result(name, entry)`
+    is called on the calling thread as each item finishes.
+    """
+    output_root = output_dir or root
+    manifest = Manifest(manifest_path or output_root / MANIFEST_NAME)
+    summary = BatchSummary(total=len(images))
+
+    pending = []
+    for image in images:
+        name = image.relative_to(root).as_posix()
+        output = (output_root / name).with_suffix(".excalidraw")
+        previous = manifest.entries.get(name, {})
+        if manifest.is_done(name, output) or (previous.get("status") == "failed" and not retry_failed):
+            summary.skipped += 1
+            continue
+        pending.append((name, image, output))
+
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    def work(name: str, image: Path, output: Path) -> dict:
+        try:
+            entry = _convert_one(image, output, pretty)
+        except Exception as e:
+            entry = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        entry = {"input": name, "output": str(output), **entry}
+        manifest.record(entry)
+        return entry
+
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(work, *item) for item in pending]
+        for future in as_completed(futures):
+            entry = future.result()
+            if on_result is not None:
+                on_result(entry["input"], entry)
+            if entry["status"] == "done":
+                summary.converted += 1
+                summary.cache_hits += entry["cache_hit"]
+                summary.latencies_ms.append(entry["ms"])
+            else:
+                summary.failed += 1
+    finally:
+        # On Ctrl-C, drop queued items; finished ones are already in the manifest
+        executor.shutdown(wait=True, cancel_futures=True)
+        summary.elapsed = time.perf_counter() - started
+    return summary
@@ -0,0 +1,341 @@
+"""
+Result cache: Content-addressed store for validated flowchart dicts,
+so identical uploads skip the model round trip.
+
+Two tiers: a per-process LRU in memory, backed by an SQLite file that
+every server worker and the CLI share.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from .config import get_settings
+
+log = logging.getLogger("hand2excal")
+
+# VACUUM rewrites the whole file under an exclusive lock, so only do it
+# once at least this share of its pages is free; SQLite reuses the rest
+_VACUUM_FREE_SHARE = 0.25
+
+
+def make_cache_key(kind: str, payload: bytes, model: str, prompt: str) -> str:
+    """
+    Build a content-addressed key from the normalized input, the model
+    and the prompt text (so editing a prompt invalidates old results).
+    """
+    prompt_version = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    digest = hashlib.sha256(payload).hexdigest()
+    return f"{kind}:{model}:{prompt_version}:{digest}"
+
+
+class DiskCache:
+    """
+    SQLite-backed result store that is safe to share between processes.
+    Entries are evicted by TTL and, once the file exceeds `max_bytes`,
+    least recently used first.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = 256 * 1024 * 1024, ttl: float = 86400.0):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps this thread- and fork-safe
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        return json.loads(value)
+
+    def put(self, key: str, value: dict) -> None:
+        payload = json.dumps(value, separators=(",", ":"))
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now),
+            )
+            self._evict(conn, self.max_bytes)
+        finally:
+            conn.close()
+
+    def _evict(self, conn: sqlite3.Connection, max_bytes: int) -> int:
+        """Drop least recently used rows until the total payload fits max_bytes."""
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        if total <= max_bytes:
+            return 0
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        return removed
+
+    def prune(self, max_bytes: int | None = None, older_than: float | None = None) -> int:
+        """
+        Remove expired entries, entries not used for `older_than` seconds,
+        and LRU entries beyond `max_bytes`. The file only shrinks once a
+        quarter of it is free space. Returns the number removed.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            removed = 0
+            if self.ttl:
+                removed += conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,)).rowcount
+            if older_than is not None:
+                removed += conn.execute("DELETE FROM results WHERE accessed < ?", (now - older_than,)).rowcount
+            removed += self._evict(conn, self.max_bytes if max_bytes is None else max_bytes)
+            self._vacuum_if_sparse(conn)
+        finally:
+            conn.close()
+        return removed
+
+    def clear(self) -> int:
+        conn = self._connect()
+        try:
+            removed = conn.execute("DELETE FROM results").rowcount
+            self._vacuum_if_sparse(conn)
+        finally:
+            conn.close()
+        return removed
+
+    @staticmethod
+    def _vacuum_if_sparse(conn: sqlite3.Connection) -> bool:
+        """Give free pages back to the file system once enough have piled up."""
+        (pages,) = conn.execute("PRAGMA page_count").fetchone()
+        (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+        if not pages or free < pages * _VACUUM_FREE_SHARE:
+            return False
+        conn.execute("VACUUM")
+        return True
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            count, total, oldest, newest = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(created), MAX(created) FROM results"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {
+            "path": str(self.path),
+            "entries": count,
+            "payload_bytes": total,
+            "file_bytes": self.path.stat().st_size if self.path.exists() else 0,
+            "max_bytes": self.max_bytes,
+            "oldest": oldest,
+            "newest": newest,
+        }
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL, optionally backed by a
+    DiskCache shared with other processes.
+    Values are deep-copied on the way in and out because the builder
+    mutates node positions in place.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 86400.0, disk: DiskCache | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        """Return a copy of the cached value, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl and time.monotonic() - stored_at > self.ttl:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    return copy.deepcopy(value)
+
+        if self.disk is None:
+            return None
+        try:
+            value = self.disk.get(key)
+        except sqlite3.Error as e:
+            log.warning(f"⚠️  Disk cache read failed: {e}")
+            return None
+        if value is not None:
+            # Promote so later hits in this process skip SQLite
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        """Store a copy of value in both tiers."""
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except sqlite3.Error as e:
+                log.warning(f"⚠️  Disk cache write failed: {e}")
+        self._put_memory(key, value)
+
+    def _put_memory(self, key: str, value: dict) -> None:
+        """Store a copy of value in memory, evicting the least recently used entries."""
+        if self.max_entries <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LeaderCancelled(Exception):
+    """The leader of a single-flight call gave up (its client went away); followers retry."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (leader)
+    does the work, later callers (followers) wait for and share its result
+    or exception instead of repeating it.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> tuple[Future, bool]:
+        """
+        Join the call in flight for key, or start one. Returns (future,
+        is_leader); a leader must report its outcome with end().
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def end(self, key: str, future: Future, result=None, error: BaseException | None = None) -> None:
+        """Publish a leader's result (or exception) to its followers."""
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(copy.deepcopy(result))
+
+    def do(self, key: str, func) -> tuple[dict, bool]:
+        """Run func() once per in-flight key. Returns (result, was_follower)."""
+        while True:
+            future, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return copy.deepcopy(future.result()), True
+            except LeaderCancelled:
+                continue
+
+        try:
+            result = func()
+        except BaseException as e:
+            self.end(key, future, error=e)
+            raise
+        self.end(key, future, result)
+        return result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+def open_disk_cache() -> DiskCache | None:
+    """Open the shared on-disk cache from settings, or None if it is disabled."""
+    settings = get_settings()
+    if not settings.cache_dir or settings.cache_disk_max_mb <= 0:
+        return None
+    return DiskCache(
+        Path(settings.cache_dir).expanduser() / "results.sqlite3",
+        max_bytes=settings.cache_disk_max_mb * 1024 * 1024,
+        ttl=settings.cache_ttl,
+    )
+
+
+_cache: ResultCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Return the process-wide result cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = get_settings()
+            _cache = ResultCache(
+                max_entries=settings.cache_max_entries,
+                ttl=settings.cache_ttl,
+                disk=open_disk_cache(),
+            )
+        return _cache
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the process-wide single-flight group for model calls."""
+    return _single_flight
@@ -0,0 +1,73 @@
+"""
+Model cascade: Scores the flowchart a fast model read from an image so
+that only doubtful results are sent again to the slower, stronger
+escalation model (HAND2EXCAL_ESCALATION_MODEL).
+
+The score starts at 1.0 and loses a penalty for each warning sign:
+output that did not parse, arrows pointing at ids that do not exist,
+shapes without text, a cut-off response, and a node count far from the
+number of closed shapes drawn in the image.
+"""
+
+from dataclasses import dataclass
+
+# Lost for every arrow dropped for a dangling endpoint, as a share of all arrows
+DANGLING_ARROW_WEIGHT = 1.0
+# Lost for every node without a label, as a share of all nodes
+EMPTY_LABEL_WEIGHT = 0.5
+# Lost when the response hit max_tokens and was not finished
+TRUNCATED_PENALTY = 0.3
+# Node count vs closed shapes in the image: relative differences up to
+# SHAPE_SLACK are normal (loops and crossing arrows enclose paper too),
+# beyond it the rest is lost at SHAPE_MISMATCH_WEIGHT
+SHAPE_SLACK = 0.3
+SHAPE_MISMATCH_WEIGHT = 1.0
+
+
+@dataclass(frozen=True)
+class Confidence:
+    score: float
+    reasons: tuple[str, ...] = ()
+
+    def describe(self) -> str:
+        return f"{self.score:.2f}" + (f" ({', '.join(self.reasons)})" if self.reasons else "")
+
+
+UNPARSEABLE = Confidence(0.0, ("unparseable output",))
+
+
+def score_extraction(
+    flowchart: dict, dropped_arrows: int, truncated: bool, closed_shapes: int | None = None
+) -> Confidence:
+    """
+    Confidence (0..1) in a validated flowchart. `dropped_arrows` is how
+    many arrows validation removed; `closed_shapes` the count from
+    preprocess.count_closed_shapes, if known.
+    """
+    nodes = flowchart.get("nodes", [])
+    if not nodes:
+        return Confidence(0.0, ("no nodes",))
+
+    score = 1.0
+    reasons = []
+    total_arrows = len(flowchart.get("arrows", [])) + dropped_arrows
+    if dropped_arrows:
+        score -= DANGLING_ARROW_WEIGHT * dropped_arrows / total_arrows
+        reasons.append(f"{dropped_arrows}/{total_arrows} dangling arrows")
+
+    empty = sum(1 for node in nodes if not str(node.get("label", "")).strip())
+    if empty:
+        score -= EMPTY_LABEL_WEIGHT * empty / len(nodes)
+        reasons.append(f"{empty}/{len(nodes)} empty labels")
+
+    if truncated:
+        score -= TRUNCATED_PENALTY
+        reasons.append("truncated")
+
+    if closed_shapes:
+        mismatch = abs(len(nodes) - closed_shapes) / max(len(nodes), closed_shapes)
+        if mismatch > SHAPE_SLACK:
+            score -= SHAPE_MISMATCH_WEIGHT * (mismatch - SHAPE_SLACK)
+            reasons.append(f"{len(nodes)} nodes vs ~{closed_shapes} shapes drawn")
+
+    return Confidence(round(max(0.0, score), 3), tuple(reasons))
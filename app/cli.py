@@ -1,17 +1,198 @@
 """
 CLI interface for hand-to-excalidraw conversion.
 Usage: python -m app.cli input.jpg -o output.excalidraw
+       python -m app.cli batch <dir|glob> [-o OUT_DIR] [-j WORKERS]
+       python -m app.cli cache stats|prune|clear
 """
 
 import argparse
+import contextlib
 import sys
+import time
 from pathlib import Path
 
-from .vision import extract_flowchart_from_image
+from .batch import IMAGE_EXTENSIONS, find_images, run_batch
+from .cache import open_disk_cache
+from .config import get_settings
+from .preprocess import get_preprocess_pool, use_inline_preprocessing
+from .profiling import ProfileSession, should_profile
+from .vision import run_image_file_extraction
 from .excalidraw_builder import build_excalidraw_json
 
 
-def main():
+def _format_bytes(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def _cache_main(argv: list[str]) -> None:
+    """Inspect and maintain the shared on-disk result cache."""
+    parser = argparse.ArgumentParser(
+        description="Manage the on-disk conversion cache shared by the server and CLI.",
+        prog="hand2excalidraw cache",
+    )
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("stats", help="Show cache location, size and entry count")
+    prune = sub.add_parser("prune", help="Evict expired and least recently used entries")
+    prune.add_argument(
+        "--max-mb",
+        type=float,
+        default=None,
+        help="Shrink the cache to at most this many MB (default: configured cap)",
+    )
+    prune.add_argument(
+        "--older-than",
+        type=float,
+        default=None,
+        metavar="DAYS",
+        help="Also remove entries not used in this many days",
+    )
+    sub.add_parser("clear", help="Remove every cached entry")
+
+    args = parser.parse_args(argv)
+
+    disk = open_disk_cache()
+    if disk is None:
+        print("The on-disk cache is disabled (see HAND2EXCAL_CACHE_DIR / HAND2EXCAL_CACHE_DISK_MAX_MB).", file=sys.stderr)
+        sys.exit(1)
+
+    if args.action == "stats":
+        stats = disk.stats()
+        print(f"📦 Cache:   {stats['path']}")
+        print(f"   Entries: {stats['entries']}")
+        print(f"   Size:    {_format_bytes(stats['file_bytes'])} on disk "
+              f"({_format_bytes(stats['payload_bytes'])} payload, cap {_format_bytes(stats['max_bytes'])})")
+        if stats["oldest"] is not None:
+            fmt = "%Y-%m-%d %H:%M:%S"
+            print(f"   Oldest:  {time.strftime(fmt, time.localtime(stats['oldest']))}")
+            print(f"   Newest:  {time.strftime(fmt, time.localtime(stats['newest']))}")
+    elif args.action == "prune":
+        max_bytes = None if args.max_mb is None else int(args.max_mb * 1024 * 1024)
+        older_than = None if args.older_than is None else args.older_than * 86400
+        removed = disk.prune(max_bytes=max_bytes, older_than=older_than)
+        print(f"🧹 Pruned {removed} entries.")
+    elif args.action == "clear":
+        removed = disk.clear()
+        print(f"🗑️  Cleared {removed} entries.")
+
+
+def _add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample the run with the profiler and write a collapsed-stack file "
+             "(see HAND2EXCAL_PROFILE_DIR)",
+    )
+
+
+def _profiling(args: argparse.Namespace, label: str):
+    """Profile the whole process for --profile (or HAND2EXCAL_PROFILE)."""
+    if args.profile or should_profile(None):
+        return ProfileSession(label, all_threads=True)
+    return contextlib.nullcontext()
+
+
+def _batch_main(argv: list[str]) -> None:
+    """Convert a directory or glob of images, resuming an interrupted run."""
+    parser = argparse.ArgumentParser(
+        description="Convert many flowchart images concurrently. Progress is recorded in a "
+                    "manifest, so re-running the same command skips finished images.",
+        prog="hand2excalidraw batch",
+    )
+    parser.add_argument("source", help="Directory of images, or a glob pattern (quote it, e.g. 'scans/**/*.jpg')")
+    parser.add_argument(
+        "-o", "--output-dir",
+        type=str,
+        default=None,
+        help="Write outputs here, mirroring the input layout (default: next to each image)",
+    )
+    parser.add_argument(
+        "-j", "--workers",
+        type=int,
+        default=8,
+        help="Images converted concurrently (default: 8)",
+    )
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include subdirectories of a source directory")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Progress manifest path (default: .hand2excal-batch.jsonl in the output directory)",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Retry images that failed in a previous run (default: yes)",
+    )
+    parser.add_argument(
+        "--pretty",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Pretty-print the JSON output (default: pretty)",
+    )
+    _add_profile_argument(parser)
+    args = parser.parse_args(argv)
+
+    images, root = find_images(args.source, recursive=args.recursive)
+    if not images:
+        print(f"Error: No images found for {args.source}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"🗂️  {len(images)} images, {args.workers} workers")
+    done = 0
+
+    def report(name: str, entry: dict) -> None:
+        nonlocal done
+        done += 1
+        if entry["status"] == "done":
+            print(f"   ✅ [{done}] {name}: {entry['nodes']} shapes, {entry['arrows']} connections ({entry['ms']:.0f} ms)")
+        else:
+            print(f"   ❌ [{done}] {name}: {entry['error']}", file=sys.stderr)
+
+    try:
+        with _profiling(args, "cli-batch") as session:
+            summary = run_batch(
+                images,
+                root,
+                output_dir=Path(args.output_dir) if args.output_dir else None,
+                workers=args.workers,
+                pretty=args.pretty,
+                retry_failed=args.retry_failed,
+                manifest_path=Path(args.manifest) if args.manifest else None,
+                on_result=report,
+            )
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; run the same command again to resume.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        get_preprocess_pool().close()
+
+    print()
+    if session is not None and session.path is not None:
+        print(f"🔬 Profile: {session.path}")
+    print(f"📊 Converted {summary.converted}, skipped {summary.skipped}, failed {summary.failed} "
+          f"of {summary.total} in {summary.elapsed:.1f} s")
+    if summary.converted:
+        print(f"   Throughput: {summary.throughput:.2f} images/s ({summary.cache_hits} from cache)")
+        print(f"   Latency:    p50 {summary.percentile(50):.0f} ms, p95 {summary.percentile(95):.0f} ms, "
+              f"max {max(summary.latencies_ms):.0f} ms")
+    if summary.failed:
+        sys.exit(1)
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "cache":
+        _cache_main(argv[1:])
+        return
+    if argv and argv[0] == "batch":
+        _batch_main(argv[1:])
+        return
+
     parser = argparse.ArgumentParser(
         description="Convert a hand-drawn flowchart image to an Excalidraw file.",
         prog="hand2excalidraw",
@@ -29,12 +210,13 @@ def main():
     )
     parser.add_argument(
         "--pretty",
-        action="store_true",
+        action=argparse.BooleanOptionalAction,
         default=True,
-        help="Pretty-print the JSON output (default: True)",
+        help="Pretty-print the JSON output; --no-pretty writes compact JSON (default: pretty)",
     )
+    _add_profile_argument(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Validate input
     image_path = Path(args.image)
@@ -42,7 +224,7 @@ def main():
         print(f"Error: Image file not found: {image_path}", file=sys.stderr)
         sys.exit(1)
 
-    if not image_path.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".heic"}:
+    if not image_path.suffix.lower() in IMAGE_EXTENSIONS:
         print(f"Warning: Unusual image extension '{image_path.suffix}'. Proceeding anyway.", file=sys.stderr)
 
     # Determine output path
@@ -55,22 +237,28 @@ def main():
     print(f"📄 Output: {output_path}")
     print()
     print("🤖 Analyzing flowchart with Qwen2.5-VL...")
+    use_inline_preprocessing()
 
     try:
-        # Step 1: Extract flowchart data
-        flowchart_data = extract_flowchart_from_image(str(image_path))
-        nodes_count = len(flowchart_data.get("nodes", []))
-        arrows_count = len(flowchart_data.get("arrows", []))
-        print(f"   Found {nodes_count} shapes and {arrows_count} connections.")
-
-        # Step 2: Build Excalidraw JSON
-        print("🔧 Building Excalidraw file...")
-        excalidraw_json = build_excalidraw_json(flowchart_data)
-
-        # Step 3: Write output
-        output_path.write_text(excalidraw_json, encoding="utf-8")
-        print(f"\n✅ Done! Open the file in Excalidraw:")
-        print(f"   https://excalidraw.com → File → Open → {output_path.name}")
+        with _profiling(args, "cli") as session:
+            # Step 1: Extract flowchart data
+            extraction = run_image_file_extraction(image_path)
+            flowchart_data = extraction.flowchart
+            nodes_count = len(flowchart_data.get("nodes", []))
+            arrows_count = len(flowchart_data.get("arrows", []))
+            print(f"   Found {nodes_count} shapes and {arrows_count} connections.")
+
+            # Step 2: Build Excalidraw JSON
+            print("🔧 Building Excalidraw file...")
+            key = extraction.key if get_settings().deterministic_builds else None
+            excalidraw_json = build_excalidraw_json(flowchart_data, pretty=args.pretty, key=key)
+
+            # Step 3: Write output
+            output_path.write_text(excalidraw_json, encoding="utf-8")
+            print(f"\n✅ Done! Open the file in Excalidraw:")
+            print(f"   https://excalidraw.com → File → Open → {output_path.name}")
+        if session is not None and session.path is not None:
+            print(f"🔬 Profile: {session.path}")
 
     except ValueError as e:
         print(f"\n❌ Error: {e}", file=sys.stderr)
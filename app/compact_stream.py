@@ -0,0 +1,120 @@
+"""
+Compact flowchart format: A line-based edge list the model can emit in
+a fraction of the tokens of the JSON format. It carries topology only
+(ids, shapes, labels, connections and coarse row/column hints); geometry
+is computed locally by app.layout.
+
+    N <id> <shape>[:<color>] [<row> <col>] <label>
+    E <from> <to> [<label>]
+    END
+
+Shapes: R rectangle, O rounded rectangle, E ellipse, D diamond.
+A literal "\\n" in a label is a line break.
+"""
+
+_SHAPES = {
+    "R": ("rectangle", False),
+    "O": ("rectangle", True),
+    "E": ("ellipse", False),
+    "D": ("diamond", False),
+}
+
+
+def _node_id(token: str) -> str:
+    return token if token.startswith("node_") else f"node_{token}"
+
+
+def _label(text: str) -> str:
+    return text.strip().strip('"').replace("\\n", "\n")
+
+
+def _is_int(token: str) -> bool:
+    return token.lstrip("-").isdigit()
+
+
+class CompactStreamParser:
+    """
+    Incremental parser for the compact format, with the same interface as
+    FlowchartStreamParser: `feed()` returns ("node" | "arrow", dict) for
+    each line completed by the chunk, `result()` returns the flowchart.
+
+    Parsed flowcharts carry `"layout": "layered"` so the builder lays
+    them out instead of trusting coordinates.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pending = ""
+        self._ended = False
+        self._finished = False
+        self.nodes: list[dict] = []
+        self.arrows: list[dict] = []
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        self._text += chunk
+        self._pending += chunk
+        *lines, self._pending = self._pending.split("\n")
+        return [item for item in map(self._parse_line, lines) if item is not None]
+
+    def finish(self) -> list[tuple[str, dict]]:
+        """
+        Mark the response as finished normally (not cut off), parsing a
+        last line that had no trailing newline.
+        """
+        self._finished = True
+        line, self._pending = self._pending, ""
+        item = self._parse_line(line)
+        return [item] if item is not None else []
+
+    def _parse_line(self, line: str) -> tuple[str, dict] | None:
+        line = line.strip()
+        if self._ended or not line or line.startswith("```"):
+            return None
+        if line.upper() == "END":
+            self._ended = True
+            return None
+
+        tag, _, rest = line.partition(" ")
+        tokens = rest.split()
+        tag = tag.upper()
+        if tag == "N" and len(tokens) >= 2:
+            shape, _, color = tokens[1].partition(":")
+            node_type, rounded = _SHAPES.get(shape.upper(), ("rectangle", False))
+            node = {"id": _node_id(tokens[0]), "type": node_type, "rounded": rounded}
+            if color:
+                node["strokeColor"] = color
+            label_at = 2
+            if len(tokens) >= 4 and _is_int(tokens[2]) and _is_int(tokens[3]):
+                node["row"], node["col"] = int(tokens[2]), int(tokens[3])
+                label_at = 4
+            words = rest.split(None, label_at)
+            node["label"] = _label(words[label_at]) if len(words) > label_at else ""
+            self.nodes.append(node)
+            return "node", node
+
+        if tag == "E" and len(tokens) >= 2:
+            words = rest.split(None, 2)
+            arrow = {"from_id": _node_id(words[0]), "to_id": _node_id(words[1])}
+            arrow["label"] = _label(words[2]) if len(words) > 2 else ""
+            self.arrows.append(arrow)
+            return "arrow", arrow
+        return None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._text
+
+    @property
+    def complete(self) -> bool:
+        """True once END was seen or the response finished normally."""
+        return self._ended or self._finished
+
+    def result(self) -> dict:
+        """
+        The flowchart built from every complete line. Raises ValueError
+        if no node could be parsed.
+        """
+        if not self.nodes:
+            raise ValueError(f"Could not extract a flowchart from model response:\n{self._text[:500]}")
+        return {"nodes": list(self.nodes), "arrows": list(self.arrows), "layout": "layered"}
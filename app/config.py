@@ -0,0 +1,196 @@
+"""
+Runtime settings: Reads tunables from the environment (and .env)
+so the server and CLI share one configuration surface.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    """Read an integer (at least `minimum`) from the environment, falling back to default."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return max(minimum, int(value))
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+
+
+def _default_cache_dir() -> str:
+    """Per-user cache directory, honouring XDG_CACHE_HOME."""
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "hand2excal")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag (1/true/yes/on) from the environment."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a positive float from the environment, falling back to default."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Tunables for the conversion pipeline."""
+
+    # Where model calls go: "hf" (Hugging Face API), "openai" (the OpenAI-compatible
+    # server at inference_base_url) or "replay" (recorded responses); empty picks
+    # "openai" when a base URL is set and "hf" otherwise
+    inference_backend: str = ""
+    # OpenAI-compatible server for the "openai" backend
+    # (e.g. http://127.0.0.1:8000/v1 for vLLM, a local stand-in for load tests)
+    inference_base_url: str = ""
+    # Models asked for image and text conversions
+    image_model: str = "Qwen/Qwen2.5-VL-7B-Instruct"
+    text_model: str = "meta-llama/Meta-Llama-3-8B-Instruct"
+    # Model cascade: images whose result from image_model scores below the
+    # threshold (0..1, see app/cascade.py) are read again by this larger model
+    # (empty disables the cascade)
+    escalation_model: str = ""
+    escalation_threshold: float = 0.7
+    # Save every live model response here for the replay backend (empty disables)
+    record_dir: str = ""
+    # Replay backend: recordings to serve (default record_dir), whether a request
+    # with no exact recording gets another recording of the same model, and the
+    # pace (0 answers at once, 1 takes as long as the recorded call)
+    replay_dir: str = ""
+    replay_any: bool = False
+    replay_speed: float = 0.0
+    # Max model calls kept in flight per process by the async path
+    inference_workers: int = 32
+    # Seconds to wait for a model response / for the TCP+TLS handshake
+    inference_timeout: float = 120.0
+    http_connect_timeout: float = 10.0
+    # Connection pool limits for the upstream inference API
+    http_max_connections: int = 100
+    http_max_connections_per_host: int = 32
+    http_keepalive_expiry: float = 60.0
+    # Model calls sent upstream at once (0 = unlimited), calls allowed to wait
+    # for a slot, and the longest wait (seconds) before a 503
+    upstream_max_concurrent: int = 16
+    upstream_max_queue: int = 8
+    upstream_queue_timeout: float = 30.0
+    # Total seconds a batch job or CLI batch item keeps retrying 503s before failing
+    upstream_retry_budget: float = 600.0
+    # In-memory result cache (0 entries disables it; TTL in seconds)
+    cache_max_entries: int = 512
+    cache_ttl: float = 86400.0
+    # Shared on-disk cache (empty dir or 0 MB disables it); the dir also holds
+    # batch job state shared by all workers (empty dir keeps jobs in memory)
+    cache_dir: str = ""
+    cache_disk_max_mb: int = 256
+    # Follow-up requests made when model output hits max_tokens
+    max_continuations: int = 1
+    # Ask for the compact topology-only format and lay the chart out locally
+    compact_output: bool = False
+    # Derive element ids/seeds from the input so identical input builds identical
+    # bytes (and scenes get ETags); off keeps Excalidraw's random ids
+    deterministic_builds: bool = False
+    # Largest accepted image upload
+    max_upload_mb: int = 20
+    # Batch jobs: concurrent conversions, items per job, queued items across
+    # jobs, seconds finished jobs are kept, and largest job request body
+    job_workers: int = 8
+    job_max_items: int = 500
+    job_max_queued_items: int = 5000
+    job_ttl: float = 3600.0
+    job_max_upload_mb: int = 500
+    # Image decode pool (0 workers decodes inline) and its memory bounds
+    preprocess_workers: int = min(4, os.cpu_count() or 1)
+    preprocess_max_concurrent: int = 8
+    preprocess_max_tasks_per_child: int = 200
+    # Crop to the ink bounding box and size the output by stroke density
+    preprocess_crop: bool = True
+    preprocess_min_dim: int = 768
+    # Send a high-contrast grayscale JPEG instead of colour
+    preprocess_grayscale: bool = False
+    # Sampling profiler: fraction of conversions profiled, secret that turns it on
+    # per request (X-Hand2Excal-Profile header), output directory (default
+    # <cache_dir>/profiles), sampling interval, and how many profiles to keep
+    profile_rate: float = 0.0
+    profile_token: str = ""
+    profile_dir: str = ""
+    profile_interval_ms: float = 5.0
+    profile_max_files: int = 100
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            inference_backend=os.getenv("HAND2EXCAL_INFERENCE_BACKEND", cls.inference_backend).strip().lower(),
+            inference_base_url=os.getenv("HAND2EXCAL_INFERENCE_BASE_URL", cls.inference_base_url).strip(),
+            image_model=os.getenv("HAND2EXCAL_IMAGE_MODEL", "").strip() or cls.image_model,
+            text_model=os.getenv("HAND2EXCAL_TEXT_MODEL", "").strip() or cls.text_model,
+            escalation_model=os.getenv("HAND2EXCAL_ESCALATION_MODEL", cls.escalation_model).strip(),
+            escalation_threshold=min(1.0, _env_float("HAND2EXCAL_ESCALATION_THRESHOLD", cls.escalation_threshold)),
+            record_dir=os.getenv("HAND2EXCAL_RECORD_DIR", cls.record_dir).strip(),
+            replay_dir=os.getenv("HAND2EXCAL_REPLAY_DIR", cls.replay_dir).strip(),
+            replay_any=_env_bool("HAND2EXCAL_REPLAY_ANY", cls.replay_any),
+            replay_speed=_env_float("HAND2EXCAL_REPLAY_SPEED", cls.replay_speed),
+            inference_workers=_env_int("HAND2EXCAL_INFERENCE_WORKERS", cls.inference_workers),
+            inference_timeout=_env_float("HAND2EXCAL_INFERENCE_TIMEOUT", cls.inference_timeout),
+            http_connect_timeout=_env_float("HAND2EXCAL_HTTP_CONNECT_TIMEOUT", cls.http_connect_timeout),
+            http_max_connections=_env_int("HAND2EXCAL_HTTP_MAX_CONNECTIONS", cls.http_max_connections),
+            http_max_connections_per_host=_env_int(
+                "HAND2EXCAL_HTTP_MAX_CONNECTIONS_PER_HOST", cls.http_max_connections_per_host
+            ),
+            http_keepalive_expiry=_env_float("HAND2EXCAL_HTTP_KEEPALIVE_EXPIRY", cls.http_keepalive_expiry),
+            upstream_max_concurrent=_env_int(
+                "HAND2EXCAL_UPSTREAM_MAX_CONCURRENT", cls.upstream_max_concurrent, minimum=0
+            ),
+            upstream_max_queue=_env_int("HAND2EXCAL_UPSTREAM_MAX_QUEUE", cls.upstream_max_queue, minimum=0),
+            upstream_queue_timeout=_env_float("HAND2EXCAL_UPSTREAM_QUEUE_TIMEOUT", cls.upstream_queue_timeout),
+            upstream_retry_budget=_env_float("HAND2EXCAL_UPSTREAM_RETRY_BUDGET", cls.upstream_retry_budget),
+            cache_max_entries=_env_int("HAND2EXCAL_CACHE_MAX_ENTRIES", cls.cache_max_entries, minimum=0),
+            cache_ttl=_env_float("HAND2EXCAL_CACHE_TTL", cls.cache_ttl),
+            cache_dir=os.getenv("HAND2EXCAL_CACHE_DIR", _default_cache_dir()),
+            cache_disk_max_mb=_env_int("HAND2EXCAL_CACHE_DISK_MAX_MB", cls.cache_disk_max_mb, minimum=0),
+            max_continuations=_env_int("HAND2EXCAL_MAX_CONTINUATIONS", cls.max_continuations, minimum=0),
+            compact_output=_env_bool("HAND2EXCAL_COMPACT_OUTPUT", cls.compact_output),
+            deterministic_builds=_env_bool("HAND2EXCAL_DETERMINISTIC_BUILDS", cls.deterministic_builds),
+            max_upload_mb=_env_int("HAND2EXCAL_MAX_UPLOAD_MB", cls.max_upload_mb),
+            job_workers=_env_int("HAND2EXCAL_JOB_WORKERS", cls.job_workers),
+            job_max_items=_env_int("HAND2EXCAL_JOB_MAX_ITEMS", cls.job_max_items),
+            job_max_queued_items=_env_int("HAND2EXCAL_JOB_MAX_QUEUED_ITEMS", cls.job_max_queued_items),
+            job_ttl=_env_float("HAND2EXCAL_JOB_TTL", cls.job_ttl),
+            job_max_upload_mb=_env_int("HAND2EXCAL_JOB_MAX_UPLOAD_MB", cls.job_max_upload_mb),
+            preprocess_workers=_env_int("HAND2EXCAL_PREPROCESS_WORKERS", cls.preprocess_workers, minimum=0),
+            preprocess_max_concurrent=_env_int(
+                "HAND2EXCAL_PREPROCESS_MAX_CONCURRENT", cls.preprocess_max_concurrent
+            ),
+            preprocess_max_tasks_per_child=_env_int(
+                "HAND2EXCAL_PREPROCESS_MAX_TASKS_PER_CHILD", cls.preprocess_max_tasks_per_child
+            ),
+            preprocess_crop=_env_bool("HAND2EXCAL_PREPROCESS_CROP", cls.preprocess_crop),
+            preprocess_min_dim=_env_int("HAND2EXCAL_PREPROCESS_MIN_DIM", cls.preprocess_min_dim),
+            preprocess_grayscale=_env_bool("HAND2EXCAL_PREPROCESS_GRAYSCALE", cls.preprocess_grayscale),
+            profile_rate=min(1.0, _env_float("HAND2EXCAL_PROFILE", cls.profile_rate)),
+            profile_token=os.getenv("HAND2EXCAL_PROFILE_TOKEN", cls.profile_token),
+            profile_dir=os.getenv("HAND2EXCAL_PROFILE_DIR", cls.profile_dir),
+            profile_interval_ms=max(1.0, _env_float("HAND2EXCAL_PROFILE_INTERVAL_MS", cls.profile_interval_ms)),
+            profile_max_files=_env_int("HAND2EXCAL_PROFILE_MAX_FILES", cls.profile_max_files),
+        )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide settings, loaded once from the environment."""
+    return Settings.from_env()
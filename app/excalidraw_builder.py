@@ -3,21 +3,19 @@ Excalidraw JSON builder: Converts structured flowchart data
 (nodes + arrows) into a valid .excalidraw JSON file.
 """
 
-import json
+import base64
+import hashlib
 import math
 import random
-import string
 import time
+from dataclasses import dataclass
 
+from .geometry import arrow_endpoints, scaled_centres
+from .layout import LAYER_GAP, layered_layout, node_size
+from .metrics import stage
+from .serialize import dumps
 
-def _generate_id() -> str:
-    """Generate a unique Excalidraw element ID."""
-    return "".join(random.choices(string.ascii_letters + string.digits, k=20))
-
-
-def _seed() -> int:
-    """Generate a random seed for Excalidraw rendering."""
-    return random.randint(1, 2**31 - 1)
+ARROW_GAP = 8  # visual gap between arrow tip and shape edge
 
 
 def _timestamp() -> int:
@@ -25,6 +23,76 @@ def _timestamp() -> int:
     return int(time.time() * 1000)
 
 
+# `updated` written by deterministic builds
+FIXED_TIMESTAMP = 0
+
+
+# customData key naming the flowchart item an element was built from
+# (e.g. "node:node_3", "arrow:node_1>node_2:label"); survives edits in Excalidraw
+SOURCE_KEY = "hand2excal"
+
+
+def _unique_name(name: str, counts: dict[str, int]) -> str:
+    """Repeated names (duplicate node ids, parallel arrows) get a counter."""
+    count = counts.get(name, 0)
+    counts[name] = count + 1
+    return f"{name}#{count}" if count else name
+
+
+class _BuildContext:
+    """
+    Per-build state shared by every element of one scene: a single
+    `updated` timestamp and the source of element ids and seeds.
+
+    Without a key, ids and seeds come from a private random generator
+    (cheaper than random.choices / random.randint on the global RNG).
+    With a key, they are derived by hashing the key with each element's
+    name, and `updated` is FIXED_TIMESTAMP, so identical input builds
+    byte-identical scenes. Elements named in `previous` keep that
+    element's id and seed (used by update_excalidraw).
+    """
+
+    __slots__ = ("updated", "_rng", "_key", "_names", "_previous")
+
+    def __init__(self, key: str | None = None, previous: dict[str, dict] | None = None):
+        self._key = key
+        self._names: dict[str, int] = {}
+        self._previous = previous or {}
+        if key is None:
+            self.updated = _timestamp()
+            self._rng = random.Random()
+        else:
+            self.updated = FIXED_TIMESTAMP
+            self._rng = None
+
+    def _digest(self, name: str) -> bytes:
+        return hashlib.blake2b(f"{self._key}\0{name}".encode("utf-8"), digest_size=23).digest()
+
+    def identity(self, name: str) -> tuple[str, str, int, int]:
+        """(unique name, id, seed, versionNonce) for the element called `name`."""
+        name = _unique_name(name, self._names)
+        previous = self._previous.get(name)
+        if previous is not None:
+            return name, previous["id"], previous.get("seed", 1), previous.get("versionNonce", 1)
+
+        if self._rng is not None:
+            rng = self._rng
+            element_id = base64.urlsafe_b64encode(rng.getrandbits(120).to_bytes(15, "big")).decode("ascii")
+            return name, element_id, rng.getrandbits(31) or 1, rng.getrandbits(31) or 1
+
+        digest = self._digest(name)
+        element_id = base64.urlsafe_b64encode(digest[:15]).decode("ascii")
+        seed = (int.from_bytes(digest[15:19], "big") >> 1) or 1
+        nonce = (int.from_bytes(digest[19:23], "big") >> 1) or 1
+        return name, element_id, seed, nonce
+
+    def nonce(self, name: str, version: int) -> int:
+        """versionNonce for a new version of an existing element."""
+        if self._rng is not None:
+            return self._rng.getrandbits(31) or 1
+        return (int.from_bytes(self._digest(f"{name}@{version}")[:4], "big") >> 1) or 1
+
+
 # ---------- Color helpers ----------
 
 _COLOR_MAP = {
@@ -60,6 +128,8 @@ def _normalize_color(color: str) -> str:
 # ---------- Element builders ----------
 
 def _base_element(
+    ctx: _BuildContext,
+    name: str,
     element_type: str,
     x: float,
     y: float,
@@ -69,8 +139,9 @@ def _base_element(
     bg_color: str = "transparent",
 ) -> dict:
     """Create a base Excalidraw element with common properties."""
+    name, element_id, seed, nonce = ctx.identity(name)
     return {
-        "id": _generate_id(),
+        "id": element_id,
         "type": element_type,
         "x": x,
         "y": y,
@@ -88,21 +159,24 @@ def _base_element(
         "frameId": None,
         "index": None,
         "roundness": None,
-        "seed": _seed(),
+        "seed": seed,
         "version": 1,
-        "versionNonce": _seed(),
+        "versionNonce": nonce,
         "isDeleted": False,
         "boundElements": [],
-        "updated": _timestamp(),
+        "updated": ctx.updated,
         "link": None,
         "locked": False,
+        "customData": {SOURCE_KEY: name},
     }
 
 
-def _create_shape(node: dict) -> dict:
+def _create_shape(ctx: _BuildContext, node: dict) -> dict:
     """Create a shape element from a node definition."""
     shape_type = node.get("type", "rectangle")
     element = _base_element(
+        ctx,
+        f"node:{node.get('id')}",
         element_type=shape_type,
         x=node.get("x", 0),
         y=node.get("y", 0),
@@ -127,6 +201,8 @@ def _create_shape(node: dict) -> dict:
 
 
 def _create_text(
+    ctx: _BuildContext,
+    name: str,
     text: str,
     x: float,
     y: float,
@@ -138,6 +214,8 @@ def _create_text(
 ) -> dict:
     """Create a text element, optionally bound to a container."""
     element = _base_element(
+        ctx,
+        name,
         element_type="text",
         x=x,
         y=y,
@@ -161,98 +239,24 @@ def _create_text(
     return element
 
 
-def _edge_point(element: dict, dx: float, dy: float) -> tuple[float, float]:
-    """
-    Calculate where a ray from the center of a shape exits its boundary.
-    (dx, dy) is the direction vector pointing outward.
-    Returns the (x, y) point on the shape edge.
-    """
-    cx = element["x"] + element["width"] / 2
-    cy = element["y"] + element["height"] / 2
-    w = element["width"]
-    h = element["height"]
-    shape_type = element["type"]
-
-    if abs(dx) < 1e-9 and abs(dy) < 1e-9:
-        return cx, cy
-
-    if shape_type == "ellipse":
-        # Ellipse: parametric intersection
-        a = w / 2
-        b = h / 2
-        denom = math.sqrt((dx / a) ** 2 + (dy / b) ** 2)
-        if denom < 1e-9:
-            return cx, cy
-        t = 1.0 / denom
-        return cx + dx * t, cy + dy * t
-
-    elif shape_type == "diamond":
-        # Diamond: intersection with 4 diagonal edges
-        a = w / 2
-        b = h / 2
-        # The diamond has vertices at (cx±a, cy) and (cx, cy±b)
-        # Compute intersection with t * (dx, dy) against each edge
-        t = float("inf")
-        if abs(dx) > 1e-9:
-            t = min(t, abs(a / dx) * (1.0 / (abs(dx) / a + abs(dy) / b)))
-        if abs(dy) > 1e-9:
-            t = min(t, abs(b / dy) * (1.0 / (abs(dx) / a + abs(dy) / b)))
-        # Simpler formula: for a diamond, t = 1 / (|dx|/a + |dy|/b)
-        denom = abs(dx) / a + abs(dy) / b
-        if denom < 1e-9:
-            return cx, cy
-        t = 1.0 / denom
-        return cx + dx * t, cy + dy * t
-
-    else:
-        # Rectangle: ray-box intersection
-        t = float("inf")
-        if abs(dx) > 1e-9:
-            t = min(t, (w / 2) / abs(dx))
-        if abs(dy) > 1e-9:
-            t = min(t, (h / 2) / abs(dy))
-        return cx + dx * t, cy + dy * t
-
-
 def _create_arrow(
+    ctx: _BuildContext,
+    name: str,
     from_element: dict,
     to_element: dict,
     label: str = "",
     stroke_color: str = "#1e1e1e",
+    endpoints: tuple[float, float, float, float] | None = None,
 ) -> tuple[dict, dict | None]:
     """
     Create an arrow element connecting two shapes.
-    Calculates proper edge intersection points so arrows never go through shapes.
+    Calculates proper edge intersection points so arrows never go through shapes;
+    pass `endpoints` (from geometry.arrow_endpoints) when they were computed in bulk.
     Returns (arrow_element, optional_label_text_element).
     """
-    GAP = 8  # visual gap between arrow tip and shape edge
-
-    # Direction vector from source center to target center
-    from_cx = from_element["x"] + from_element["width"] / 2
-    from_cy = from_element["y"] + from_element["height"] / 2
-    to_cx = to_element["x"] + to_element["width"] / 2
-    to_cy = to_element["y"] + to_element["height"] / 2
-
-    dx = to_cx - from_cx
-    dy = to_cy - from_cy
-    length = math.sqrt(dx * dx + dy * dy)
-    if length < 1e-9:
-        dx, dy = 0, 1
-        length = 1
-
-    # Normalize direction
-    ndx = dx / length
-    ndy = dy / length
-
-    # Find where the line exits each shape boundary
-    start_x, start_y = _edge_point(from_element, dx, dy)
-    end_x, end_y = _edge_point(to_element, -dx, -dy)
-
-    # Add gap offset (push start outward, push end outward)
-    start_x += ndx * GAP
-    start_y += ndy * GAP
-    end_x -= ndx * GAP
-    end_y -= ndy * GAP
+    if endpoints is None:
+        endpoints = arrow_endpoints([from_element, to_element], [(0, 1)], ARROW_GAP)[0]
+    start_x, start_y, end_x, end_y = endpoints
 
     # Arrow points are relative to arrow's x, y position
     arrow_x = start_x
@@ -261,6 +265,8 @@ def _create_arrow(
     rel_end_y = end_y - start_y
 
     arrow = _base_element(
+        ctx,
+        name,
         element_type="arrow",
         x=arrow_x,
         y=arrow_y,
@@ -278,13 +284,13 @@ def _create_arrow(
     arrow["startBinding"] = {
         "elementId": from_element["id"],
         "focus": 0,
-        "gap": GAP,
+        "gap": ARROW_GAP,
         "fixedPoint": None,
     }
     arrow["endBinding"] = {
         "elementId": to_element["id"],
         "focus": 0,
-        "gap": GAP,
+        "gap": ARROW_GAP,
         "fixedPoint": None,
     }
 
@@ -295,6 +301,8 @@ def _create_arrow(
         mid_y = arrow_y + rel_end_y / 2
         label_width = max(len(label) * 9, 40)
         label_element = _create_text(
+            ctx,
+            f"{name}:label",
             text=label.strip(),
             x=mid_x - label_width / 2,
             y=mid_y - 10,
@@ -309,99 +317,190 @@ def _create_arrow(
     return arrow, label_element
 
 
-def _enforce_spacing(flowchart_data: dict, min_gap: int = 100) -> dict:
+def _grid_key(x: float, y: float, cell: float) -> tuple[int, int]:
+    return math.floor(x / cell), math.floor(y / cell)
+
+
+def _neighbour_pairs(cxs: list[float], cys: list[float], cell: float) -> list[tuple[int, int]]:
+    """
+    Index pairs (i < j) of nodes whose centres fall in the same or adjacent
+    cells of a uniform grid. With `cell` at least the largest required
+    centre distance, every pair close enough to conflict is included.
+    """
+    grid: dict[tuple[int, int], list[int]] = {}
+    cells = []
+    for i in range(len(cxs)):
+        key = _grid_key(cxs[i], cys[i], cell)
+        cells.append(key)
+        grid.setdefault(key, []).append(i)
+
+    pairs = []
+    for i, (gx, gy) in enumerate(cells):
+        for ox in (-1, 0, 1):
+            for oy in (-1, 0, 1):
+                for j in grid.get((gx + ox, gy + oy), ()):
+                    if j > i:
+                        pairs.append((i, j))
+    pairs.sort()
+    return pairs
+
+
+def _relax(cxs: list[float], cys: list[float], hws: list[float], hhs: list[float], cell: float, min_gap: float) -> int:
+    """
+    One pass pushing each conflicting nearby pair apart symmetrically
+    along its dominant axis. Works on centres and half-sizes in place;
+    returns the number of conflicts found.
+    """
+    conflicts = 0
+    for i, j in _neighbour_pairs(cxs, cys, cell):
+        dx = cxs[j] - cxs[i]
+        dy = cys[j] - cys[i]
+
+        # Required minimum distance on each axis
+        min_dx = hws[i] + hws[j] + min_gap
+        min_dy = hhs[i] + hhs[j] + min_gap
+        if abs(dx) >= min_dx or abs(dy) >= min_dy:
+            continue
+        conflicts += 1
+        if abs(dx) < 1 and abs(dy) < 1:
+            dy = 1
+
+        # Push along the dominant axis
+        if abs(dy) >= abs(dx):
+            push = (min_dy - abs(dy)) / 2 + 5
+            sign = 1 if dy >= 0 else -1
+            cys[j] += push * sign
+            cys[i] -= push * sign
+        else:
+            push = (min_dx - abs(dx)) / 2 + 5
+            sign = 1 if dx >= 0 else -1
+            cxs[j] += push * sign
+            cxs[i] -= push * sign
+    return conflicts
+
+
+def _settle(
+    cxs: list[float],
+    cys: list[float],
+    hws: list[float],
+    hhs: list[float],
+    cell: float,
+    min_gap: float,
+    fixed: frozenset[int] = frozenset(),
+) -> None:
+    """
+    Remove every remaining conflict in one sweep: place nodes top to
+    bottom, moving each one right or down (never back) until it clears
+    the nodes already placed. Placed nodes, and those in `fixed`, never
+    move again.
+    """
+    grid: dict[tuple[int, int], list[int]] = {}
+    for i in fixed:
+        grid.setdefault(_grid_key(cxs[i], cys[i], cell), []).append(i)
+    movable = [i for i in range(len(cxs)) if i not in fixed]
+    for i in sorted(movable, key=lambda i: (cys[i], cxs[i])):
+        while True:
+            gx, gy = _grid_key(cxs[i], cys[i], cell)
+            shift_x = shift_y = 0.0
+            for ox in (-1, 0, 1):
+                for oy in (-1, 0, 1):
+                    for j in grid.get((gx + ox, gy + oy), ()):
+                        dx = cxs[i] - cxs[j]
+                        dy = cys[i] - cys[j]
+                        min_dx = hws[i] + hws[j] + min_gap
+                        min_dy = hhs[i] + hhs[j] + min_gap
+                        if abs(dx) >= min_dx or abs(dy) >= min_dy:
+                            continue
+                        if abs(dx) > abs(dy) and dx > 0:
+                            shift_x = max(shift_x, min_dx - dx + 5)
+                        else:
+                            shift_y = max(shift_y, min_dy - dy + 5)
+            if not shift_x and not shift_y:
+                break
+            # One move per round, the larger one (fewer rounds), then re-check
+            if shift_x and (not shift_y or shift_x >= shift_y):
+                cxs[i] += shift_x
+            else:
+                cys[i] += shift_y
+        grid.setdefault(_grid_key(cxs[i], cys[i], cell), []).append(i)
+
+
+def _enforce_spacing(flowchart_data: dict, min_gap: int = 100, max_iterations: int = 50) -> dict:
     """
     Post-process node positions:
     1. Scale all positions by 2x to spread nodes out
-    2. Enforce minimum gap between all node pairs
+    2. Push apart nodes closer than min_gap, testing only nearby pairs
+       (uniform grid), until no conflicts remain or progress stalls
+    3. Sweep away whatever conflicts relaxation left behind
     """
     nodes = flowchart_data.get("nodes", [])
     if len(nodes) < 2:
         return flowchart_data
 
     # --- Step 1: Scale positions by 2x from the centroid ---
-    cx = sum(n["x"] + n["width"] / 2 for n in nodes) / len(nodes)
-    cy = sum(n["y"] + n["height"] / 2 for n in nodes) / len(nodes)
-    scale = 2.0
-    for n in nodes:
-        ncx = n["x"] + n["width"] / 2
-        ncy = n["y"] + n["height"] / 2
-        new_cx = cx + (ncx - cx) * scale
-        new_cy = cy + (ncy - cy) * scale
-        n["x"] = new_cx - n["width"] / 2
-        n["y"] = new_cy - n["height"] / 2
+    cxs, cys = scaled_centres(nodes, 2.0)
+    hws = [n["width"] / 2 for n in nodes]
+    hhs = [n["height"] / 2 for n in nodes]
 
     # --- Step 2: Push overlapping nodes apart ---
-    for _ in range(15):
-        moved = False
-        for i in range(len(nodes)):
-            for j in range(i + 1, len(nodes)):
-                a = nodes[i]
-                b = nodes[j]
-
-                a_cx = a["x"] + a["width"] / 2
-                a_cy = a["y"] + a["height"] / 2
-                b_cx = b["x"] + b["width"] / 2
-                b_cy = b["y"] + b["height"] / 2
-
-                dx = b_cx - a_cx
-                dy = b_cy - a_cy
-
-                # Required minimum distance on each axis
-                min_dx = (a["width"] + b["width"]) / 2 + min_gap
-                min_dy = (a["height"] + b["height"]) / 2 + min_gap
-
-                # Check if overlapping in both axes
-                if abs(dx) < min_dx and abs(dy) < min_dy:
-                    if abs(dx) < 1 and abs(dy) < 1:
-                        dy = 1
-
-                    # Push along the dominant axis
-                    if abs(dy) >= abs(dx):
-                        needed = min_dy
-                        shortfall = needed - abs(dy)
-                        if shortfall > 0:
-                            push = shortfall / 2 + 5
-                            sign = 1 if dy >= 0 else -1
-                            b["y"] += push * sign
-                            a["y"] -= push * sign
-                            moved = True
-                    else:
-                        needed = min_dx
-                        shortfall = needed - abs(dx)
-                        if shortfall > 0:
-                            push = shortfall / 2 + 5
-                            sign = 1 if dx >= 0 else -1
-                            b["x"] += push * sign
-                            a["x"] -= push * sign
-                            moved = True
-
-        if not moved:
+    # Two nodes conflict only if their centres are closer than this on both axes
+    cell = 2 * max(max(hws), max(hhs)) + min_gap
+    conflicts = previous = None
+    for _ in range(max_iterations):
+        conflicts = _relax(cxs, cys, hws, hhs, cell, min_gap)
+        # Stop when clean, or when a pass no longer removes a tenth of the conflicts
+        if conflicts == 0 or (previous is not None and conflicts > previous * 0.9):
             break
+        previous = conflicts
+
+    # --- Step 3: Guarantee no overlaps are left ---
+    if conflicts:
+        _settle(cxs, cys, hws, hhs, cell, min_gap)
+
+    for n, ncx, ncy in zip(nodes, cxs, cys):
+        n["x"] = ncx - n["width"] / 2
+        n["y"] = ncy - n["height"] / 2
 
     flowchart_data["nodes"] = nodes
     return flowchart_data
 
 
-def build_excalidraw(flowchart_data: dict) -> dict:
+def build_excalidraw(flowchart_data: dict, key: str | None = None) -> dict:
     """
     Build a complete Excalidraw JSON structure from flowchart data.
 
     Args:
         flowchart_data: dict with 'nodes' and 'arrows' as returned by vision module.
+            With "layout": "layered", node positions and sizes are computed
+            by app.layout instead of taken from the data.
+        key: identifies the input (e.g. the extraction cache key). When given,
+            element ids, seeds and timestamps are derived from it and from
+            node/arrow ids, so the same input always builds the same bytes.
+            When None, ids and seeds are random.
 
     Returns:
         Complete Excalidraw JSON dict ready to be saved as .excalidraw file.
     """
-    # Enforce minimum spacing between nodes
-    flowchart_data = _enforce_spacing(flowchart_data)
+    with stage("layout"):
+        if flowchart_data.get("layout") == "layered":
+            # Topology-only input: compute the geometry locally
+            flowchart_data = layered_layout(flowchart_data)
+        else:
+            # Enforce minimum spacing between nodes
+            flowchart_data = _enforce_spacing(flowchart_data)
+
+    with stage("build"):
+        return _scene(_build_elements(flowchart_data, _BuildContext(key)))
 
+
+def _build_elements(flowchart_data: dict, ctx: _BuildContext) -> list[dict]:
+    """Shapes, labels and arrows for flowchart data whose nodes are already placed."""
     elements = []
     node_id_to_element = {}  # maps our node id → excalidraw element
 
     # --- 1. Create shape elements for each node ---
     for node in flowchart_data.get("nodes", []):
-        shape = _create_shape(node)
+        shape = _create_shape(ctx, node)
         node_id_to_element[node["id"]] = shape
 
         # Create bound text label
@@ -415,6 +514,8 @@ def build_excalidraw(flowchart_data: dict) -> dict:
             text_height = len(lines) * font_size * 1.25
 
             text_el = _create_text(
+                ctx,
+                f"node:{node['id']}:label",
                 text=label_text,
                 x=shape["x"] + (shape["width"] - text_width) / 2,
                 y=shape["y"] + (shape["height"] - text_height) / 2,
@@ -433,18 +534,31 @@ def build_excalidraw(flowchart_data: dict) -> dict:
             elements.append(shape)
 
     # --- 2. Create arrow elements ---
+    shapes = list(node_id_to_element.values())
+    shape_index = {element["id"]: i for i, element in enumerate(shapes)}
+    connections = []
+    links = []
     for arrow_def in flowchart_data.get("arrows", []):
         from_el = node_id_to_element.get(arrow_def.get("from_id"))
         to_el = node_id_to_element.get(arrow_def.get("to_id"))
 
         if not from_el or not to_el:
             continue  # skip arrows with invalid references
+        connections.append((arrow_def, from_el, to_el))
+        links.append((shape_index[from_el["id"]], shape_index[to_el["id"]]))
+
+    # Edge intersections for all arrows in one batch
+    all_endpoints = arrow_endpoints(shapes, links, ARROW_GAP)
 
+    for (arrow_def, from_el, to_el), endpoints in zip(connections, all_endpoints):
         arrow_el, label_el = _create_arrow(
+            ctx,
+            f"arrow:{arrow_def['from_id']}>{arrow_def['to_id']}",
             from_element=from_el,
             to_element=to_el,
             label=arrow_def.get("label", ""),
             stroke_color=arrow_def.get("strokeColor", "#1e1e1e"),
+            endpoints=endpoints,
         )
 
         # Register arrow as bound element on the connected shapes
@@ -455,22 +569,199 @@ def build_excalidraw(flowchart_data: dict) -> dict:
         if label_el:
             elements.append(label_el)
 
-    # --- 3. Assemble the .excalidraw structure ---
+    return elements
+
+
+def _scene(elements: list[dict], app_state: dict | None = None, files: dict | None = None) -> dict:
+    """Assemble the .excalidraw structure."""
     return {
         "type": "excalidraw",
         "version": 2,
         "source": "https://excalidraw.com",
         "elements": elements,
-        "appState": {
+        "appState": app_state if app_state is not None else {
             "gridSize": 20,
             "gridStep": 5,
             "gridModeEnabled": False,
             "viewBackgroundColor": "#ffffff",
         },
-        "files": {},
+        "files": files if files is not None else {},
     }
 
 
-def build_excalidraw_json(flowchart_data: dict) -> str:
-    """Build Excalidraw JSON and return as formatted string."""
-    return json.dumps(build_excalidraw(flowchart_data), indent=2)
+@dataclass
+class SceneUpdate:
+    """Result of update_excalidraw: the patched scene and the elements it re-emitted."""
+    scene: dict
+    changed: list[dict]
+
+
+# Fields that differ between builds of the same element without a content change
+_VOLATILE_FIELDS = frozenset({"version", "versionNonce", "updated", "index"})
+
+
+def _place_nodes(flowchart_data: dict, previous: dict[str, dict], min_gap: int = 100) -> dict:
+    """
+    Position the nodes of an edited flowchart against a previous scene.
+    Nodes that already have a shape keep its position and size (including
+    any moves made in Excalidraw); new nodes go below the nodes they are
+    connected to (or below the scene) and are then pushed clear of
+    everything else. Only the new nodes ever move.
+    """
+    nodes = [dict(node) for node in flowchart_data.get("nodes", [])]
+    flowchart_data = {**flowchart_data, "nodes": nodes}
+    layered = flowchart_data.pop("layout", None) == "layered"
+
+    counts: dict[str, int] = {}
+    placed = []
+    for node in nodes:
+        shape = previous.get(_unique_name(f"node:{node.get('id')}", counts))
+        if shape is None or shape.get("isDeleted"):
+            placed.append(False)
+            if layered or "width" not in node or "height" not in node:
+                node["width"], node["height"] = node_size(node)
+            continue
+        placed.append(True)
+        for field in ("x", "y", "width", "height"):
+            node[field] = shape[field]
+
+    if not any(placed):
+        # Nothing to anchor to: lay the whole flowchart out from scratch
+        if layered:
+            return layered_layout({**flowchart_data, "layout": "layered"})
+        return _enforce_spacing(flowchart_data, min_gap=min_gap)
+    if all(placed):
+        return flowchart_data
+
+    index = {node.get("id"): i for i, node in enumerate(nodes)}
+    neighbours: dict[int, list[int]] = {}
+    for arrow in flowchart_data.get("arrows", []):
+        a = index.get(arrow.get("from_id"))
+        b = index.get(arrow.get("to_id"))
+        if a is not None and b is not None:
+            neighbours.setdefault(a, []).append(b)
+            neighbours.setdefault(b, []).append(a)
+
+    # New nodes' own x/y are overwritten below
+    cxs = [n.get("x", 0) + n["width"] / 2 for n in nodes]
+    cys = [n.get("y", 0) + n["height"] / 2 for n in nodes]
+    hws = [n["width"] / 2 for n in nodes]
+    hhs = [n["height"] / 2 for n in nodes]
+    fixed = frozenset(i for i, done in enumerate(placed) if done)
+    left = min(cxs[i] - hws[i] for i in fixed)
+    bottom = max(cys[i] + hhs[i] for i in fixed)
+
+    # New nodes in flowchart order, so chains of new nodes hang off each other
+    for i, done in enumerate(placed):
+        if done:
+            continue
+        anchors = [j for j in neighbours.get(i, ()) if placed[j]]
+        if anchors:
+            cxs[i] = sum(cxs[j] for j in anchors) / len(anchors)
+            cys[i] = max(cys[j] + hhs[j] for j in anchors) + LAYER_GAP + hhs[i]
+        else:
+            cxs[i] = left + hws[i]
+            cys[i] = bottom + LAYER_GAP + hhs[i]
+        placed[i] = True
+
+    cell = 2 * max(max(hws), max(hhs)) + min_gap
+    _settle(cxs, cys, hws, hhs, cell, min_gap, fixed=fixed)
+
+    for i, node in enumerate(nodes):
+        if i not in fixed:
+            node["x"] = cxs[i] - hws[i]
+            node["y"] = cys[i] - hhs[i]
+    return flowchart_data
+
+
+def update_excalidraw(previous: dict, flowchart_data: dict, key: str | None = None) -> SceneUpdate:
+    """
+    Patch a scene built by build_excalidraw to match an edited flowchart.
+
+    Elements are matched to nodes and arrows by the name stored in their
+    customData, so ids survive the round trip through Excalidraw. Existing
+    nodes keep their current position and size; only new nodes are laid
+    out. Unchanged elements are carried over as they are, changed ones get
+    a bumped `version` and a new `versionNonce`, and elements whose node or
+    arrow is gone are marked deleted. Elements the user added in Excalidraw
+    are kept untouched, as are the scene's appState and files.
+
+    Args:
+        previous: the .excalidraw scene to patch.
+        flowchart_data: the edited flowchart, as accepted by build_excalidraw.
+        key: as for build_excalidraw; only affects elements that are new.
+
+    Returns:
+        SceneUpdate with the full patched scene and the list of changed elements.
+    """
+    ours: dict[str, dict] = {}
+    foreign = []
+    for element in previous.get("elements", []):
+        name = (element.get("customData") or {}).get(SOURCE_KEY)
+        if name is None:
+            foreign.append(element)
+        else:
+            ours[name] = element
+
+    ctx = _BuildContext(key, previous=ours)
+    with stage("layout"):
+        placed = _place_nodes(flowchart_data, ours)
+    with stage("build"):
+        built = _build_elements(placed, ctx)
+    foreign_ids = {element.get("id") for element in foreign}
+
+    elements = []
+    changed = []
+    seen = set()
+    for element in built:
+        name = element["customData"][SOURCE_KEY]
+        seen.add(name)
+        old = ours.get(name)
+        if old is None:
+            elements.append(element)
+            changed.append(element)
+            continue
+
+        # Keep bindings to elements drawn by the user (e.g. their own arrows)
+        for bound in old.get("boundElements") or ():
+            if bound.get("id") in foreign_ids:
+                element["boundElements"].append(bound)
+
+        if all(value == old.get(field) for field, value in element.items() if field not in _VOLATILE_FIELDS):
+            elements.append(old)
+            continue
+        version = old.get("version", 1) + 1
+        element = {
+            **old,
+            **element,
+            "index": old.get("index"),
+            "version": version,
+            "versionNonce": ctx.nonce(name, version),
+        }
+        elements.append(element)
+        changed.append(element)
+
+    elements.extend(foreign)
+
+    for name, old in ours.items():
+        if name in seen:
+            continue
+        if not old.get("isDeleted"):
+            version = old.get("version", 1) + 1
+            old = {
+                **old,
+                "isDeleted": True,
+                "version": version,
+                "versionNonce": ctx.nonce(name, version),
+                "updated": ctx.updated,
+            }
+            changed.append(old)
+        elements.append(old)
+
+    scene = _scene(elements, app_state=previous.get("appState"), files=previous.get("files"))
+    return SceneUpdate(scene=scene, changed=changed)
+
+
+def build_excalidraw_json(flowchart_data: dict, pretty: bool = True, key: str | None = None) -> str:
+    """Build Excalidraw JSON and return it as an indented (or compact) string."""
+    return dumps(build_excalidraw(flowchart_data, key=key), pretty=pretty)
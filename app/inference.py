@@ -0,0 +1,178 @@
+"""
+Inference client manager: Owns the pooled HTTP transport, the API token
+and the worker pool used for model calls, so they are set up once per
+process instead of once per request.
+"""
+
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from huggingface_hub import InferenceClient
+
+from .config import Settings, get_settings
+
+log = logging.getLogger("hand2excal")
+
+
+def _hub_http_module(hub_http):
+    """
+    The httpx-like module whose Client huggingface_hub's default factory
+    returns, or None if it cannot be told (the hook is then left alone).
+    """
+    factory = getattr(hub_http, "default_client_factory", None)
+    if factory is None:
+        return None
+    client = factory()
+    try:
+        module = sys.modules.get(type(client).__module__.split(".")[0])
+    finally:
+        client.close()
+    if module is None or not all(hasattr(module, name) for name in ("Client", "Limits", "Timeout")):
+        return None
+    return module
+
+
+def _install_pooled_transport(settings: Settings) -> bool:
+    """
+    Point huggingface_hub at a keep-alive connection pool sized from settings.
+    Returns False when the installed huggingface_hub exposes no hook for it.
+    """
+    # huggingface_hub >= 1.0 talks to the API through a shared client from
+    # httpx (1.x) or its httpx2 fork (2.x); build the type the hub builds
+    try:
+        from huggingface_hub import set_client_factory
+        from huggingface_hub.utils import _http as hub_http
+    except ImportError:
+        pass
+    else:
+        http = _hub_http_module(hub_http)
+        if http is None:
+            return False
+        limits = http.Limits(
+            max_connections=settings.http_max_connections,
+            # The HTTP client has no per-host cap; model calls go to one host,
+            # so the per-host value bounds the connections kept open for it
+            max_keepalive_connections=min(settings.http_max_connections, settings.http_max_connections_per_host),
+            keepalive_expiry=settings.http_keepalive_expiry,
+        )
+        timeout = http.Timeout(settings.inference_timeout, connect=settings.http_connect_timeout)
+        # Keep the hub's own request hook (auth and user-agent headers)
+        hook = getattr(hub_http, "hf_request_event_hook", None)
+        event_hooks = {"request": [hook]} if hook is not None else None
+        set_client_factory(
+            lambda: http.Client(limits=limits, timeout=timeout, follow_redirects=True, event_hooks=event_hooks)
+        )
+        return True
+
+    # Older releases use a requests.Session per thread
+    try:
+        import requests
+        from huggingface_hub import configure_http_backend
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return False
+
+    def session_factory() -> "requests.Session":
+        session = requests.Session()
+        # pool_connections is how many per-host pools are cached, pool_maxsize
+        # the connections each of them keeps
+        adapter = HTTPAdapter(
+            pool_connections=settings.http_max_connections,
+            pool_maxsize=settings.http_max_connections_per_host,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    configure_http_backend(backend_factory=session_factory)
+    return True
+
+
+def _close_pooled_transport() -> None:
+    """Drop pooled connections held by huggingface_hub, if supported."""
+    try:
+        from huggingface_hub import close_session
+    except ImportError:
+        return
+    close_session()
+
+
+class InferenceClientManager:
+    """
+    Process-wide owner of everything a model call needs.
+
+    Clients handed out by `client()` are cheap wrappers around the shared
+    connection pool, so TLS sessions stay warm across requests.
+    """
+
+    def __init__(self, settings: Settings | None = None):
+        self.settings = settings or get_settings()
+        self._token: str | None = None
+        self._api_key: str | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Read credentials and set up the connection pool (idempotent)."""
+        with self._lock:
+            if self._started:
+                return
+            self._token = os.getenv("HF_API_TOKEN")
+            self._api_key = os.getenv("HAND2EXCAL_INFERENCE_API_KEY")
+            if not _install_pooled_transport(self.settings):
+                log.warning("⚠️  huggingface_hub has no transport hook; using its default session")
+            self._started = True
+
+    def client(self, base_url: str | None = None) -> InferenceClient:
+        """
+        Return an inference client bound to the shared connection pool: for
+        the Hugging Face API, or for the OpenAI-compatible server at base_url.
+        """
+        self.start()
+        if base_url:
+            return InferenceClient(
+                base_url=base_url,
+                token=self._api_key or None,
+                timeout=self.settings.inference_timeout,
+            )
+        if not self._token:
+            raise ValueError("HF_API_TOKEN not set. Copy .env.example to .env and add your token.")
+        return InferenceClient(token=self._token, timeout=self.settings.inference_timeout)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Bounded pool that runs blocking model calls for the async path."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.settings.inference_workers,
+                    thread_name_prefix="hand2excal-inference",
+                )
+            return self._executor
+
+    def close(self) -> None:
+        """Wait for in-flight calls, then release pooled connections."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._started:
+                _close_pooled_transport()
+                self._started = False
+
+
+_manager: InferenceClientManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager() -> InferenceClientManager:
+    """Return the process-wide client manager, creating it on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = InferenceClientManager()
+        return _manager
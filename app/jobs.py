@@ -0,0 +1,516 @@
+"""
+Batch jobs: Accepts many images or texts in one request, converts them
+in the background with a bounded number of concurrent conversions, and
+keeps the results until the client has collected them.
+
+Only the server process that accepted a job runs it. Every state change
+is also written to an SQLite file next to the result cache (`cache_dir`),
+so any worker behind the same load balancer can report a job's progress,
+serve its results and cancel it. With HAND2EXCAL_CACHE_DIR empty, jobs
+live only in the accepting process, and multi-worker deployments need
+sticky routing by job id. Jobs expire `job_ttl` seconds after they finish.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import secrets
+import sqlite3
+import time
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .admission import OverloadedError
+from .config import Settings, get_settings
+from .excalidraw_builder import build_excalidraw
+from .serialize import dumps
+from .uploads import discard_upload
+from .vision import Extraction, run_image_extraction_async, run_text_extraction_async
+
+log = logging.getLogger("hand2excal")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """Raised when accepting a job would exceed the scheduler's queue bound."""
+
+
+class _ItemCancelled(Exception):
+    """The job was cancelled while its item waited for an upstream slot."""
+
+
+@dataclass
+class JobItem:
+    """One image or text of a job."""
+
+    index: int
+    kind: str  # "image" or "text"
+    name: str
+    # Upload (bytes or spooled path) or text; dropped once the item finishes
+    payload: bytes | Path | str | None
+    content_type: str = "image/jpeg"
+    status: str = QUEUED
+    error: str | None = None
+    extraction: Extraction | None = None
+    scene: dict | None = None
+    ms: float = 0.0
+
+    @property
+    def filename(self) -> str:
+        """Name of this item's result in a bulk download."""
+        stem = Path(self.name).stem if self.kind == "image" else "text"
+        return f"{self.index:04d}-{stem}.excalidraw"
+
+    def release(self) -> None:
+        if self.kind == "image" and self.payload is not None:
+            discard_upload(self.payload)
+        self.payload = None
+
+    def to_dict(self) -> dict:
+        item = {"index": self.index, "kind": self.kind, "name": self.name, "status": self.status}
+        if self.error is not None:
+            item["error"] = self.error
+        if self.extraction is not None:
+            item["nodes_count"] = len(self.extraction.flowchart.get("nodes", []))
+            item["arrows_count"] = len(self.extraction.flowchart.get("arrows", []))
+            item["cache_hit"] = self.extraction.cache_hit
+            item["truncated"] = self.extraction.truncated
+        if self.status in (DONE, FAILED):
+            item["ms"] = round(self.ms, 1)
+        return item
+
+
+@dataclass
+class Job:
+    """A submitted batch and the state of each of its items."""
+
+    id: str
+    items: list[JobItem]
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    # Set once the job is cancelled; items waiting for an upstream slot give up
+    cancel_requested: bool = False
+
+    @property
+    def status(self) -> str:
+        if self.finished is not None:
+            return CANCELLED if any(item.status == CANCELLED for item in self.items) else DONE
+        if any(item.status != QUEUED for item in self.items):
+            return RUNNING
+        return QUEUED
+
+    def to_dict(self, include_items: bool = True) -> dict:
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for item in self.items:
+            counts[item.status] += 1
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "total": len(self.items),
+            "counts": counts,
+        }
+        if include_items:
+            job["items"] = [item.to_dict() for item in self.items]
+        return job
+
+    def results_zip(self) -> bytes:
+        """Every finished scene as <index>-<name>.excalidraw, plus job.json with the item states."""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for item in self.items:
+                if item.scene is not None:
+                    archive.writestr(item.filename, dumps(item.scene, pretty=True))
+            archive.writestr("job.json", dumps(self.to_dict(), pretty=True))
+        return buffer.getvalue()
+
+
+class JobStore:
+    """
+    SQLite copy of every job's state and finished results, shared by all
+    server workers. One short-lived connection per operation, as in
+    cache.DiskCache.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    created REAL NOT NULL,
+                    finished REAL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    ms REAL NOT NULL DEFAULT 0,
+                    flowchart TEXT,
+                    cache_hit INTEGER NOT NULL DEFAULT 0,
+                    truncated INTEGER NOT NULL DEFAULT 0,
+                    key TEXT NOT NULL DEFAULT '',
+                    scene TEXT,
+                    PRIMARY KEY (job_id, idx)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    def add(self, job: Job) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.execute("INSERT INTO jobs (id, created, finished) VALUES (?, ?, ?)", (job.id, job.created, job.finished))
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, kind, name, status) VALUES (?, ?, ?, ?, ?)",
+                [(job.id, item.index, item.kind, item.name, item.status) for item in job.items],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def update(self, job: Job, items: list[JobItem]) -> None:
+        """Write the given items' state and results, and the job's finish time."""
+        rows = []
+        for item in items:
+            extraction = item.extraction
+            rows.append((
+                item.status,
+                item.error,
+                item.ms,
+                json.dumps(extraction.flowchart, separators=(",", ":")) if extraction is not None else None,
+                int(extraction.cache_hit) if extraction is not None else 0,
+                int(extraction.truncated) if extraction is not None else 0,
+                extraction.key if extraction is not None else "",
+                dumps(item.scene) if item.scene is not None else None,
+                job.id,
+                item.index,
+            ))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE job_items SET status = ?, error = ?, ms = ?, flowchart = ?, cache_hit = ?,"
+                " truncated = ?, key = ?, scene = ? WHERE job_id = ? AND idx = ?",
+                rows,
+            )
+            conn.execute("UPDATE jobs SET finished = ? WHERE id = ?", (job.finished, job.id))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def load(self, job_id: str, scenes: bool = False) -> Job | None:
+        """The job as last saved; scenes are only read when asked for."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT created, finished FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                "SELECT idx, kind, name, status, error, ms, flowchart, cache_hit, truncated, key, "
+                f"{'scene' if scenes else 'NULL'} FROM job_items WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        items = []
+        for index, kind, name, status, error, ms, flowchart, cache_hit, truncated, key, scene in rows:
+            item = JobItem(index, kind, name, None, status=status, error=error, ms=ms)
+            if flowchart is not None:
+                item.extraction = Extraction(
+                    json.loads(flowchart), cache_hit=bool(cache_hit), truncated=bool(truncated), key=key
+                )
+            if scene is not None:
+                item.scene = json.loads(scene)
+            items.append(item)
+        return Job(id=job_id, items=items, created=row[0], finished=row[1])
+
+    def request_cancel(self, job_id: str) -> bool:
+        """
+        Flag the job for its owner to cancel and mark its queued items
+        cancelled right away. False if the job is unknown.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            if not conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,)).rowcount:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "UPDATE job_items SET status = ? WHERE job_id = ? AND status = ?", (CANCELLED, job_id, QUEUED)
+            )
+            (pending,) = conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status IN (?, ?)", (job_id, QUEUED, RUNNING)
+            ).fetchone()
+            if not pending:
+                conn.execute("UPDATE jobs SET finished = COALESCE(finished, ?) WHERE id = ?", (time.time(), job_id))
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return bool(row and row[0])
+
+    def prune(self, cutoff: float) -> int:
+        """Delete jobs that finished before `cutoff`; returns how many."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.execute(
+                "DELETE FROM job_items WHERE job_id IN (SELECT id FROM jobs WHERE finished < ?)", (cutoff,)
+            )
+            removed = conn.execute("DELETE FROM jobs WHERE finished < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+            return removed
+        finally:
+            conn.close()
+
+
+def open_job_store(settings: Settings | None = None) -> JobStore | None:
+    """Open the shared job store in cache_dir, or None if no cache_dir is set."""
+    settings = settings or get_settings()
+    if not settings.cache_dir:
+        return None
+    return JobStore(Path(settings.cache_dir).expanduser() / "jobs.sqlite3")
+
+
+class JobManager:
+    """
+    Job scheduler plus the jobs this process accepted. A fixed set of
+    worker tasks take items off one FIFO queue, so at most `job_workers`
+    conversions run at once across all jobs and items are served in
+    submission order. Jobs accepted by other workers are read from (and
+    cancelled through) the shared JobStore.
+    """
+
+    def __init__(self, settings: Settings | None = None, store: JobStore | None = None):
+        self.settings = settings or get_settings()
+        self.store = store if store is not None else open_job_store(self.settings)
+        self.jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._queued_items = 0
+
+    def _ensure_workers(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"hand2excal-job-{i}")
+            for i in range(self.settings.job_workers)
+        ]
+
+    async def _save(self, job: Job, items: list[JobItem]) -> None:
+        """Mirror the items' state to the shared store; failures are logged, not raised."""
+        if self.store is None or not items:
+            return
+        try:
+            await asyncio.to_thread(self.store.update, job, items)
+        except sqlite3.Error as e:
+            log.warning(f"⚠️  Could not save job {job.id}: {e}")
+
+    async def close(self) -> None:
+        """Stop the workers, record unfinished items as cancelled and drop pending uploads."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        for job in self.jobs.values():
+            stopped = [item for item in job.items if item.status in (QUEUED, RUNNING)]
+            for item in stopped:
+                item.status = CANCELLED
+                item.error = "Server shut down"
+                item.release()
+            self._check_finished(job)
+            await self._save(job, stopped)
+
+    async def _prune(self) -> None:
+        """Forget jobs that finished more than job_ttl seconds ago."""
+        cutoff = time.time() - self.settings.job_ttl
+        for job_id in [j.id for j in self.jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self.jobs[job_id]
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.prune, cutoff)
+            except sqlite3.Error as e:
+                log.warning(f"⚠️  Could not prune jobs: {e}")
+
+    async def submit(self, items: list[JobItem]) -> Job:
+        """Queue a new job. Raises QueueFullError when over the queue bound."""
+        await self._prune()
+        if self._queued_items + len(items) > self.settings.job_max_queued_items:
+            raise QueueFullError(
+                f"Too many queued items ({self._queued_items}); try again later."
+            )
+        job = Job(id=secrets.token_urlsafe(12), items=items)
+        if self.store is not None:
+            # Saved before it runs, so other workers can answer for it at once
+            try:
+                await asyncio.to_thread(self.store.add, job)
+            except sqlite3.Error as e:
+                log.warning(f"⚠️  Could not save job {job.id}, only this worker will know it: {e}")
+        self._ensure_workers()
+        self.jobs[job.id] = job
+        self._queued_items += len(items)
+        for item in items:
+            self._queue.put_nowait((job, item))
+        log.info(f"🗃️  Job {job.id}: queued {len(items)} items")
+        return job
+
+    @property
+    def queued_items(self) -> int:
+        """Items of this process's jobs still waiting for a worker."""
+        return self._queued_items
+
+    async def _cancel_requested(self, job: Job) -> bool:
+        """True if another worker asked to cancel this process's job."""
+        if self.store is None or job.finished is not None:
+            return False
+        try:
+            return await asyncio.to_thread(self.store.cancel_requested, job.id)
+        except sqlite3.Error as e:
+            log.warning(f"⚠️  Could not read job {job.id}: {e}")
+            return False
+
+    async def get(self, job_id: str, scenes: bool = False) -> Job | None:
+        """
+        The job, from memory if this process runs it, else from the shared
+        store (finished scenes are only loaded with scenes=True).
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if await self._cancel_requested(job):
+                await self._cancel_local(job)
+            return job
+        if self.store is None:
+            return None
+        return await asyncio.to_thread(self.store.load, job_id, scenes)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        """Cancel the job's queued items; running ones finish, unless still waiting for an upstream slot."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            await self._cancel_local(job)
+            return job
+        # Another worker runs it: flag it there and report the stored state
+        if self.store is None or not await asyncio.to_thread(self.store.request_cancel, job_id):
+            return None
+        return await asyncio.to_thread(self.store.load, job_id)
+
+    async def _cancel_local(self, job: Job) -> None:
+        job.cancel_requested = True
+        cancelled = []
+        for item in job.items:
+            if item.status == QUEUED:
+                item.status = CANCELLED
+                item.release()
+                self._queued_items -= 1
+                cancelled.append(item)
+        self._check_finished(job)
+        await self._save(job, cancelled)
+
+    def _check_finished(self, job: Job) -> None:
+        if job.finished is None and all(item.status in (DONE, FAILED, CANCELLED) for item in job.items):
+            job.finished = time.time()
+            log.info(f"🗃️  Job {job.id}: {job.status}")
+
+    async def _worker(self) -> None:
+        while True:
+            job, item = await self._queue.get()
+            try:
+                if item.status == QUEUED and await self._cancel_requested(job):
+                    await self._cancel_local(job)
+                if item.status != QUEUED:
+                    continue  # cancelled while waiting
+                self._queued_items -= 1
+                await self._run_item(job, item)
+            finally:
+                self._queue.task_done()
+
+    async def _run_item(self, job: Job, item: JobItem) -> None:
+        item.status = RUNNING
+        await self._save(job, [item])
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.settings.upstream_retry_budget
+        try:
+            while True:
+                try:
+                    if item.kind == "image":
+                        extraction = await run_image_extraction_async(item.payload, item.content_type)
+                    else:
+                        extraction = await run_text_extraction_async(item.payload)
+                    break
+                except OverloadedError as e:
+                    # Background work can wait its turn instead of failing, within a budget
+                    wait = min(e.retry_after, deadline - time.monotonic())
+                    if wait <= 0:
+                        raise OverloadedError(
+                            f"Upstream still busy after {self.settings.upstream_retry_budget:g}s of retries",
+                            e.retry_after,
+                        ) from e
+                    await asyncio.sleep(wait)
+                    if await self._cancel_requested(job):
+                        await self._cancel_local(job)
+                    if job.cancel_requested:
+                        raise _ItemCancelled()
+            key = extraction.key if self.settings.deterministic_builds else None
+            # Layout of large charts is CPU-bound; keep it off the event loop
+            item.scene = await asyncio.to_thread(build_excalidraw, extraction.flowchart, key=key)
+            item.extraction = extraction
+            item.status = DONE
+        except _ItemCancelled:
+            item.status = CANCELLED
+        except Exception as e:
+            item.error = str(e)
+            item.status = FAILED
+        finally:
+            item.ms = (time.perf_counter() - started) * 1000
+            item.release()
+        self._check_finished(job)
+        await self._save(job, [item])
+
+
+_manager: JobManager | None = None
+
+
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager, creating it on first use."""
+    global _manager
+    if _manager is None:
+        _manager = JobManager()
+    return _manager
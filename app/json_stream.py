@@ -0,0 +1,147 @@
+"""
+Streaming JSON scanner: Picks complete node and arrow objects out of a
+model response while it is still being generated, and recovers
+everything usable when the response is cut off.
+"""
+
+import json
+
+
+class FlowchartStreamParser:
+    """
+    Single-pass incremental scanner for `{"nodes": [...], "arrows": [...]}`
+    output.
+
+    Feed it text chunks as they arrive; each call returns the node/arrow
+    objects that closed within that chunk, as ("node" | "arrow", dict).
+    Text around the JSON (prose, markdown fences) is ignored, and a
+    brace-delimited span that turns out not to be JSON is skipped. Objects
+    already returned are not returned again when a later span repeats
+    them (nodes by id, arrows by content).
+    Call `result()` at the end to get the full object, or, if the output
+    was truncated, every node and arrow that was completed.
+    """
+
+    _SECTIONS = {"nodes": "node", "arrows": "arrow"}
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._reset_scan()
+        # Every complete node/arrow seen so far, used to salvage truncated output
+        self.nodes: list[dict] = []
+        self.arrows: list[dict] = []
+        self._seen: set[str] = set()
+        self._root: dict | None = None
+
+    def _reset_scan(self) -> None:
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._root_start = 0
+        self._last_key: str | None = None
+        self._section: str | None = None
+        self._item_start: int | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        self._text += chunk
+        items = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            if self._root is not None:
+                break
+            char = text[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start + 1:pos]
+                continue
+
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._root_start = pos
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in "{[":
+                if self._depth == 1 and char == "[":
+                    self._section = self._SECTIONS.get(self._last_key)
+                elif self._depth == 2 and char == "{" and self._section:
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 2 and char == "}" and self._item_start is not None:
+                    item = self._decode(text[self._item_start:pos + 1])
+                    if item is not None and self._is_new(self._section, item):
+                        (self.nodes if self._section == "node" else self.arrows).append(item)
+                        items.append((self._section, item))
+                    self._item_start = None
+                elif self._depth == 1 and char == "]":
+                    self._section = None
+                elif self._depth == 0:
+                    self._close_root(text[self._root_start:pos + 1])
+
+        self._pos = len(text)
+        return items
+
+    def finish(self) -> list[tuple[str, dict]]:
+        """Called when the response finished normally; JSON needs no flush."""
+        return []
+
+    def _close_root(self, fragment: str) -> None:
+        root = self._decode(fragment)
+        if root is not None:
+            self._root = root
+        else:
+            # Not valid JSON as a whole (braces in prose, a trailing comma):
+            # keep any objects salvaged from it and look for a later one
+            self._reset_scan()
+
+    def _is_new(self, kind: str, item: dict) -> bool:
+        """False for a node id or arrow already returned, e.g. from a span that failed to decode."""
+        node_id = item.get("id") if kind == "node" else None
+        key = f"node:{node_id}" if isinstance(node_id, str) else f"{kind}:{json.dumps(item, sort_keys=True)}"
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    @staticmethod
+    def _decode(fragment: str) -> dict | None:
+        try:
+            item = json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._text
+
+    @property
+    def complete(self) -> bool:
+        """True once a full top-level JSON object has been parsed."""
+        return self._root is not None
+
+    def result(self) -> dict:
+        """
+        The parsed object, or the nodes/arrows salvaged from a truncated
+        response. Raises ValueError if nothing usable was found.
+        """
+        if self._root is not None:
+            return self._root
+        if self.nodes:
+            return {"nodes": list(self.nodes), "arrows": list(self.arrows)}
+        raise ValueError(f"Could not extract valid JSON from model response:\n{self._text[:500]}")
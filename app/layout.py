@@ -0,0 +1,276 @@
+"""
+Layered auto-layout: Computes node geometry for flowcharts whose model
+output carries topology only (ids, types, labels, edges and optional
+row/column hints), Sugiyama style:
+
+1. break cycles, 2. assign nodes to layers, 3. insert dummy nodes on
+long edges, 4. order each layer to reduce crossings (barycenter sweeps),
+5. assign coordinates (isotonic regression under spacing constraints).
+
+The result is deterministic for a given input.
+"""
+
+from collections import defaultdict
+
+LAYER_GAP = 110  # vertical space between layers
+NODE_GAP = 80  # horizontal space between neighbours in a layer
+DUMMY_WIDTH = 20
+MARGIN = 50
+ORDER_SWEEPS = 8
+POSITION_SWEEPS = 6
+
+
+def node_size(node: dict) -> tuple[float, float]:
+    """Estimate a box that fits the label, matching the builder's text metrics."""
+    lines = (node.get("label") or "").split("\n")
+    longest = max(len(line) for line in lines)
+    width = min(max(longest * 9 + 40, 120), 320)
+    height = 60 + 20 * (len(lines) - 1)
+    if node.get("type") == "diamond":
+        return width * 1.5, height * 1.6
+    if node.get("type") == "ellipse":
+        return width * 1.25, height * 1.2
+    return width, height
+
+
+def _break_cycles(ids: list[str], edges: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Reverse DFS back edges so the graph becomes acyclic."""
+    succ = defaultdict(list)
+    for a, b in edges:
+        succ[a].append(b)
+    state = {}  # 1 = on stack, 2 = done
+    back = set()
+    for root in ids:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(succ[root]))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node] = 2
+                stack.pop()
+            elif state.get(child) == 1:
+                back.add((node, child))
+            elif child not in state:
+                state[child] = 1
+                stack.append((child, iter(succ[child])))
+    return [(b, a) if (a, b) in back else (a, b) for a, b in edges]
+
+
+def _assign_layers(ids: list[str], edges: list[tuple[str, str]], hints: dict[str, int]) -> dict[str, int]:
+    """
+    Use the model's row hints when every node has one, otherwise
+    longest-path layering from the sources.
+    """
+    if hints and len(hints) == len(ids):
+        rows = sorted(set(hints.values()))
+        dense = {row: i for i, row in enumerate(rows)}
+        return {node_id: dense[hints[node_id]] for node_id in ids}
+
+    preds = defaultdict(list)
+    indegree = {node_id: 0 for node_id in ids}
+    succ = defaultdict(list)
+    for a, b in edges:
+        if a == b:
+            continue
+        succ[a].append(b)
+        preds[b].append(a)
+        indegree[b] += 1
+
+    layer = {}
+    queue = [node_id for node_id in ids if indegree[node_id] == 0]
+    while queue:
+        node_id = queue.pop(0)
+        layer[node_id] = max((layer[p] + 1 for p in preds[node_id]), default=0)
+        for child in succ[node_id]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    return layer
+
+
+def _count_crossings(upper_pos: dict, lower_pos: dict, edges: list[tuple[str, str]]) -> int:
+    """Crossings between two adjacent layers, as inversions (merge sort)."""
+    pairs = sorted((upper_pos[a], lower_pos[b]) for a, b in edges)
+    seq = [lower for _, lower in pairs]
+
+    def sort_count(items):
+        if len(items) < 2:
+            return items, 0
+        mid = len(items) // 2
+        left, cl = sort_count(items[:mid])
+        right, cr = sort_count(items[mid:])
+        merged, count, i, j = [], cl + cr, 0, 0
+        while i < len(left) and j < len(right):
+            if right[j] < left[i]:
+                merged.append(right[j])
+                count += len(left) - i
+                j += 1
+            else:
+                merged.append(left[i])
+                i += 1
+        merged.extend(left[i:])
+        merged.extend(right[j:])
+        return merged, count
+
+    return sort_count(seq)[1]
+
+
+def _isotonic_positions(desired: list[float], widths: list[float]) -> list[float]:
+    """
+    Centres as close as possible (least squares) to `desired` while keeping
+    neighbours at least half-width + gap + half-width apart, via
+    pool-adjacent-violators on the offset-shifted targets.
+    """
+    offsets = [0.0]
+    for i in range(1, len(widths)):
+        offsets.append(offsets[-1] + (widths[i - 1] + widths[i]) / 2 + NODE_GAP)
+    targets = [d - o for d, o in zip(desired, offsets)]
+
+    blocks = []  # [mean, size]
+    for value in targets:
+        blocks.append([value, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            mean, size = blocks.pop()
+            prev = blocks[-1]
+            prev[0] = (prev[0] * prev[1] + mean * size) / (prev[1] + size)
+            prev[1] += size
+
+    fitted = []
+    for mean, size in blocks:
+        fitted.extend([mean] * size)
+    return [f + o for f, o in zip(fitted, offsets)]
+
+
+def layered_layout(flowchart_data: dict) -> dict:
+    """
+    Compute x, y, width and height for every node in place.
+    Nodes may carry `row` / `col` hints; arrows reference node ids.
+    """
+    nodes = flowchart_data.get("nodes", [])
+    if not nodes:
+        return flowchart_data
+    by_id = {node["id"]: node for node in nodes}
+    ids = list(by_id)
+    edges = [
+        (a["from_id"], a["to_id"])
+        for a in flowchart_data.get("arrows", [])
+        if a.get("from_id") in by_id and a.get("to_id") in by_id and a["from_id"] != a["to_id"]
+    ]
+    sizes = {node_id: node_size(by_id[node_id]) for node_id in ids}
+    row_hints = {n["id"]: int(n["row"]) for n in nodes if isinstance(n.get("row"), (int, float))}
+    col_hints = {n["id"]: float(n["col"]) for n in nodes if isinstance(n.get("col"), (int, float))}
+
+    # 1-2. Acyclic orientation and layering
+    acyclic = _break_cycles(ids, edges)
+    layer = _assign_layers(ids, acyclic, row_hints)
+
+    # 3. Orient edges downwards and split long ones with dummy nodes
+    widths = {node_id: sizes[node_id][0] for node_id in ids}
+    segments = []
+    for a, b in acyclic:
+        if layer[a] == layer[b]:
+            continue  # same-layer edge: drawn straight, ignored for ordering
+        if layer[a] > layer[b]:
+            a, b = b, a
+        prev = a
+        for rank in range(layer[a] + 1, layer[b]):
+            dummy = f"__dummy_{a}_{b}_{rank}"
+            layer[dummy] = rank
+            widths[dummy] = DUMMY_WIDTH
+            segments.append((prev, dummy))
+            prev = dummy
+        segments.append((prev, b))
+
+    depth = max(layer.values()) + 1
+    layers = [[] for _ in range(depth)]
+    # Initial order: column hints, then input order
+    order_key = {node_id: (col_hints.get(node_id, 0.0), i) for i, node_id in enumerate(ids)}
+    for node_id in sorted(layer, key=lambda n: order_key.get(n, (0.0, len(ids)))):
+        layers[layer[node_id]].append(node_id)
+
+    up = defaultdict(list)
+    down = defaultdict(list)
+    for a, b in segments:
+        down[a].append(b)
+        up[b].append(a)
+    layer_edges = defaultdict(list)
+    for a, b in segments:
+        layer_edges[layer[a]].append((a, b))
+
+    # 4. Crossing minimisation: barycenter sweeps, keeping the best order
+    def positions(order):
+        return {node_id: i for i, node_id in enumerate(order)}
+
+    def total_crossings(current):
+        pos = [positions(order) for order in current]
+        return sum(
+            _count_crossings(pos[r], pos[r + 1], layer_edges[r])
+            for r in range(depth - 1)
+        )
+
+    best = [list(order) for order in layers]
+    best_crossings = total_crossings(best)
+    for sweep in range(ORDER_SWEEPS):
+        if best_crossings == 0:
+            break
+        downward = sweep % 2 == 0
+        ranks = range(1, depth) if downward else range(depth - 2, -1, -1)
+        for r in ranks:
+            fixed = positions(layers[r - 1] if downward else layers[r + 1])
+            neighbours = up if downward else down
+            current = positions(layers[r])
+
+            def barycenter(node_id):
+                linked = [fixed[n] for n in neighbours[node_id] if n in fixed]
+                return sum(linked) / len(linked) if linked else current[node_id]
+
+            layers[r].sort(key=lambda n: (barycenter(n), current[n]))
+        crossings = total_crossings(layers)
+        if crossings < best_crossings:
+            best, best_crossings = [list(order) for order in layers], crossings
+    layers = best
+
+    # 5. Coordinates: pack each layer, then pull nodes towards neighbours
+    centre = {}
+    for order in layers:
+        x = 0.0
+        for node_id in order:
+            centre[node_id] = x + widths[node_id] / 2
+            x += widths[node_id] + NODE_GAP
+    for sweep in range(POSITION_SWEEPS):
+        downward = sweep % 2 == 0
+        ranks = range(1, depth) if downward else range(depth - 2, -1, -1)
+        neighbours = up if downward else down
+        for r in ranks:
+            order = layers[r]
+            desired = []
+            for node_id in order:
+                linked = [centre[n] for n in neighbours[node_id]]
+                desired.append(sum(linked) / len(linked) if linked else centre[node_id])
+            for node_id, x in zip(order, _isotonic_positions(desired, [widths[n] for n in order])):
+                centre[node_id] = x
+
+    layer_heights = [
+        max((sizes[n][1] for n in order if n in sizes), default=0) for order in layers
+    ]
+    layer_top = []
+    y = 0.0
+    for height in layer_heights:
+        layer_top.append(y)
+        y += height + LAYER_GAP
+
+    min_left = min(centre[n] - widths[n] / 2 for n in ids)
+    for node_id in ids:
+        width, height = sizes[node_id]
+        rank = layer[node_id]
+        node = by_id[node_id]
+        node["width"] = width
+        node["height"] = height
+        node["x"] = round(MARGIN + centre[node_id] - width / 2 - min_left, 1)
+        # Centre vertically within the layer band
+        node["y"] = round(MARGIN + layer_top[rank] + (layer_heights[rank] - height) / 2, 1)
+
+    return flowchart_data
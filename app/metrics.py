@@ -0,0 +1,243 @@
+"""
+Metrics: Per-stage timers, counters and histograms for the conversion
+pipeline, exported in the Prometheus text format on /metrics and, per
+request, as a Server-Timing header.
+
+A request's stage timings are collected in a context variable, so
+stages timed on the inference thread pool still count toward the
+request that started them.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) shared by every histogram: 1 ms to 2 min
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}{_label_text(self.labels, k)} {v:g}" for k, v in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # labels → [bucket counts..., sum, count]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0.0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip((*BUCKETS, math.inf), (*series[:len(BUCKETS)], series[-1])):
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_label_text((*self.labels, 'le'), (*key, le))} {count:g}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]:g}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Returns a number, or {label values: number} for labelled gauges
+        self._read = read
+
+    def samples(self) -> list[str]:
+        value = self._read()
+        if not isinstance(value, dict):
+            return [f"{self.name} {value:g}"]
+        return [f"{self.name}{_label_text(self.labels, k)} {v:g}" for k, v in sorted(value.items())]
+
+
+_registry: list = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help: str, read, labels: tuple[str, ...] = ()) -> Gauge:
+    """Register a gauge read from `read()` on every scrape."""
+    return _register(Gauge(name, help, read, labels))
+
+
+STAGE_SECONDS = _register(Histogram(
+    "hand2excal_stage_seconds", "Time spent in each pipeline stage.", ("stage",)
+))
+REQUEST_SECONDS = _register(Histogram(
+    "hand2excal_request_seconds", "End-to-end time of API requests.", ("path", "status")
+))
+REQUESTS = _register(Counter(
+    "hand2excal_requests_total", "API requests by path and status code.", ("path", "status")
+))
+EXTRACTIONS = _register(Counter(
+    "hand2excal_extractions_total", "Flowchart extractions by input kind and outcome.", ("kind", "outcome")
+))
+CASCADE = _register(Counter(
+    "hand2excal_cascade_total", "Image extractions by model cascade outcome.", ("outcome",)
+))
+MODEL_CALLS = _register(Counter(
+    "hand2excal_model_calls_total", "Chat completion requests sent upstream.", ("model",)
+))
+MODEL_TOKENS = _register(Counter(
+    "hand2excal_model_tokens_total", "Tokens reported by the model API.", ("model", "type")
+))
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Per-request stage timings ----------
+
+class Timings:
+    """Stage durations (seconds) of one request; repeated stages add up."""
+
+    __slots__ = ("stages", "started")
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, ending with the total so far."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_timings: contextvars.ContextVar[Timings | None] = contextvars.ContextVar("hand2excal_timings", default=None)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Record a stage measured elsewhere (e.g. preprocessing in a worker process)."""
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as pipeline stage `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def record_usage(model: str, usage) -> None:
+    """Count the tokens in a chat completion's `usage` block, if it has one."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None)
+        if count:
+            MODEL_TOKENS.inc(model, kind.removesuffix("_tokens"), amount=count)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every /api request, counts it by path and
+    status, and adds a Server-Timing header with the stages it went
+    through. Streaming responses only carry the stages done before their
+    headers were sent.
+    """
+
+    def __init__(self, app, prefix: str = "/api/"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        token = _timings.set(timings)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("ascii")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "other"
+            elapsed = time.perf_counter() - timings.started
+            REQUESTS.inc(path, str(status))
+            REQUEST_SECONDS.observe(elapsed, path, str(status))
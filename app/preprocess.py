@@ -0,0 +1,336 @@
+"""
+Image preprocessing: Normalizes uploads to a small JPEG for the vision
+model, in a bounded process pool so large decodes neither block request
+handling nor pile up in memory.
+
+Kept free of model/HTTP imports so pool workers start quickly.
+"""
+
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
+from pathlib import Path
+
+from PIL import Image, ImageFilter, ImageOps
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass  # HEIC support optional
+
+from .config import Settings, get_settings
+
+MAX_DIM = 1200
+JPEG_QUALITY = 85
+_EXIF_ORIENTATION = 0x0112
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Ink detection runs on a copy reduced to about this size
+_INK_PROBE_DIM = 400
+# Stroke density (ink pixels / crop area) at which full resolution is kept
+_DENSE_INK = 0.06
+# Closed shapes are counted on a copy reduced to about this size; enclosed
+# regions outside these fractions of it are letters or the page edge
+_SHAPE_PROBE_DIM = 240
+_MIN_SHAPE_AREA = 0.001
+_MAX_SHAPE_AREA = 0.25
+
+
+@dataclass(frozen=True)
+class CropBox:
+    """
+    The region of the upright uploaded image that was sent to the model,
+    in upload pixels. Reported as `metadata.crop` so clients can place the
+    scene over the photo; node coordinates are not mapped through it,
+    since the model lays nodes out on its own canvas, not in image pixels.
+    """
+
+    x: float
+    y: float
+    width: float
+    height: float
+    # Source pixels per pixel of the image sent to the model
+    scale: float
+
+
+@dataclass(frozen=True)
+class PreprocessedImage:
+    jpeg_bytes: bytes
+    crop: CropBox
+
+
+def _is_upright(img: Image.Image) -> bool:
+    """True if the image has no EXIF rotation/flip to apply."""
+    return img.getexif().get(_EXIF_ORIENTATION, 1) == 1
+
+
+def _upright_size(img: Image.Image) -> tuple[int, int]:
+    """Full-resolution size of the image once EXIF orientation is applied."""
+    width, height = img.size
+    if img.getexif().get(_EXIF_ORIENTATION, 1) in _TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def _ink_mask(gray: Image.Image) -> Image.Image:
+    """Pen strokes (255) vs paper (0) in a reduced grayscale image."""
+    probe = ImageOps.autocontrast(gray, cutoff=1)
+    histogram = probe.histogram()
+    total = sum(histogram)
+    mean = sum(level * count for level, count in enumerate(histogram)) / total
+    if mean < 128:
+        # Chalkboard / dark background: treat light strokes as ink
+        probe = ImageOps.invert(probe)
+    return probe.point(lambda v: 255 if v < 128 else 0)
+
+
+def _find_ink(img: Image.Image) -> tuple[tuple[int, int, int, int] | None, float]:
+    """
+    Locate pen strokes on paper or a whiteboard.
+    Returns (bbox in img pixels or None, fraction of the bbox covered by ink).
+    """
+    gray = img.convert("L")
+    factor = max(1, max(gray.size) // _INK_PROBE_DIM)
+    mask = _ink_mask(gray.reduce(factor)).filter(ImageFilter.MedianFilter(3))
+
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None, 0.0
+    inked = mask.crop(bbox).histogram()[255]
+    density = inked / ((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
+    scaled = tuple(min(edge * factor, limit) for edge, limit in zip(bbox, gray.size * 2))
+    return scaled, density
+
+
+def _target_dim(density: float, min_dim: int) -> int:
+    """Pick the output resolution: sparse drawings survive stronger downscaling."""
+    if density >= _DENSE_INK:
+        return MAX_DIM
+    return int(min_dim + (MAX_DIM - min_dim) * density / _DENSE_INK)
+
+
+def _source_bytes(source: bytes | str | os.PathLike) -> bytes:
+    return source if isinstance(source, bytes) else Path(source).read_bytes()
+
+
+def preprocess_image(
+    source: bytes | str | os.PathLike,
+    content_type: str,
+    crop: bool = False,
+    grayscale: bool = False,
+    min_dim: int = 768,
+) -> PreprocessedImage:
+    """
+    Normalize an upload (raw bytes or a file path) into the JPEG sent to
+    the vision model. Paths are decoded straight from disk.
+
+    With `crop`, margins without ink are trimmed and the output size is
+    chosen from stroke density; with `grayscale`, the result is a
+    high-contrast single-channel JPEG. Small upright JPEGs that need none
+    of this are sent as uploaded. The returned CropBox records which part
+    of the upload the model saw.
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    source_width, source_height = _upright_size(img)
+    full_frame = CropBox(0, 0, source_width, source_height, 1.0)
+
+    # Already a small, upright JPEG: send the original bytes untouched,
+    # unless cropping below finds margins to trim or a smaller size
+    passthrough = (
+        not grayscale
+        and img.format == "JPEG"
+        and img.mode in ("RGB", "L")
+        and max(img.size) <= MAX_DIM
+        and _is_upright(img)
+    )
+    if passthrough and not crop:
+        return PreprocessedImage(_source_bytes(source), full_frame)
+
+    # Let the decoder downscale while decoding (JPEG DCT scaling decodes a
+    # 12 MP photo at 1/2-1/8 size); a no-op for formats without support
+    img.draft("RGB", (MAX_DIM, MAX_DIM))
+    target = MAX_DIM
+    left = top = 0.0
+    region_width = source_width
+
+    if crop:
+        # Find ink on the draft-sized image, before the final resize, so
+        # small drawings on big pages keep their detail
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        draft_scale = source_width / img.width
+        bbox, density = _find_ink(img)
+        if bbox is not None:
+            pad = int(0.04 * max(img.size)) + 8
+            x0, y0 = max(0, bbox[0] - pad), max(0, bbox[1] - pad)
+            x1, y1 = min(img.width, bbox[2] + pad), min(img.height, bbox[3] + pad)
+            # Not worth trimming a sliver of margin
+            if (x1 - x0) * (y1 - y0) < 0.9 * img.width * img.height:
+                img = img.crop((x0, y0, x1, y1))
+                left, top = x0 * draft_scale, y0 * draft_scale
+                region_width = img.width * draft_scale
+                passthrough = False
+            target = _target_dim(density, min_dim)
+        if passthrough and max(img.size) <= target:
+            return PreprocessedImage(_source_bytes(source), full_frame)
+
+    if max(img.size) > target:
+        img.thumbnail((target, target), Image.LANCZOS)
+
+    # Rotate phone photos upright after shrinking, when it is cheap
+    # (no-op if cropping already did it)
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("RGB")
+    scale = region_width / img.width
+
+    if grayscale:
+        img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+    return PreprocessedImage(
+        buf.getvalue(),
+        CropBox(left, top, img.width * scale, img.height * scale, scale),
+    )
+
+
+def count_closed_shapes(jpeg_bytes: bytes) -> int:
+    """
+    Estimate how many shapes a drawing has from the paper regions fully
+    enclosed by ink: each box, ellipse or diamond outline encloses one,
+    holes in letters are too small to count. (Arrows join the shapes into
+    one blob of ink, so counting ink components would not work.)
+    """
+    img = Image.open(io.BytesIO(jpeg_bytes))
+    img.draft("L", (_SHAPE_PROBE_DIM * 4, _SHAPE_PROBE_DIM * 4))
+    gray = img.convert("L")
+    # Threshold before shrinking so thin strokes survive: a block of the
+    # probe is ink if a quarter of its pixels are
+    factor = max(1, -(-max(gray.size) // _SHAPE_PROBE_DIM))
+    mask = _ink_mask(gray).reduce(factor).point(lambda v: 255 if v >= 64 else 0)
+    # Thicken the strokes so small gaps in hand-drawn outlines close
+    mask = mask.filter(ImageFilter.MaxFilter(3))
+
+    width, height = mask.size
+    visited = bytearray(mask.tobytes())
+    min_area = _MIN_SHAPE_AREA * width * height
+    max_area = _MAX_SHAPE_AREA * width * height
+    shapes = 0
+    for start in range(width * height):
+        if visited[start]:
+            continue
+        visited[start] = 1
+        stack = [start]
+        area = 0
+        enclosed = True
+        while stack:
+            p = stack.pop()
+            area += 1
+            y, x = divmod(p, width)
+            if x == 0 or y == 0 or x == width - 1 or y == height - 1:
+                enclosed = False
+            for q, inside in ((p - 1, x > 0), (p + 1, x < width - 1), (p - width, y > 0), (p + width, y < height - 1)):
+                if inside and not visited[q]:
+                    visited[q] = 1
+                    stack.append(q)
+        if enclosed and min_area <= area <= max_area:
+            shapes += 1
+    return shapes
+
+
+def ensure_jpeg(image_bytes: bytes, content_type: str) -> tuple[bytes, str]:
+    """Resize and convert images to JPEG for the API (keeps payload small)."""
+    return preprocess_image(image_bytes, content_type).jpeg_bytes, "image/jpeg"
+
+
+class PreprocessPool:
+    """
+    Runs preprocess_image in worker processes, with cropping and
+    grayscale options taken from settings.
+
+    A semaphore caps how many decodes may be submitted at once, so peak
+    memory is bounded by `max_concurrent` images rather than by traffic.
+    Workers are recycled after `max_tasks_per_child` images to hand
+    fragmented heap back to the OS. With zero workers, decoding runs
+    inline in the calling thread (handy for the CLI).
+    """
+
+    def __init__(self, settings: Settings | None = None):
+        self.settings = settings or get_settings()
+        self._slots = threading.BoundedSemaphore(self.settings.preprocess_max_concurrent)
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                kwargs = {}
+                # Worker recycling needs Python 3.11; on 3.10 workers live as long as the pool
+                if sys.version_info >= (3, 11):
+                    kwargs["max_tasks_per_child"] = self.settings.preprocess_max_tasks_per_child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.settings.preprocess_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    **kwargs,
+                )
+            return self._executor
+
+    def run(self, source: bytes | str | os.PathLike, content_type: str) -> tuple[PreprocessedImage, float]:
+        """
+        Normalize an image; returns (result, elapsed_ms) including queueing.
+        Passing a path avoids copying the upload into the worker process.
+        """
+        if isinstance(source, os.PathLike):
+            source = os.fspath(source)
+        task = partial(
+            preprocess_image,
+            source,
+            content_type,
+            crop=self.settings.preprocess_crop,
+            grayscale=self.settings.preprocess_grayscale,
+            min_dim=self.settings.preprocess_min_dim,
+        )
+        start = time.perf_counter()
+        with self._slots:
+            if self.settings.preprocess_workers == 0:
+                result = task()
+            else:
+                result = self._get_executor().submit(task).result()
+        return result, (time.perf_counter() - start) * 1000
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+_pool: PreprocessPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool() -> PreprocessPool:
+    """Return the process-wide preprocessing pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PreprocessPool()
+        return _pool
+
+
+def use_inline_preprocessing() -> None:
+    """
+    Decode in the calling thread from now on. A single conversion (the
+    CLI's) gains nothing from worker processes but pays their startup.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = PreprocessPool(replace(get_settings(), preprocess_workers=0))
@@ -0,0 +1,264 @@
+"""
+Request profiling: An opt-in sampling profiler for single conversions.
+
+While a profile is active, a background thread samples the Python stack
+of the threads doing the work every few milliseconds (via
+sys._current_frames) and, when the request ends, writes the samples in
+collapsed-stack format ("frame;frame;frame count" per line), which
+flamegraph.pl, speedscope and inferno read directly.
+
+Profiling is enabled per request by HAND2EXCAL_PROFILE (a fraction of
+all conversions) or by sending `X-Hand2Excal-Profile: <token>` when
+HAND2EXCAL_PROFILE_TOKEN is set, and for the CLI by --profile. Images
+decoded in the preprocess process pool are not sampled; set
+HAND2EXCAL_PREPROCESS_WORKERS=0 to see decoding in the profile.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from .config import Settings, get_settings
+
+log = logging.getLogger("hand2excal")
+
+PROFILE_HEADER = "x-hand2excal-profile"
+
+# Profiles sampled at the same time, at most; further requests run unprofiled
+MAX_ACTIVE = 4
+# Deepest stack recorded per sample
+MAX_DEPTH = 128
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profile:
+    """
+    Samples the stacks of registered threads (or of every thread but its
+    own with `all_threads`) until stopped.
+    """
+
+    def __init__(self, interval: float, all_threads: bool = False):
+        self.interval = interval
+        self.all_threads = all_threads
+        self.samples: Counter[str] = Counter()
+        self.started = 0.0
+        self.elapsed = 0.0
+        self._threads: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def add_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def remove_thread(self, ident: int) -> None:
+        with self._lock:
+            count = self._threads.get(ident, 0) - 1
+            if count > 0:
+                self._threads[ident] = count
+            else:
+                self._threads.pop(ident, None)
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="hand2excal-profiler", daemon=True)
+        self._sampler.start()
+
+    def request_stop(self) -> None:
+        """Stop sampling after the current sample, without waiting for it."""
+        if not self._stop.is_set():
+            self.elapsed = time.perf_counter() - self.started
+            self._stop.set()
+
+    def stop(self) -> None:
+        self.request_stop()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.all_threads:
+                idents = [ident for ident in frames if ident != own]
+            else:
+                with self._lock:
+                    idents = list(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def write(self, path: Path) -> None:
+        """Write the samples as collapsed stacks, most frequent first."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp, path)
+
+
+_active: contextvars.ContextVar[Profile | None] = contextvars.ContextVar("hand2excal_profile", default=None)
+_active_count = 0
+_count_lock = threading.Lock()
+
+
+def traced(func, *args):
+    """Call func(*args), sampling the calling thread if the current context is being profiled."""
+    profile = _active.get()
+    if profile is None:
+        return func(*args)
+    ident = threading.get_ident()
+    profile.add_thread(ident)
+    try:
+        return func(*args)
+    finally:
+        profile.remove_thread(ident)
+
+
+def _profile_dir(settings: Settings) -> Path:
+    return Path(settings.profile_dir or os.path.join(settings.cache_dir, "profiles")).expanduser()
+
+
+def _enforce_retention(directory: Path, max_files: int) -> None:
+    """Delete the oldest profiles beyond max_files."""
+    files = sorted(directory.glob("*.collapsed"), key=lambda p: p.stat().st_mtime)
+    for old in files[:max(0, len(files) - max_files)]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+
+
+def should_profile(header: str | None, settings: Settings | None = None) -> bool:
+    """Whether a request (with this profiling header value, if any) is profiled."""
+    settings = settings or get_settings()
+    if header and settings.profile_token and secrets.compare_digest(header, settings.profile_token):
+        return True
+    return settings.profile_rate > 0 and random.random() < settings.profile_rate
+
+
+class ProfileSession:
+    """
+    Context manager that profiles the block and writes `<label>` profile
+    on exit. Does nothing when MAX_ACTIVE profiles are already running.
+    `path` is known on entry (None when not profiling). Use `async with`
+    on the event loop so the profile is written from a worker thread.
+    """
+
+    def __init__(self, label: str, all_threads: bool = False, settings: Settings | None = None):
+        self.settings = settings or get_settings()
+        self.label = label
+        self.all_threads = all_threads
+        self.path: Path | None = None
+        self._profile: Profile | None = None
+        self._token = None
+
+    def __enter__(self) -> "ProfileSession":
+        global _active_count
+        with _count_lock:
+            if _active_count >= MAX_ACTIVE:
+                log.warning("⚠️  Profiler busy; running this request unprofiled")
+                return self
+            _active_count += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = _profile_dir(self.settings) / f"{stamp}-{self.label}-{secrets.token_hex(4)}.collapsed"
+        self._profile = Profile(self.settings.profile_interval_ms / 1000, all_threads=self.all_threads)
+        self._token = _active.set(self._profile)
+        self._profile.add_thread(threading.get_ident())
+        self._profile.start()
+        return self
+
+    def _detach(self) -> bool:
+        """
+        Stop sampling and attributing threads to this profile; must run in
+        the context __enter__ ran in. False when nothing was profiled.
+        """
+        if self._profile is None:
+            return False
+        self._profile.request_stop()
+        _active.reset(self._token)
+        return True
+
+    def _finish(self) -> None:
+        """Join the sampler and write the profile (blocking file I/O)."""
+        global _active_count
+        self._profile.stop()
+        with _count_lock:
+            _active_count -= 1
+        try:
+            self._profile.write(self.path)
+            _enforce_retention(self.path.parent, self.settings.profile_max_files)
+        except OSError as e:
+            log.error(f"❌ Could not write profile {self.path}: {e}")
+            return
+        total = sum(self._profile.samples.values())
+        log.info(f"🔬 Profile: {self.path} ({total} samples over {self._profile.elapsed:.2f}s)")
+
+    def __exit__(self, *exc) -> None:
+        if self._detach():
+            self._finish()
+
+    async def __aenter__(self) -> "ProfileSession":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc) -> None:
+        # Keep the sampler join and the disk writes off the event loop
+        if self._detach():
+            await asyncio.to_thread(self._finish)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests to the given paths when
+    should_profile says so, and names the profile file in the response's
+    X-Hand2Excal-Profile header. The event loop thread is sampled for
+    the whole request, so profiles of concurrent requests overlap there.
+    """
+
+    def __init__(self, app, paths: tuple[str, ...]):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        header = headers.get(PROFILE_HEADER.encode("ascii"))
+        if not should_profile(header.decode("latin-1") if header else None):
+            await self.app(scope, receive, send)
+            return
+
+        label = scope["path"].strip("/").replace("/", "_")
+        async with ProfileSession(label) as session:
+            async def profiled_send(message):
+                if message["type"] == "http.response.start" and session.path is not None:
+                    message = {
+                        **message,
+                        "headers": [*message.get("headers", []), (b"x-hand2excal-profile", session.path.name.encode())],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, profiled_send)
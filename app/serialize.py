@@ -0,0 +1,28 @@
+"""
+JSON encoding: Uses orjson when it is installed
+(`pip install hand2excal[fast]`) and falls back to the standard library.
+Compact output has no whitespace; pretty output is indented by 2.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjson optional
+
+
+def dumps_bytes(obj, pretty: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    return dumps(obj, pretty).encode("utf-8")
+
+
+def dumps(obj, pretty: bool = False) -> str:
+    """Serialize to a JSON string."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0).decode("utf-8")
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
@@ -2,27 +2,79 @@
 FastAPI server: Serves the frontend and provides the /api/convert endpoint.
 """
 
-import json
+import asyncio
+import hashlib
 import logging
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from functools import partial
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Request, Response, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
+
+from .vision import (
+    Extraction,
+    run_image_extraction_async,
+    run_text_extraction_async,
+    stream_image_extraction_async,
+    stream_text_extraction_async,
+    validate_flowchart,
+)
+from .admission import OverloadedError, get_admission_controller
+from .backends import get_backend
+from .inference import get_client_manager
+from .jobs import FAILED, JobItem, QueueFullError, get_job_manager
+from .metrics import MetricsMiddleware, gauge, render as render_metrics, stage
+from .profiling import ProfilingMiddleware
+from .preprocess import get_preprocess_pool
+from .excalidraw_builder import build_excalidraw, update_excalidraw
+from .config import get_settings
+from .serialize import dumps, dumps_bytes
+from .uploads import MULTIPART_OVERHEAD, UploadLimitMiddleware, discard_upload, spool_upload
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    manager = get_client_manager()
+    manager.start()
+    # Fail at startup, not on the first request, if the backend is misconfigured
+    get_backend()
+    yield
+    await get_job_manager().close()
+    # Let in-flight model calls finish before the worker exits
+    manager.close()
+    get_preprocess_pool().close()
 
-from .vision import extract_flowchart_from_bytes, extract_flowchart_from_text
-from .excalidraw_builder import build_excalidraw
 
 app = FastAPI(
     title="Hand2Excal",
     description="Convert handwritten flowcharts to Excalidraw files",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(message)s", datefmt="%H:%M:%S")
 log = logging.getLogger("hand2excal")
 
+# Refuse oversized uploads before their bodies are buffered. Registered first so
+# it is the innermost middleware: CORS headers and metrics also cover its 413s
+MAX_UPLOAD_BYTES = get_settings().max_upload_mb * 1024 * 1024
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_body_size=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    paths=("/api/convert", "/api/convert/stream"),
+)
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_body_size=get_settings().job_max_upload_mb * 1024 * 1024 + MULTIPART_OVERHEAD,
+    paths=("/api/jobs",),
+)
+
 # CORS for Vite dev server
 app.add_middleware(
     CORSMiddleware,
@@ -32,64 +84,187 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in sampling profiles of whole conversions (HAND2EXCAL_PROFILE*); for the
+# streaming endpoints the profile covers the request until the last event is sent
+app.add_middleware(
+    ProfilingMiddleware,
+    paths=("/api/convert", "/api/convert-text", "/api/convert/stream", "/api/convert-text/stream"),
+)
 
-@app.post("/api/convert")
-async def convert_image(file: UploadFile = File(...)):
-    """
-    Upload a handwritten flowchart image, returns Excalidraw JSON.
-    """
-    # Validate file type
-    allowed_types = {
-        "image/jpeg", "image/png", "image/webp",
-        "image/gif", "image/bmp", "image/heic",
-    }
+# Per-request timing, counters and the Server-Timing header
+app.add_middleware(MetricsMiddleware)
+
+gauge(
+    "hand2excal_upstream_calls",
+    "Model calls holding an upstream slot (active) or waiting for one (queued).",
+    lambda: {(state,): get_admission_controller().stats()[state] for state in ("active", "queued")},
+    ("state",),
+)
+gauge(
+    "hand2excal_upstream_rejected",
+    "Model calls refused by admission control since start.",
+    lambda: get_admission_controller().stats()["rejected"],
+)
+gauge(
+    "hand2excal_job_items_queued",
+    "Batch job items waiting for a job worker.",
+    lambda: get_job_manager().queued_items,
+)
+
+ALLOWED_IMAGE_TYPES = {
+    "image/jpeg", "image/png", "image/webp",
+    "image/gif", "image/bmp", "image/heic",
+}
+
+
+def _check_image_type(file: UploadFile) -> str:
+    """Return the upload's content type, rejecting unsupported formats."""
     content_type = file.content_type or "image/jpeg"
-    if content_type not in allowed_types:
+    if content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
             status_code=400,
             detail=f"Unsupported file type: {content_type}. Use JPG, PNG, or WebP.",
         )
+    return content_type
+
+
+class SceneResponse(JSONResponse):
+    """JSON response encoded with the fast serializer (orjson when installed)."""
+
+    def render(self, content) -> bytes:
+        with stage("serialize"):
+            return dumps_bytes(content)
+
+
+def _conversion_metadata(extraction: Extraction) -> dict:
+    metadata = {
+        "nodes_count": len(extraction.flowchart.get("nodes", [])),
+        "arrows_count": len(extraction.flowchart.get("arrows", [])),
+        "cache_hit": extraction.cache_hit,
+        "coalesced": extraction.coalesced,
+        "truncated": extraction.truncated,
+    }
+    if extraction.crop is not None:
+        metadata["preprocess_ms"] = round(extraction.preprocess_ms, 1)
+        metadata["crop"] = asdict(extraction.crop)
+    return metadata
+
+
+def _conversion_result(extraction: Extraction, excalidraw_json: dict) -> dict:
+    """Response body shared by the JSON and streaming endpoints."""
+    return {
+        "success": True,
+        "excalidraw": excalidraw_json,
+        "metadata": _conversion_metadata(extraction),
+    }
 
-    # Read image bytes
-    image_bytes = await file.read()
-    size_mb = len(image_bytes) / (1024 * 1024)
-    if len(image_bytes) > 20 * 1024 * 1024:  # 20MB limit
-        raise HTTPException(status_code=400, detail="Image too large. Max 20MB.")
+
+def _build_scene(extraction: Extraction) -> dict:
+    """Build the Excalidraw scene, keyed by the input when builds are deterministic."""
+    key = extraction.key if get_settings().deterministic_builds else None
+    return build_excalidraw(extraction.flowchart, key=key)
+
+
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    """Weak comparison against an If-None-Match header."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _scene_etag(extraction: Extraction) -> str:
+    """
+    Weak ETag for the scene built from `extraction`, from its input key and
+    flowchart, so it is known before the scene is built or serialized.
+    """
+    digest = hashlib.sha256(extraction.key.encode("utf-8") + b"\n" + dumps_bytes(extraction.flowchart))
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+async def _scene_response(request: Request, extraction: Extraction, build: Callable[[], dict]) -> Response:
+    """
+    JSON response for a finished conversion; `build` returns its scene.
+    Deterministic scenes carry a weak ETag (metadata such as cache_hit may
+    differ). Only GET requests for stored results are conditional: a
+    client that already holds the scene gets an empty 304 and nothing is
+    built or serialized. A conversion POST always runs and answers 200,
+    since If-None-Match on POST is not a cache revalidation. Building and
+    serializing run in a thread, as layout of a large chart takes long
+    enough to stall every other request on the event loop.
+    """
+    headers = {}
+    if get_settings().deterministic_builds and extraction.key:
+        headers["ETag"] = _scene_etag(extraction)
+        if request.method == "GET" and _etag_matches(headers["ETag"], request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+
+    def render() -> bytes:
+        result = _conversion_result(extraction, build())
+        with stage("serialize"):
+            return dumps_bytes(result)
+
+    body = await asyncio.to_thread(render)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _overloaded(error: OverloadedError) -> HTTPException:
+    """503 telling the client when to retry."""
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+@app.post("/api/convert")
+async def convert_image(request: Request, file: UploadFile = File(...)):
+    """
+    Upload a handwritten flowchart image, returns Excalidraw JSON.
+    """
+    content_type = _check_image_type(file)
+
+    # Stream the upload in, spooling large images to a temp file
+    with stage("upload"):
+        upload, size = await spool_upload(file, MAX_UPLOAD_BYTES)
+    size_mb = size / (1024 * 1024)
 
     log.info(f"📸 Received: {file.filename} ({size_mb:.1f} MB, {content_type})")
 
     try:
         # Step 1: Extract flowchart data using Qwen
         log.info("🤖 Sending to Qwen for analysis...")
-        flowchart_data = extract_flowchart_from_bytes(image_bytes, content_type)
+        extraction = await run_image_extraction_async(upload, content_type)
+        flowchart_data = extraction.flowchart
+        log.info(f"🖼️  Preprocessed in {extraction.preprocess_ms:.0f} ms")
+        if extraction.cache_hit:
+            log.info("⚡ Cache hit, skipped model call")
+        elif extraction.coalesced:
+            log.info("🔗 Shared result of an identical in-flight request")
+        if extraction.truncated:
+            log.warning("⚠️  Model output was cut off; returning the shapes recovered so far")
         nodes = flowchart_data.get("nodes", [])
         arrows = flowchart_data.get("arrows", [])
         log.info(f"📐 Extracted: {len(nodes)} shapes, {len(arrows)} connections")
-        for n in nodes:
-            log.info(f"   🔷 {n.get('id')}: {n.get('type')} \"{n.get('label')}\" at ({n.get('x')},{n.get('y')})")
-        for a in arrows:
-            log.info(f"   ➡️  {a.get('from_id')} → {a.get('to_id')} \"{a.get('label', '')}\"")
+        if log.isEnabledFor(logging.DEBUG):
+            for n in nodes:
+                log.debug(f"   🔷 {n.get('id')}: {n.get('type')} \"{n.get('label')}\" at ({n.get('x')},{n.get('y')})")
+            for a in arrows:
+                log.debug(f"   ➡️  {a.get('from_id')} → {a.get('to_id')} \"{a.get('label', '')}\"")
 
         # Step 2: Build Excalidraw JSON
         log.info("🔧 Building Excalidraw file...")
-        excalidraw_json = build_excalidraw(flowchart_data)
+        response = await _scene_response(request, extraction, partial(_build_scene, extraction))
         log.info("✅ Conversion complete!")
 
-        return JSONResponse(content={
-            "success": True,
-            "excalidraw": excalidraw_json,
-            "metadata": {
-                "nodes_count": len(nodes),
-                "arrows_count": len(arrows),
-            },
-        })
+        return response
 
+    except OverloadedError as e:
+        raise _overloaded(e)
     except ValueError as e:
         log.error(f"❌ Validation error: {e}")
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         log.error(f"❌ Conversion failed: {e}")
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
+    finally:
+        discard_upload(upload)
 
 
 from pydantic import BaseModel
@@ -98,7 +273,7 @@ class TextConvertRequest(BaseModel):
     text: str
 
 @app.post("/api/convert-text")
-async def convert_text(request: TextConvertRequest):
+async def convert_text(request: TextConvertRequest, http_request: Request):
     """
     Upload a text document/process flow, returns Excalidraw JSON.
     """
@@ -110,25 +285,25 @@ async def convert_text(request: TextConvertRequest):
     try:
         # Step 1: Extract flowchart data using Llama
         log.info("🤖 Sending to LLM for text analysis...")
-        flowchart_data = extract_flowchart_from_text(request.text)
+        extraction = await run_text_extraction_async(request.text)
+        flowchart_data = extraction.flowchart
+        if extraction.cache_hit:
+            log.info("⚡ Cache hit, skipped model call")
+        elif extraction.coalesced:
+            log.info("🔗 Shared result of an identical in-flight request")
         nodes = flowchart_data.get("nodes", [])
         arrows = flowchart_data.get("arrows", [])
         log.info(f"📐 Extracted: {len(nodes)} shapes, {len(arrows)} connections")
         
         # Step 2: Build Excalidraw JSON
         log.info("🔧 Building Excalidraw file...")
-        excalidraw_json = build_excalidraw(flowchart_data)
+        response = await _scene_response(http_request, extraction, partial(_build_scene, extraction))
         log.info("✅ Text Conversion complete!")
 
-        return JSONResponse(content={
-            "success": True,
-            "excalidraw": excalidraw_json,
-            "metadata": {
-                "nodes_count": len(nodes),
-                "arrows_count": len(arrows),
-            },
-        })
+        return response
 
+    except OverloadedError as e:
+        raise _overloaded(e)
     except ValueError as e:
         log.error(f"❌ Validation error: {e}")
         raise HTTPException(status_code=422, detail=str(e))
@@ -137,9 +312,244 @@ async def convert_text(request: TextConvertRequest):
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
 
 
+class RebuildRequest(BaseModel):
+    scene: dict
+    flowchart: dict
+    # Also return the whole patched scene, not just the changed elements
+    full: bool = False
+
+
+def _rebuild_key(scene: dict) -> str:
+    """Deterministic-build key for elements added to an existing scene."""
+    ids = "\n".join(str(element.get("id")) for element in scene.get("elements", []))
+    return "rebuild:" + hashlib.sha256(ids.encode("utf-8")).hexdigest()
+
+
+@app.post("/api/rebuild")
+def rebuild_scene(request: RebuildRequest):
+    """
+    Patch a previously returned scene to match an edited flowchart.
+    Returns only the elements that changed (new, updated or deleted);
+    `full` adds the whole patched scene.
+    """
+    if not isinstance(request.scene.get("elements"), list):
+        raise HTTPException(status_code=400, detail="Scene must have an 'elements' list.")
+
+    try:
+        flowchart_data = validate_flowchart(request.flowchart)
+        key = _rebuild_key(request.scene) if get_settings().deterministic_builds else None
+        update = update_excalidraw(request.scene, flowchart_data, key=key)
+    except ValueError as e:
+        log.error(f"❌ Validation error: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        log.error(f"❌ Rebuild failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Rebuild failed: {str(e)}")
+
+    deleted = sum(1 for element in update.changed if element.get("isDeleted"))
+    log.info(f"🩹 Rebuilt scene: {len(update.changed) - deleted} elements changed, {deleted} deleted")
+    result = {
+        "success": True,
+        "changes": update.changed,
+        "metadata": {
+            "nodes_count": len(flowchart_data.get("nodes", [])),
+            "arrows_count": len(flowchart_data.get("arrows", [])),
+            "changed_count": len(update.changed) - deleted,
+            "deleted_count": deleted,
+        },
+    }
+    if request.full:
+        result["excalidraw"] = update.scene
+    return SceneResponse(content=result)
+
+
+# ---------- Batch jobs ----------
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    files: list[UploadFile] = File(default=[]),
+    texts: list[str] = Form(default=[]),
+):
+    """
+    Submit many images (`files`) and/or texts (`texts`) for conversion in
+    the background. Poll GET /api/jobs/{job_id} for progress.
+    """
+    texts = [text for text in texts if text.strip()]
+    count = len(files) + len(texts)
+    if not count:
+        raise HTTPException(status_code=400, detail="Submit at least one file or text.")
+    if count > get_settings().job_max_items:
+        raise HTTPException(status_code=400, detail=f"Too many items. Max {get_settings().job_max_items} per job.")
+
+    items = []
+    try:
+        for file in files:
+            content_type = _check_image_type(file)
+            with stage("upload"):
+                upload, _ = await spool_upload(file, MAX_UPLOAD_BYTES)
+            items.append(JobItem(len(items), "image", file.filename or "image", upload, content_type))
+        for text in texts:
+            items.append(JobItem(len(items), "text", f"text {len(items)}", text))
+        job = await get_job_manager().submit(items)
+    except QueueFullError as e:
+        for item in items:
+            item.release()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except BaseException:
+        for item in items:
+            item.release()
+        raise
+
+    return {**job.to_dict(include_items=False), "status_url": f"/api/jobs/{job.id}"}
+
+
+async def _get_job(job_id: str, scenes: bool = False):
+    job = await get_job_manager().get(job_id, scenes)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job progress with the status of every item."""
+    return SceneResponse(content=(await _get_job(job_id)).to_dict())
+
+
+@app.get("/api/jobs/{job_id}/items/{index}")
+async def get_job_item(job_id: str, index: int, request: Request):
+    """One finished item, in the same shape as the /api/convert response."""
+    job = await _get_job(job_id, scenes=True)
+    if not 0 <= index < len(job.items):
+        raise HTTPException(status_code=404, detail="No such item.")
+    item = job.items[index]
+    if item.status == FAILED:
+        raise HTTPException(status_code=422, detail=item.error)
+    if item.scene is None:
+        raise HTTPException(status_code=409, detail=f"Item is {item.status}.")
+    return await _scene_response(request, item.extraction, lambda: item.scene)
+
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """ZIP of every finished scene so far, plus job.json with all item states."""
+    job = await _get_job(job_id, scenes=True)
+    return Response(
+        content=await asyncio.to_thread(job.results_zip),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="hand2excal-{job.id}.zip"'},
+    )
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel the job's queued items; items already running still finish."""
+    job = await get_job_manager().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return SceneResponse(content=job.to_dict(include_items=False))
+
+
+# ---------- Streaming (Server-Sent Events) ----------
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+async def _stream_conversion(events):
+    """
+    Relay extraction events as SSE: `stage` events for progress, `node`
+    and `arrow` as soon as each is parsed, then `result` (same body as the
+    JSON endpoints) or `error`.
+    """
+    try:
+        yield _sse("stage", {"stage": "received"})
+        extraction = None
+        async for kind, payload in events:
+            if kind == "extraction":
+                extraction = payload
+            elif kind in ("node", "arrow"):
+                yield _sse(kind, payload)
+            else:
+                yield _sse("stage", {"stage": kind, **payload})
+
+        flowchart_data = extraction.flowchart
+        yield _sse("stage", {
+            "stage": "parsed",
+            "nodes_count": len(flowchart_data.get("nodes", [])),
+            "arrows_count": len(flowchart_data.get("arrows", [])),
+        })
+        # Layout and serialization of a large chart would stall every other stream
+        excalidraw_json = await asyncio.to_thread(_build_scene, extraction)
+        yield _sse("stage", {"stage": "built"})
+        yield await asyncio.to_thread(_sse, "result", _conversion_result(extraction, excalidraw_json))
+        log.info("✅ Streamed conversion complete!")
+
+    except OverloadedError as e:
+        yield _sse("error", {"status": 503, "detail": str(e), "retry_after": e.retry_after})
+    except ValueError as e:
+        log.error(f"❌ Validation error: {e}")
+        yield _sse("error", {"status": 422, "detail": str(e)})
+    except Exception as e:
+        log.error(f"❌ Conversion failed: {e}")
+        yield _sse("error", {"status": 500, "detail": f"Conversion failed: {str(e)}"})
+
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop reverse proxies (nginx) from buffering the event stream
+    "X-Accel-Buffering": "no",
+}
+
+
+@app.post("/api/convert/stream")
+async def convert_image_stream(file: UploadFile = File(...)):
+    """
+    Streaming variant of /api/convert: emits progress, nodes and arrows
+    as Server-Sent Events, ending with a `result` event.
+    """
+    content_type = _check_image_type(file)
+    with stage("upload"):
+        upload, size = await spool_upload(file, MAX_UPLOAD_BYTES)
+    log.info(f"📸 Received for streaming: {file.filename} ({size / (1024 * 1024):.1f} MB, {content_type})")
+
+    # A background task still runs when the client disconnects before the
+    # stream starts, unlike a finally block in the never-started generator
+    return StreamingResponse(
+        _stream_conversion(stream_image_extraction_async(upload, content_type)),
+        media_type="text/event-stream",
+        headers=_SSE_HEADERS,
+        background=BackgroundTask(discard_upload, upload),
+    )
+
+
+@app.post("/api/convert-text/stream")
+async def convert_text_stream(request: TextConvertRequest):
+    """
+    Streaming variant of /api/convert-text, see /api/convert/stream.
+    """
+    if not request.text or not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty.")
+
+    log.info(f"📝 Received text for streaming ({len(request.text)} characters)")
+
+    return StreamingResponse(
+        _stream_conversion(stream_text_extraction_async(request.text)),
+        media_type="text/event-stream",
+        headers=_SSE_HEADERS,
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "backend": get_backend().name, "upstream": get_admission_controller().stats()}
 
 
 # Serve frontend static files (production build)
@@ -0,0 +1,143 @@
+"""
+Upload handling: Rejects oversized request bodies while they stream in
+and spools large images to disk so a request never holds a full copy
+of the upload in memory.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+
+CHUNK_SIZE = 1024 * 1024
+# Uploads up to this size stay in memory; larger ones go to a temp file
+SPOOL_THRESHOLD = 1024 * 1024
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that caps request bodies on the given paths.
+
+    Requests announcing a larger Content-Length are refused before any
+    body is read; chunked or lying clients are cut off as soon as the
+    running total passes the limit.
+    """
+
+    def __init__(self, app, max_body_size: int, paths: tuple[str, ...]):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self.max_body_size:
+                await self._reject(send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # The framework may turn the aborted read into its own error
+            # response; replace it with a 413
+            if exceeded:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        limit_mb = (self.max_body_size - MULTIPART_OVERHEAD) // (1024 * 1024)
+        body = json.dumps({"detail": f"Image too large. Max {limit_mb}MB."}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+async def spool_upload(file: UploadFile, max_size: int) -> tuple[bytes | Path, int]:
+    """
+    Read an upload in chunks, enforcing max_size as it goes.
+
+    Small uploads are returned as bytes; once the upload passes
+    SPOOL_THRESHOLD it is written to a named temp file and its path is
+    returned instead (the caller must delete it, see discard_upload).
+    Returns (bytes or path, size in bytes).
+    """
+    buffer = bytearray()
+    spool = None
+    size = 0
+    try:
+        while chunk := await file.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Image too large. Max {max_size // (1024 * 1024)}MB.",
+                )
+            if spool is None and len(buffer) + len(chunk) <= SPOOL_THRESHOLD:
+                buffer += chunk
+                continue
+            if spool is None:
+                suffix = Path(file.filename or "").suffix
+                spool = tempfile.NamedTemporaryFile(prefix="hand2excal-", suffix=suffix, delete=False)
+                spool.write(buffer)
+                buffer = bytearray()
+            spool.write(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.unlink(spool.name)
+        raise
+
+    if spool is None:
+        return bytes(buffer), size
+    spool.close()
+    return Path(spool.name), size
+
+
+def discard_upload(upload: bytes | Path) -> None:
+    """Delete a spooled upload's temp file, if there is one."""
+    if isinstance(upload, Path):
+        upload.unlink(missing_ok=True)
@@ -1,30 +1,39 @@
 """
-Vision module: Uses Qwen2.5-VL via HuggingFace Inference API
+Vision module: Uses Qwen2.5-VL (through the configured inference backend)
 to extract structured flowchart data from handwritten images.
 """
 
+import asyncio
 import base64
+import contextvars
+import copy
 import io
-import json
-import os
+import logging
 import re
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
 
-from PIL import Image
-try:
-    import pillow_heif
-    pillow_heif.register_heif_opener()
-except ImportError:
-    pass  # HEIC support optional
-
 from dotenv import load_dotenv
-from huggingface_hub import InferenceClient
+
+from .admission import get_admission_controller
+from .backends import get_backend
+from .cascade import UNPARSEABLE, Confidence, score_extraction
+from .config import get_settings
+from .cache import LeaderCancelled, get_result_cache, get_single_flight, make_cache_key
+from .inference import get_client_manager
+from .metrics import CASCADE, EXTRACTIONS, MODEL_CALLS, record_stage, record_usage, stage
+from .compact_stream import CompactStreamParser
+from .json_stream import FlowchartStreamParser
+from .profiling import traced
+from .preprocess import CropBox, count_closed_shapes, ensure_jpeg, get_preprocess_pool
 
 load_dotenv()
 
-QWEN_MODEL = "Qwen/Qwen2.5-VL-7B-Instruct"
-# QWEN_MODEL = "Qwen/Qwen3-VL-235B-A22B-Instruct"
-TEXT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+log = logging.getLogger("hand2excal")
 
 SYSTEM_PROMPT = """You are an expert at analyzing handwritten flowcharts and diagrams. 
 Given an image of a handwritten flowchart, you must extract ALL shapes, text, and connections into a precise structured JSON format.
@@ -133,74 +142,166 @@ Important:
 - Return ONLY the JSON object, nothing else"""
 
 
-def _image_to_data_url(image_path: str) -> str:
-    """Convert a local image to a base64 data URL, converting unsupported formats."""
-    path = Path(image_path)
-    suffix = path.suffix.lower()
-    mime_map = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".webp": "image/webp",
-        ".gif": "image/gif",
-        ".bmp": "image/bmp",
-        ".heic": "image/heic",
-    }
-    content_type = mime_map.get(suffix, "image/jpeg")
-    image_bytes = path.read_bytes()
-    image_bytes, content_type = _ensure_jpeg(image_bytes, content_type)
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
-    return f"data:{content_type};base64,{b64}"
+COMPACT_SYSTEM_PROMPT = """You are an expert at analyzing handwritten flowcharts and diagrams.
+Given an image of a handwritten flowchart, list ALL shapes and connections in the compact line format below.
+Layout is computed automatically, so do not output coordinates or sizes.
+
+Format (one item per line, nothing else):
+N <id> <shape> <row> <col> <label>
+E <from_id> <to_id> <label>
+END
 
+- <id>: a short unique number (1, 2, 3, ...)
+- <shape>: R = rectangle, O = rounded rectangle, E = ellipse/oval/circle, D = diamond.
+  Append :<css color> only if a shape is clearly drawn in a color other than black (e.g. R:red).
+- <row> <col>: coarse grid cell of the shape in the image, counting from 0 at the top-left.
+  Shapes side by side share a row; shapes stacked vertically share a column.
+- <label>: the exact text inside the shape; write \\n for a line break.
+- E lines: one per arrow, from the shape it starts at to the shape it points to.
+  Text written near an arrow (like "Yes", "No") is the arrow's label, not a separate shape. Omit the label if there is none.
+- CRITICAL: Do NOT miss any arrows! Count all arrows in the image before responding.
+- List all N lines first, then all E lines, then END.
+
+Example:
+N 1 E 0 0 Start
+N 2 R 1 0 Read input
+N 3 D 2 0 Valid?
+N 4 R 2 1 Show error
+E 1 2
+E 2 3
+E 3 4 No
+E 4 2
+END"""
+
+
+COMPACT_TEXT_SYSTEM_PROMPT = """You are an expert at analyzing process flows, documents, and textual descriptions to generate structured flowcharts.
+Given a text description, list ALL logical steps, decisions, and connections in the compact line format below.
+Layout is computed automatically, so do not output coordinates or sizes.
+
+Format (one item per line, nothing else):
+N <id> <shape> <label>
+E <from_id> <to_id> <label>
+END
+
+- <id>: a short unique number (1, 2, 3, ...)
+- <shape>: R = normal step/action, D = decision/question, E = start/end point.
+  Append :<css color> only if the text implies a specific color (e.g. R:red for a warning step).
+- <label>: a concise label for the step; write \\n for a line break.
+- E lines: one per connection, with a label for conditional paths (e.g. "Yes", "No", "If valid"); omit the label otherwise.
+- List all N lines first, then all E lines, then END.
+
+Example:
+N 1 E Start
+N 2 R Receive order
+N 3 D In stock?
+N 4 R Ship order
+E 1 2
+E 2 3
+E 3 4 Yes
+END"""
+
+
+_MIME_MAP = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+    ".bmp": "image/bmp",
+    ".heic": "image/heic",
+}
 
-def _ensure_jpeg(image_bytes: bytes, content_type: str) -> tuple[bytes, str]:
-    """Resize and convert images to JPEG for the API (keeps payload small)."""
-    img = Image.open(io.BytesIO(image_bytes))
-    img = img.convert("RGB")
 
-    # Resize if larger than 1200px on any side
-    max_dim = 1200
-    if max(img.size) > max_dim:
-        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+def _content_type_for_path(image_path: str) -> str:
+    """Guess an image content type from the file extension."""
+    return _MIME_MAP.get(Path(image_path).suffix.lower(), "image/jpeg")
 
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=85)
-    return buf.getvalue(), "image/jpeg"
+
+def _jpeg_to_data_url(jpeg_bytes: bytes) -> str:
+    """Encode already-normalized JPEG bytes as a base64 data URL."""
+    b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
+    return f"data:image/jpeg;base64,{b64}"
 
 
 def _image_bytes_to_data_url(image_bytes: bytes, content_type: str = "image/jpeg") -> str:
     """Convert image bytes to a base64 data URL, converting unsupported formats first."""
-    image_bytes, content_type = _ensure_jpeg(image_bytes, content_type)
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
-    return f"data:{content_type};base64,{b64}"
+    image_bytes, _ = ensure_jpeg(image_bytes, content_type)
+    return _jpeg_to_data_url(image_bytes)
+
+
+def _normalize_text(text: str) -> str:
+    """Normalize line endings and surrounding whitespace so trivial edits share a cache key."""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
 
 
 def _extract_json(text: str) -> dict:
-    """Extract JSON from model response, handling markdown fences."""
-    # Try direct parse first
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
+    """
+    Extract JSON from model response, handling markdown fences and
+    surrounding prose. Truncated output yields the nodes/arrows that
+    were complete.
+    """
+    parser = FlowchartStreamParser()
+    parser.feed(text.strip())
+    return parser.result()
 
-    # Try extracting from markdown code fence
-    match = re.search(r"```(?:json)?\s*\n?(.*?)\n?\s*```", text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group(1).strip())
-        except json.JSONDecodeError:
-            pass
 
-    # Try finding first { ... } block
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group(0))
-        except json.JSONDecodeError:
-            pass
+_CONTINUE_PROMPT = (
+    "Your previous response was cut off. Continue your output exactly where it stopped, "
+    "without repeating anything and without markdown fences."
+)
 
-    raise ValueError(f"Could not extract valid JSON from model response:\n{text[:500]}")
+
+def _continuation_messages(messages: list[dict], partial: str) -> list[dict]:
+    """Messages asking the model to carry on from a truncated response."""
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": _CONTINUE_PROMPT},
+    ]
+
+
+def _strip_leading_fence(text: str) -> str:
+    """Drop a markdown fence the model may open its continuation with."""
+    return re.sub(r"^\s*```(?:json)?\s*", "", text)
+
+
+def _leading_fence_pending(text: str) -> bool:
+    """
+    True while the streamed start of a continuation could still be an
+    unfinished fence (a lone backtick, or "```js" before its newline).
+    """
+    head = text.lstrip()
+    if len(head) < 3:
+        return "```".startswith(head)
+    return head.startswith("```") and not re.search(r"[\n{\[]", head)
+
+
+def _normalize_node(node: dict, index: int) -> dict:
+    """Fill in defaults for one node (index drives fallback id and grid position)."""
+    if "id" not in node:
+        node["id"] = f"node_{index + 1}"
+
+    # Defaults
+    node.setdefault("type", "rectangle")
+    node.setdefault("label", "")
+    node.setdefault("x", 100 + (index % 4) * 200)
+    node.setdefault("y", 100 + (index // 4) * 150)
+    node.setdefault("width", 150)
+    node.setdefault("height", 60)
+    node.setdefault("strokeColor", "#1e1e1e")
+    node.setdefault("backgroundColor", "transparent")
+    node.setdefault("rounded", False)
+
+    # Clamp type
+    if node["type"] not in ("rectangle", "ellipse", "diamond"):
+        node["type"] = "rectangle"
+    return node
+
+
+def _normalize_arrow(arrow: dict) -> dict:
+    """Fill in defaults for one arrow."""
+    arrow.setdefault("label", "")
+    arrow.setdefault("strokeColor", "#1e1e1e")
+    return arrow
 
 
 def _validate_flowchart_data(data: dict) -> dict:
@@ -212,71 +313,286 @@ def _validate_flowchart_data(data: dict) -> dict:
 
     node_ids = set()
     for i, node in enumerate(data["nodes"]):
-        if "id" not in node:
-            node["id"] = f"node_{i + 1}"
+        _normalize_node(node, i)
         node_ids.add(node["id"])
 
-        # Defaults
-        node.setdefault("type", "rectangle")
-        node.setdefault("label", "")
-        node.setdefault("x", 100 + (i % 4) * 200)
-        node.setdefault("y", 100 + (i // 4) * 150)
-        node.setdefault("width", 150)
-        node.setdefault("height", 60)
-        node.setdefault("strokeColor", "#1e1e1e")
-        node.setdefault("backgroundColor", "transparent")
-        node.setdefault("rounded", False)
-
-        # Clamp type
-        if node["type"] not in ("rectangle", "ellipse", "diamond"):
-            node["type"] = "rectangle"
-
     # Validate arrows
     valid_arrows = []
     for arrow in data["arrows"]:
         if arrow.get("from_id") in node_ids and arrow.get("to_id") in node_ids:
-            arrow.setdefault("label", "")
-            arrow.setdefault("strokeColor", "#1e1e1e")
-            valid_arrows.append(arrow)
+            valid_arrows.append(_normalize_arrow(arrow))
 
     data["arrows"] = valid_arrows
     return data
 
 
+def validate_flowchart(data: dict) -> dict:
+    """Validate and normalize flowchart data supplied by a client (e.g. an edited flowchart)."""
+    if not isinstance(data, dict) or not isinstance(data.get("nodes"), list):
+        raise ValueError("Flowchart must be an object with a 'nodes' list")
+    return _validate_flowchart_data(data)
+
+
+@dataclass
+class Extraction:
+    """A validated flowchart plus metadata about how it was produced."""
+
+    flowchart: dict
+    cache_hit: bool = False
+    # True when this request waited on an identical in-flight request
+    coalesced: bool = False
+    # Wall time spent normalizing the image, including pool queueing
+    preprocess_ms: float = 0.0
+    # Region of the upload that was sent to the model (images only)
+    crop: CropBox | None = None
+    # True when the model output was cut off and only partly recovered
+    truncated: bool = False
+    # Cache key of the input; also seeds deterministic builds
+    key: str = ""
+
+
+class StreamCancelled(Exception):
+    """The consumer of a streaming conversion went away (e.g. the SSE client disconnected)."""
+
+
+# Set by _iterate_blocking on the thread driving a stream; checked between model chunks
+_stream_cancel: contextvars.ContextVar[threading.Event | None] = contextvars.ContextVar(
+    "hand2excal_stream_cancel", default=None
+)
+
+
+def _check_cancelled() -> None:
+    event = _stream_cancel.get()
+    if event is not None and event.is_set():
+        raise StreamCancelled()
+
+
+_IMAGE_INSTRUCTION = "Analyze this handwritten flowchart and extract all shapes, text, and connections into the format specified."
+
+
+def _image_prompt() -> str:
+    """System prompt for images in the configured output format."""
+    return COMPACT_SYSTEM_PROMPT if get_settings().compact_output else SYSTEM_PROMPT
+
+
+def _text_prompt() -> str:
+    """System prompt for text in the configured output format."""
+    return COMPACT_TEXT_SYSTEM_PROMPT if get_settings().compact_output else TEXT_SYSTEM_PROMPT
+
+
+def _new_parser() -> FlowchartStreamParser | CompactStreamParser:
+    """A response parser matching the configured output format."""
+    return CompactStreamParser() if get_settings().compact_output else FlowchartStreamParser()
+
+
+def _image_messages(jpeg_bytes: bytes) -> list[dict]:
+    """Chat messages asking the vision model to read a normalized JPEG."""
+    with stage("encode"):
+        data_url = _jpeg_to_data_url(jpeg_bytes)
+    return [
+        {"role": "system", "content": _image_prompt()},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url}},
+                {
+                    "type": "text",
+                    "text": _IMAGE_INSTRUCTION,
+                },
+            ],
+        },
+    ]
+
+
+def _text_messages(text: str) -> list[dict]:
+    """Chat messages asking the text model to structure a description."""
+    return [
+        {"role": "system", "content": _text_prompt()},
+        {
+            "role": "user",
+            "content": text,
+        },
+    ]
+
+
+def _validated(result: dict) -> tuple[dict, int]:
+    """Validate parsed model output; returns (flowchart data, arrows dropped for unknown endpoints)."""
+    arrows = len(result.get("arrows") or []) if isinstance(result, dict) else 0
+    with stage("validate"):
+        data = _validate_flowchart_data(result)
+    return data, arrows - len(data["arrows"])
+
+
+def _call_model(model: str, messages: list[dict]) -> tuple[dict, bool, int]:
+    """
+    Run a chat completion and return (validated flowchart data, truncated,
+    dropped arrows). If the output hits max_tokens, up to
+    HAND2EXCAL_MAX_CONTINUATIONS follow-up requests ask for the rest;
+    whatever is still missing after that is dropped and `truncated` is True.
+    """
+    backend = get_backend()
+    parser = _new_parser()
+    request_messages = messages
+
+    with get_admission_controller().slot() as waited:
+        record_stage("queue", waited)
+        for attempt in range(get_settings().max_continuations + 1):
+            MODEL_CALLS.inc(model)
+            with stage("model"):
+                response = backend.chat_completion(
+                    model=model,
+                    messages=request_messages,
+                    max_tokens=4096,
+                    temperature=0.1,
+                )
+            record_usage(model, response.usage)
+            choice = response.choices[0]
+            raw_text = choice.message.content or ""
+            with stage("parse"):
+                parser.feed(_strip_leading_fence(raw_text) if attempt else raw_text)
+                if choice.finish_reason != "length":
+                    parser.finish()
+            if parser.complete or choice.finish_reason != "length":
+                break
+            request_messages = _continuation_messages(messages, parser.text)
+
+    with stage("parse"):
+        result = parser.result()
+    data, dropped = _validated(result)
+    return data, not parser.complete, dropped
+
+
+def _image_model_key() -> str:
+    """The image model setup a cached result depends on."""
+    backend = get_backend()
+    if not backend.escalation_model:
+        return backend.image_model
+    return f"{backend.image_model}>{backend.escalation_model}@{get_settings().escalation_threshold:g}"
+
+
+def _escalate(confidence: Confidence) -> None:
+    CASCADE.inc("escalated")
+    log.info(f"⤴️  Low confidence {confidence.describe()}; asking {get_backend().escalation_model}")
+
+
+def _needs_escalation(jpeg_bytes: bytes, data: dict, truncated: bool, dropped: int) -> bool:
+    """
+    Score a fast-model result (see app.cascade). The image is only
+    inspected for closed shapes when the cheaper checks pass.
+    """
+    threshold = get_settings().escalation_threshold
+    with stage("score"):
+        confidence = score_extraction(data, dropped, truncated)
+        if confidence.score >= threshold:
+            confidence = score_extraction(data, dropped, truncated, count_closed_shapes(jpeg_bytes))
+    if confidence.score >= threshold:
+        CASCADE.inc("accepted")
+        return False
+    _escalate(confidence)
+    return True
+
+
+def _call_image_model(jpeg_bytes: bytes) -> tuple[dict, bool]:
+    """
+    Send a normalized JPEG to the vision model; returns (validated data, truncated).
+    With an escalation model set, low-confidence results are read again by it.
+    """
+    backend = get_backend()
+    messages = _image_messages(jpeg_bytes)
+    if backend.escalation_model:
+        try:
+            data, truncated, dropped = _call_model(backend.image_model, messages)
+        except ValueError:
+            _escalate(UNPARSEABLE)
+        else:
+            if not _needs_escalation(jpeg_bytes, data, truncated, dropped):
+                return data, truncated
+    model = backend.escalation_model or backend.image_model
+    data, truncated, _ = _call_model(model, messages)
+    return data, truncated
+
+
+def _call_text_model(text: str) -> tuple[dict, bool]:
+    """Send a text description to the text model; returns (validated data, truncated)."""
+    data, truncated, _ = _call_model(get_backend().text_model, _text_messages(text))
+    return data, truncated
+
+
+def run_image_extraction(image: bytes | str | Path, content_type: str = "image/jpeg") -> Extraction:
+    """
+    Normalize an image (bytes or a file path), then return the cached
+    flowchart for it or ask the model.
+    Concurrent requests for the same normalized image share one model call.
+    """
+    prepared, preprocess_ms = get_preprocess_pool().run(image, content_type)
+    record_stage("preprocess", preprocess_ms / 1000)
+    jpeg_bytes = prepared.jpeg_bytes
+    cache = get_result_cache()
+    key = make_cache_key("image", jpeg_bytes, _image_model_key(), _image_prompt())
+
+    cached = cache.get(key)
+    if cached is not None:
+        EXTRACTIONS.inc("image", "cache_hit")
+        return Extraction(
+            flowchart=cached, cache_hit=True, preprocess_ms=preprocess_ms, crop=prepared.crop, key=key
+        )
+
+    def compute() -> tuple[dict, bool]:
+        result, truncated = _call_image_model(jpeg_bytes)
+        # Partial results should be retried, not served again
+        if not truncated:
+            cache.put(key, result)
+        return result, truncated
+
+    (flowchart_data, truncated), coalesced = get_single_flight().do(key, compute)
+    EXTRACTIONS.inc("image", "coalesced" if coalesced else "model")
+    return Extraction(
+        flowchart=flowchart_data,
+        coalesced=coalesced,
+        preprocess_ms=preprocess_ms,
+        crop=prepared.crop,
+        truncated=truncated,
+        key=key,
+    )
+
+
+def run_text_extraction(text: str) -> Extraction:
+    """
+    Normalize a text description, then return the cached flowchart for it or ask the model.
+    Concurrent requests for the same normalized text share one model call.
+    """
+    text = _normalize_text(text)
+    cache = get_result_cache()
+    key = make_cache_key("text", text.encode("utf-8"), get_backend().text_model, _text_prompt())
+
+    cached = cache.get(key)
+    if cached is not None:
+        EXTRACTIONS.inc("text", "cache_hit")
+        return Extraction(flowchart=cached, cache_hit=True, key=key)
+
+    def compute() -> tuple[dict, bool]:
+        result, truncated = _call_text_model(text)
+        # Partial results should be retried, not served again
+        if not truncated:
+            cache.put(key, result)
+        return result, truncated
+
+    (flowchart_data, truncated), coalesced = get_single_flight().do(key, compute)
+    EXTRACTIONS.inc("text", "coalesced" if coalesced else "model")
+    return Extraction(flowchart=flowchart_data, coalesced=coalesced, truncated=truncated, key=key)
+
+
+def run_image_file_extraction(image_path: str | Path) -> Extraction:
+    """run_image_extraction for a file on disk, typed by its extension."""
+    return run_image_extraction(Path(image_path), _content_type_for_path(str(image_path)))
+
+
 def extract_flowchart_from_image(image_path: str) -> dict:
     """
     Extract flowchart structure from a handwritten image file.
     Returns validated dict with 'nodes' and 'arrows'.
     """
-    token = os.getenv("HF_API_TOKEN")
-    if not token:
-        raise ValueError("HF_API_TOKEN not set. Copy .env.example to .env and add your token.")
-
-    client = InferenceClient(token=token)
-    data_url = _image_to_data_url(image_path)
-
-    response = client.chat_completion(
-        model=QWEN_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {
-                        "type": "text",
-                        "text": "Analyze this handwritten flowchart and extract all shapes, text, and connections into the JSON format specified.",
-                    },
-                ],
-            },
-        ],
-        max_tokens=4096,
-        temperature=0.1,
-    )
-
-    raw_text = response.choices[0].message.content
-    flowchart_data = _extract_json(raw_text)
-    return _validate_flowchart_data(flowchart_data)
+    return run_image_file_extraction(image_path).flowchart
 
 
 def extract_flowchart_from_bytes(image_bytes: bytes, content_type: str = "image/jpeg") -> dict:
@@ -284,35 +600,7 @@ def extract_flowchart_from_bytes(image_bytes: bytes, content_type: str = "image/
     Extract flowchart structure from image bytes (used by the API endpoint).
     Returns validated dict with 'nodes' and 'arrows'.
     """
-    token = os.getenv("HF_API_TOKEN")
-    if not token:
-        raise ValueError("HF_API_TOKEN not set. Copy .env.example to .env and add your token.")
-
-    client = InferenceClient(token=token)
-    data_url = _image_bytes_to_data_url(image_bytes, content_type)
-
-    response = client.chat_completion(
-        model=QWEN_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {
-                        "type": "text",
-                        "text": "Analyze this handwritten flowchart and extract all shapes, text, and connections into the JSON format specified.",
-                    },
-                ],
-            },
-        ],
-        max_tokens=4096,
-        temperature=0.1,
-    )
-
-    raw_text = response.choices[0].message.content
-    flowchart_data = _extract_json(raw_text)
-    return _validate_flowchart_data(flowchart_data)
+    return run_image_extraction(image_bytes, content_type).flowchart
 
 
 def extract_flowchart_from_text(text: str) -> dict:
@@ -320,25 +608,300 @@ def extract_flowchart_from_text(text: str) -> dict:
     Extract flowchart structure from text description.
     Returns validated dict with 'nodes' and 'arrows'.
     """
-    token = os.getenv("HF_API_TOKEN")
-    if not token:
-        raise ValueError("HF_API_TOKEN not set. Copy .env.example to .env and add your token.")
-
-    client = InferenceClient(token=token)
-
-    response = client.chat_completion(
-        model=TEXT_MODEL,
-        messages=[
-            {"role": "system", "content": TEXT_SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": text,
-            },
-        ],
-        max_tokens=4096,
-        temperature=0.1,
+    return run_text_extraction(text).flowchart
+
+
+# ---------- Streaming path ----------
+
+def _stream_model(model: str, messages: list[dict]) -> Iterator[tuple[str, dict]]:
+    """
+    Stream a chat completion, yielding ("model_streaming", {}) on the first
+    token and ("node" | "arrow", dict) as soon as each object is complete.
+    Arrows are held back until both of their endpoints have been sent.
+    Truncated output is continued like in _call_model.
+    Returns (validated flowchart data, truncated, dropped arrows) once the
+    response has finished.
+    """
+    backend = get_backend()
+    parser = _new_parser()
+    node_ids: set[str] = set()
+    pending_arrows: list[dict] = []
+    started = False
+    request_messages = messages
+
+    def release(items: list[tuple[str, dict]]) -> Iterator[tuple[str, dict]]:
+        for kind, item in items:
+            if kind == "node":
+                node = _normalize_node(item, len(node_ids))
+                node_ids.add(node["id"])
+                yield "node", node
+            else:
+                pending_arrows.append(item)
+            ready = [a for a in pending_arrows if a.get("from_id") in node_ids and a.get("to_id") in node_ids]
+            for arrow in ready:
+                pending_arrows.remove(arrow)
+                yield "arrow", _normalize_arrow(arrow)
+
+    with get_admission_controller().slot() as waited:
+        record_stage("queue", waited)
+        for attempt in range(get_settings().max_continuations + 1):
+            MODEL_CALLS.inc(model)
+            # Parsing is interleaved with the stream, so it counts as model time here
+            model_started = time.perf_counter()
+            stream = backend.chat_completion(
+                model=model,
+                messages=request_messages,
+                max_tokens=4096,
+                temperature=0.1,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            finish_reason = None
+            # A continuation's first deltas are held until a fence would be complete
+            head = "" if attempt else None
+            try:
+                for chunk in stream:
+                    _check_cancelled()
+                    record_usage(model, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if head is not None:
+                        head += delta
+                        if _leading_fence_pending(head):
+                            continue
+                        delta, head = _strip_leading_fence(head), None
+                    if not started:
+                        started = True
+                        yield "model_streaming", {}
+
+                    yield from release(parser.feed(delta))
+            finally:
+                # Ends the upstream response early when the loop stopped before it did
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+
+            if head:
+                yield from release(parser.feed(_strip_leading_fence(head)))
+            if finish_reason != "length":
+                yield from release(parser.finish())
+            record_stage("model", time.perf_counter() - model_started)
+            if parser.complete or finish_reason != "length":
+                break
+            yield "model_continuing", {}
+            request_messages = _continuation_messages(messages, parser.text)
+
+    data, dropped = _validated(parser.result())
+    return data, not parser.complete, dropped
+
+
+def _stream_image_model(jpeg_bytes: bytes) -> Iterator[tuple[str, dict]]:
+    """
+    Streaming variant of _call_image_model. When the cascade escalates,
+    ("model_escalating", {...}) tells clients to drop the nodes streamed
+    so far; the larger model's nodes follow.
+    """
+    backend = get_backend()
+    messages = _image_messages(jpeg_bytes)
+    if backend.escalation_model:
+        try:
+            data, truncated, dropped = yield from _stream_model(backend.image_model, messages)
+        except ValueError:
+            _escalate(UNPARSEABLE)
+        else:
+            if not _needs_escalation(jpeg_bytes, data, truncated, dropped):
+                return data, truncated
+        yield "model_escalating", {"model": backend.escalation_model}
+    model = backend.escalation_model or backend.image_model
+    data, truncated, _ = yield from _stream_model(model, messages)
+    return data, truncated
+
+
+def _replay_flowchart(flowchart_data: dict) -> Iterator[tuple[str, dict]]:
+    """Emit a finished flowchart as the same node/arrow events a live stream produces."""
+    for node in flowchart_data.get("nodes", []):
+        yield "node", node
+    for arrow in flowchart_data.get("arrows", []):
+        yield "arrow", arrow
+
+
+def _stream_coalesced(kind: str, key: str, start_stream) -> Iterator[tuple[str, dict]]:
+    """
+    Stream a cache miss through single-flight like the blocking path: the
+    leader runs start_stream() (a generator returning (flowchart,
+    truncated)), relays its events and caches the result; followers yield
+    nothing and wait for the leader's result.
+    Returns (flowchart, truncated, coalesced).
+    """
+    single_flight = get_single_flight()
+    while True:
+        future, leader = single_flight.begin(key)
+        if leader:
+            break
+        try:
+            flowchart_data, truncated = future.result()
+        except LeaderCancelled:
+            continue
+        EXTRACTIONS.inc(kind, "coalesced")
+        return copy.deepcopy(flowchart_data), truncated, True
+
+    EXTRACTIONS.inc(kind, "model")
+    try:
+        flowchart_data, truncated = yield from start_stream()
+    except (GeneratorExit, StreamCancelled):
+        # The client went away; let a follower take over instead of failing it
+        single_flight.end(key, future, error=LeaderCancelled())
+        raise
+    except BaseException as e:
+        single_flight.end(key, future, error=e)
+        raise
+    # Partial results should be retried, not served again
+    if not truncated:
+        get_result_cache().put(key, flowchart_data)
+    single_flight.end(key, future, (flowchart_data, truncated))
+    return flowchart_data, truncated, False
+
+
+def stream_image_extraction(
+    image: bytes | str | Path, content_type: str = "image/jpeg"
+) -> Iterator[tuple[str, object]]:
+    """
+    Streaming variant of run_image_extraction.
+    Yields (stage, payload) events while working and finishes with
+    ("extraction", Extraction). Cache hits are replayed as events;
+    requests coalesced with one already streaming get only the result.
+    """
+    prepared, preprocess_ms = get_preprocess_pool().run(image, content_type)
+    record_stage("preprocess", preprocess_ms / 1000)
+    yield "preprocessed", {"preprocess_ms": round(preprocess_ms, 1)}
+
+    cache = get_result_cache()
+    key = make_cache_key("image", prepared.jpeg_bytes, _image_model_key(), _image_prompt())
+    cached = cache.get(key)
+    if cached is not None:
+        EXTRACTIONS.inc("image", "cache_hit")
+        yield from _replay_flowchart(cached)
+        yield "extraction", Extraction(
+            flowchart=cached, cache_hit=True, preprocess_ms=preprocess_ms, crop=prepared.crop, key=key
+        )
+        return
+
+    flowchart_data, truncated, coalesced = yield from _stream_coalesced(
+        "image", key, partial(_stream_image_model, prepared.jpeg_bytes)
     )
+    yield "extraction", Extraction(
+        flowchart=flowchart_data,
+        coalesced=coalesced,
+        preprocess_ms=preprocess_ms,
+        crop=prepared.crop,
+        truncated=truncated,
+        key=key,
+    )
+
+
+def stream_text_extraction(text: str) -> Iterator[tuple[str, object]]:
+    """
+    Streaming variant of run_text_extraction.
+    Yields (stage, payload) events while working and finishes with
+    ("extraction", Extraction). Cache hits are replayed as events;
+    requests coalesced with one already streaming get only the result.
+    """
+    text = _normalize_text(text)
+    cache = get_result_cache()
+    key = make_cache_key("text", text.encode("utf-8"), get_backend().text_model, _text_prompt())
+    cached = cache.get(key)
+    if cached is not None:
+        EXTRACTIONS.inc("text", "cache_hit")
+        yield from _replay_flowchart(cached)
+        yield "extraction", Extraction(flowchart=cached, cache_hit=True, key=key)
+        return
+
+    def start_stream() -> Iterator[tuple[str, dict]]:
+        flowchart_data, truncated, _ = yield from _stream_model(get_backend().text_model, _text_messages(text))
+        return flowchart_data, truncated
+
+    flowchart_data, truncated, coalesced = yield from _stream_coalesced("text", key, start_stream)
+    yield "extraction", Extraction(flowchart=flowchart_data, coalesced=coalesced, truncated=truncated, key=key)
+
+
+# ---------- Async path ----------
 
-    raw_text = response.choices[0].message.content
-    flowchart_data = _extract_json(raw_text)
-    return _validate_flowchart_data(flowchart_data)
+async def _run_blocking(func, *args):
+    """Run a blocking call on the inference pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's context (stage timings, profile) over to the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_client_manager().executor, partial(context.run, traced, func, *args))
+
+
+async def run_image_extraction_async(image: bytes | str | Path, content_type: str = "image/jpeg") -> Extraction:
+    """
+    Async variant of run_image_extraction for the API endpoints.
+    The model call runs on a bounded thread pool so other requests keep flowing.
+    """
+    return await _run_blocking(run_image_extraction, image, content_type)
+
+
+async def run_text_extraction_async(text: str) -> Extraction:
+    """
+    Async variant of run_text_extraction for the API endpoints.
+    The model call runs on a bounded thread pool so other requests keep flowing.
+    """
+    return await _run_blocking(run_text_extraction, text)
+
+
+async def _iterate_blocking(gen_func, *args) -> AsyncIterator:
+    """
+    Drive a blocking generator on the inference pool and re-yield its
+    items on the event loop as they are produced. When the consumer stops
+    early (client disconnect), the producer stops at the next model chunk
+    and closes the upstream stream.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    cancelled = threading.Event()
+
+    def produce():
+        _stream_cancel.set(cancelled)
+        items = gen_func(*args)
+        try:
+            for item in items:
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except StreamCancelled:
+            pass
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            # Runs the generator's cleanup (admission slot, upstream stream) on this thread
+            items.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(get_client_manager().executor, contextvars.copy_context().run, traced, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Stops the producer at the next model chunk once the consumer is gone
+        cancelled.set()
+
+
+def stream_image_extraction_async(image: bytes | str | Path, content_type: str = "image/jpeg") -> AsyncIterator:
+    """Async iterator over stream_image_extraction events."""
+    return _iterate_blocking(stream_image_extraction, image, content_type)
+
+
+def stream_text_extraction_async(text: str) -> AsyncIterator:
+    """Async iterator over stream_text_extraction events."""
+    return _iterate_blocking(stream_text_extraction, text)
@@ -0,0 +1,97 @@
+"""
+Benchmark: the CPU side of a conversion on synthetic flowcharts.
+
+Times each step on its own, on a fresh copy of the model-style data
+every run:
+  validate  vision._validate_flowchart_data
+  spacing   excalidraw_builder._enforce_spacing
+  build     build_excalidraw (spacing + elements)
+  json      build_excalidraw_json (build + compact serialization)
+With NumPy installed it first checks that the vectorized arrow endpoints
+match the plain-Python ones, zero-size shapes included.
+Usage: python -m benchmarks.bench_builder [--sizes 10,50,200,500,1000,2000] [--repeat 20]
+                                          [--save-baseline | --check-baseline]
+"""
+
+import argparse
+import copy
+import math
+import sys
+import time
+
+from app import geometry
+from app.excalidraw_builder import _enforce_spacing, build_excalidraw, build_excalidraw_json
+from app.vision import _validate_flowchart_data
+
+from .common import add_baseline_arguments, handle_baseline, latency_summary, peak_rss_mb
+from .synthetic import make_flowchart
+
+STEPS = {
+    "validate": _validate_flowchart_data,
+    "spacing": _enforce_spacing,
+    "build": lambda data: build_excalidraw(data, key="bench"),
+    "json": lambda data: build_excalidraw_json(data, pretty=False, key="bench"),
+}
+
+
+def _check_geometry() -> bool:
+    """Vectorized and plain-Python arrow endpoints agree (True without NumPy)."""
+    if geometry.np is None:
+        return True
+    shapes = make_flowchart(200, seed=1)["nodes"]
+    links = [(i, (i * 7 + 3) % len(shapes)) for i in range(len(shapes))]
+    # Zero-size shapes of each kind, and a link between two shapes at the same centre
+    for kind, width, height in (("rectangle", 0, 40), ("ellipse", 60, 0), ("diamond", 0, 0)):
+        shapes.append({"type": kind, "x": 100.0, "y": 100.0, "width": width, "height": height})
+        links += [(len(shapes) - 1, 0), (1, len(shapes) - 1)]
+    shapes.append(dict(shapes[0]))
+    links.append((0, len(shapes) - 1))
+
+    vector = geometry._arrow_endpoints_vector(shapes, links, 4.0)
+    for link, got in zip(links, vector):
+        (expected,) = geometry.arrow_endpoints(shapes, [link], 4.0)
+        if not all(math.isclose(g, e, abs_tol=1e-6) for g, e in zip(got, expected)):
+            print(f"Geometry mismatch for link {link}: vector {got}, scalar {list(expected)}")
+            return False
+    return True
+
+
+def _run(step, data: dict, repeat: int) -> list[float]:
+    latencies = []
+    for _ in range(repeat):
+        fresh = copy.deepcopy(data)
+        start = time.perf_counter()
+        step(fresh)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark validation, layout and building.")
+    parser.add_argument("--sizes", default="10,50,200,500,1000,2000", help="Comma-separated node counts")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per step and size")
+    add_baseline_arguments(parser, "builder")
+    args = parser.parse_args()
+
+    if not _check_geometry():
+        sys.exit(1)
+
+    results = {}
+    print(f"{'step':<9} {'nodes':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for count in (int(s) for s in args.sizes.split(",")):
+        data = _validate_flowchart_data(make_flowchart(count, seed=count))
+        # Fewer repeats for the big charts keep the whole run short
+        repeat = max(3, args.repeat * 200 // max(count, 200))
+        for name, step in STEPS.items():
+            summary = latency_summary(_run(step, data, repeat))
+            results[f"{name}@{count}"] = summary
+            print(f"{name:<9} {count:>6} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+
+    rss = peak_rss_mb()
+    print(f"\nPeak RSS: {rss} MB")
+    results["process"] = {"peak_rss_mb": rss}
+    sys.exit(handle_baseline(args, "builder", results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark: overlap resolution time versus node count.
+
+Compares the original all-pairs _enforce_spacing (15 fixed passes)
+against the grid-indexed version in app.excalidraw_builder, both on
+nodes crammed into the 1200x900 canvas the model is asked to use and
+on a canvas that grows with the node count (constant density).
+"left" is the number of node pairs still closer than the minimum gap.
+Baselines record the grid version's median time and pairs left.
+Usage: python -m benchmarks.bench_layout [--sizes 10,50,100,200,500] [--legacy-max 500] [--repeat 5]
+                                         [--save-baseline | --check-baseline]
+"""
+
+import argparse
+import copy
+import itertools
+import math
+import random
+import sys
+import time
+
+from app.excalidraw_builder import _enforce_spacing
+
+from .common import add_baseline_arguments, handle_baseline, percentile
+
+
+def _legacy_enforce_spacing(flowchart_data: dict, min_gap: int = 100) -> dict:
+    """The pre-optimization path: 2x scale, then 15 passes over every pair."""
+    nodes = flowchart_data.get("nodes", [])
+    if len(nodes) < 2:
+        return flowchart_data
+    cx = sum(n["x"] + n["width"] / 2 for n in nodes) / len(nodes)
+    cy = sum(n["y"] + n["height"] / 2 for n in nodes) / len(nodes)
+    for n in nodes:
+        n["x"] = cx + (n["x"] + n["width"] / 2 - cx) * 2.0 - n["width"] / 2
+        n["y"] = cy + (n["y"] + n["height"] / 2 - cy) * 2.0 - n["height"] / 2
+    for _ in range(15):
+        moved = False
+        for a, b in itertools.combinations(nodes, 2):
+            dx = (b["x"] + b["width"] / 2) - (a["x"] + a["width"] / 2)
+            dy = (b["y"] + b["height"] / 2) - (a["y"] + a["height"] / 2)
+            min_dx = (a["width"] + b["width"]) / 2 + min_gap
+            min_dy = (a["height"] + b["height"]) / 2 + min_gap
+            if abs(dx) < min_dx and abs(dy) < min_dy:
+                if abs(dx) < 1 and abs(dy) < 1:
+                    dy = 1
+                if abs(dy) >= abs(dx):
+                    push = (min_dy - abs(dy)) / 2 + 5
+                    sign = 1 if dy >= 0 else -1
+                    b["y"] += push * sign
+                    a["y"] -= push * sign
+                else:
+                    push = (min_dx - abs(dx)) / 2 + 5
+                    sign = 1 if dx >= 0 else -1
+                    b["x"] += push * sign
+                    a["x"] -= push * sign
+                moved = True
+        if not moved:
+            break
+    return flowchart_data
+
+
+def make_flowchart(count: int, seed: int = 0, fixed_canvas: bool = True) -> dict:
+    """
+    Random boxes on a 1200x900 canvas, the way a model lays out a big chart,
+    or on a canvas scaled to keep about 30 nodes per 1200x900.
+    """
+    rng = random.Random(seed)
+    scale = 1.0 if fixed_canvas else max(1.0, math.sqrt(count / 30))
+    nodes = [
+        {
+            "id": f"node_{i + 1}",
+            "x": rng.uniform(0, 1200 * scale),
+            "y": rng.uniform(0, 900 * scale),
+            "width": rng.choice((120, 150, 160, 200)),
+            "height": rng.choice((60, 80)),
+        }
+        for i in range(count)
+    ]
+    return {"nodes": nodes, "arrows": []}
+
+
+def count_conflicts(nodes: list[dict], min_gap: int = 100) -> int:
+    """Pairs still closer than min_gap on both axes (all-pairs, for checking)."""
+    conflicts = 0
+    for a, b in itertools.combinations(nodes, 2):
+        dx = abs((b["x"] + b["width"] / 2) - (a["x"] + a["width"] / 2))
+        dy = abs((b["y"] + b["height"] / 2) - (a["y"] + a["height"] / 2))
+        if dx < (a["width"] + b["width"]) / 2 + min_gap - 1e-6 and dy < (a["height"] + b["height"]) / 2 + min_gap - 1e-6:
+            conflicts += 1
+    return conflicts
+
+
+def _time(func, data: dict) -> tuple[float, dict]:
+    data = copy.deepcopy(data)
+    start = time.perf_counter()
+    func(data)
+    return (time.perf_counter() - start) * 1000, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark overlap resolution.")
+    parser.add_argument("--sizes", default="10,50,100,200,500,1000", help="Comma-separated node counts")
+    parser.add_argument("--legacy-max", type=int, default=500, help="Skip the all-pairs version above this size")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of the grid version per case (median is reported)")
+    add_baseline_arguments(parser, "layout")
+    args = parser.parse_args()
+
+    results = {}
+
+    print(f"{'canvas':<9} {'nodes':>6} {'legacy ms':>10} {'left':>6} {'grid ms':>9} {'left':>6} {'speedup':>8}")
+    for fixed_canvas in (True, False):
+        canvas = "fixed" if fixed_canvas else "scaled"
+        for count in (int(s) for s in args.sizes.split(",")):
+            data = make_flowchart(count, seed=count, fixed_canvas=fixed_canvas)
+            runs = [_time(_enforce_spacing, data) for _ in range(max(1, args.repeat))]
+            new_ms = percentile([ms for ms, _ in runs], 50)
+            new_left = count_conflicts(runs[0][1]["nodes"])
+            results[f"{canvas}@{count}"] = {"grid_p50_ms": round(new_ms, 2), "left": new_left}
+            if count <= args.legacy_max:
+                legacy_ms, legacy_out = _time(_legacy_enforce_spacing, data)
+                legacy_left = count_conflicts(legacy_out["nodes"])
+                print(
+                    f"{canvas:<9} {count:>6} {legacy_ms:>10.1f} {legacy_left:>6} {new_ms:>9.1f} {new_left:>6} "
+                    f"{legacy_ms / max(new_ms, 1e-6):>7.1f}x"
+                )
+            else:
+                print(f"{canvas:<9} {count:>6} {'-':>10} {'-':>6} {new_ms:>9.1f} {new_left:>6} {'-':>8}")
+
+    sys.exit(handle_baseline(args, "layout", results))
+
+
+if __name__ == "__main__":
+    main()
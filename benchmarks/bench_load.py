@@ -0,0 +1,184 @@
+"""
+Benchmark: /api/convert end to end under concurrent load.
+
+Starts the mock model (benchmarks.mock_model) and the app under uvicorn
+pointed at it, then posts synthetic flowchart images from `--concurrency`
+clients at once. The response cache is disabled (and the images vary)
+so each request reaches the model. Reports throughput,
+latency percentiles, status codes, the server's peak RSS and the mean
+of each Server-Timing stage.
+Usage: python -m benchmarks.bench_load [--requests 200] [--concurrency 32] [--latency 1.5] [--nodes 12]
+                                       [--save-baseline | --check-baseline]
+The committed baseline was saved with --concurrency 16, which stays within
+the default upstream admission limits so every request is expected to succeed.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from .common import add_baseline_arguments, handle_baseline, latency_summary, peak_rss_mb
+from .mock_model import start_mock_model
+from .synthetic import make_flowchart, render_flowchart
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(port: int, model_url: str, extra_env: dict[str, str], verbose: bool) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "HAND2EXCAL_INFERENCE_BASE_URL": model_url,
+        "HAND2EXCAL_CACHE_MAX_ENTRIES": "0",
+        "HAND2EXCAL_CACHE_DISK_MAX_MB": "0",
+        "HF_API_TOKEN": os.environ.get("HF_API_TOKEN", "bench"),
+        **extra_env,
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.server:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode} (run with --verbose to see why)")
+        try:
+            if httpx.get(f"{base_url}/api/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready in {timeout:.0f}s")
+
+
+def _server_timing(header: str) -> dict[str, float]:
+    """{stage: ms} from a Server-Timing header."""
+    stages = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.startswith("dur="):
+            stages[name] = float(params[4:])
+    return stages
+
+
+async def _load(base_url: str, images: list[bytes], requests: int, concurrency: int) -> tuple[list[float], Counter, dict, float]:
+    latencies: list[float] = []
+    statuses: Counter[str] = Counter()
+    stage_ms: dict[str, list[float]] = defaultdict(list)
+    next_index = 0
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            image = images[index % len(images)]
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    f"{base_url}/api/convert",
+                    files={"file": (f"chart-{index}.jpg", image, "image/jpeg")},
+                )
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            statuses[str(response.status_code)] += 1
+            if response.status_code == 200:
+                latencies.append((time.perf_counter() - start) * 1000)
+                for name, ms in _server_timing(response.headers.get("server-timing", "")).items():
+                    stage_ms[name].append(ms)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300.0, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, stage_ms, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/convert against a mock model.")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at once")
+    parser.add_argument("--latency", type=float, default=1.5, help="Mock model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Mock model latency jitter in seconds")
+    parser.add_argument("--nodes", type=int, default=12, help="Nodes per synthetic flowchart")
+    parser.add_argument("--images", type=int, default=50, help="Distinct images to cycle through")
+    parser.add_argument("--url", default=None, help="Load an already running server instead of starting one")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Extra environment for the started server (repeatable)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show the started server's log")
+    add_baseline_arguments(parser, "load")
+    args = parser.parse_args()
+
+    images = []
+    for seed in range(args.images):
+        images.append(render_flowchart(make_flowchart(args.nodes, seed=seed), seed=seed))
+
+    server = None
+    mock = None
+    base_url = args.url
+    if base_url is None:
+        mock, _ = start_mock_model(latency=args.latency, jitter=args.jitter, nodes=args.nodes)
+        port = _free_port()
+        extra_env = dict(item.split("=", 1) for item in args.env)
+        server = _start_server(port, f"http://127.0.0.1:{mock.server_port}/v1", extra_env, args.verbose)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        if server is not None:
+            _wait_ready(base_url, server)
+        print(f"{args.requests} requests, concurrency {args.concurrency}, "
+              f"{args.nodes} nodes, model latency {args.latency}s +/- {args.jitter}s")
+        latencies, statuses, stage_ms, elapsed = asyncio.run(
+            _load(base_url.rstrip("/"), images, args.requests, args.concurrency)
+        )
+        rss = peak_rss_mb(server.pid) if server is not None else None
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if mock is not None:
+            mock.shutdown()
+
+    summary = latency_summary(latencies)
+    throughput = round(len(latencies) / elapsed, 2) if elapsed else 0.0
+    print(f"\nThroughput: {throughput} req/s over {elapsed:.1f}s")
+    print(f"Latency:    p50 {summary['p50_ms']:.0f} ms, p95 {summary['p95_ms']:.0f} ms, p99 {summary['p99_ms']:.0f} ms")
+    print(f"Statuses:   {dict(sorted(statuses.items()))}")
+    if rss is not None:
+        print(f"Server peak RSS: {rss} MB")
+    if stage_ms:
+        print("\nServer-Timing (mean ms):")
+        for name, values in sorted(stage_ms.items(), key=lambda item: -sum(item[1])):
+            print(f"  {name:<10} {sum(values) / len(values):>9.1f}")
+
+    errors = args.requests - statuses.get("200", 0)
+    case = f"convert@{args.nodes}x{args.concurrency}"
+    results = {case: {"throughput": throughput, **summary, "errors": errors}}
+    if rss is not None:
+        results[case]["peak_rss_mb"] = rss
+    sys.exit(handle_baseline(args, "load", results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: image preprocessing on synthetic phone photos.
+
+Compares the original full-resolution decode path against
+app.preprocess.ensure_jpeg (draft decode, pass-through, EXIF in one pass).
+Baselines record the new path's best time per case.
+Usage: python -m benchmarks.bench_preprocess [--repeat 5] [--save-baseline | --check-baseline]
+"""
+
+import argparse
+import io
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.preprocess import MAX_DIM, ensure_jpeg
+
+from .common import add_baseline_arguments, handle_baseline
+
+
+def _legacy_ensure_jpeg(image_bytes: bytes) -> bytes:
+    """The pre-optimization path: full decode, convert, LANCZOS, re-encode."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img = img.convert("RGB")
+    if max(img.size) > MAX_DIM:
+        img.thumbnail((MAX_DIM, MAX_DIM), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_photo(width: int, height: int, orientation: int = 1, fmt: str = "JPEG", seed: int = 0) -> bytes:
+    """Render a paper-coloured photo with pen strokes and sensor-like noise."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (236, 232, 222))
+    draw = ImageDraw.Draw(img)
+    stroke = max(2, width // 600)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 12, width // 5), rng.randrange(height // 20, height // 8)
+        draw.rectangle([x, y, x + w, y + h], outline=(30, 30, 40), width=stroke)
+        draw.line([x + w // 2, y + h, x + w // 2 + rng.randint(-200, 200), y + h + rng.randint(50, 300)],
+                  fill=(30, 30, 40), width=stroke)
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    img = Image.blend(img, noise, 0.08).filter(ImageFilter.SMOOTH)
+
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        exif = img.getexif()
+        exif[0x0112] = orientation
+        img.save(buf, format="JPEG", quality=92, exif=exif.tobytes())
+    else:
+        img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _time(func, data: bytes, repeat: int) -> tuple[float, bytes]:
+    best = float("inf")
+    out = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func(data)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case (best is reported)")
+    add_baseline_arguments(parser, "preprocess")
+    args = parser.parse_args()
+
+    # (baseline case, description, image)
+    cases = [
+        ("jpeg_12mp_rotated", "12 MP JPEG, rotated", make_photo(4032, 3024, orientation=6)),
+        ("jpeg_12mp", "12 MP JPEG, upright", make_photo(4032, 3024)),
+        ("jpeg_48mp", "48 MP JPEG, upright", make_photo(8064, 6048, seed=1)),
+        ("jpeg_1mp_passthrough", "1 MP JPEG (pass-through)", make_photo(1200, 900, seed=2)),
+        ("png_12mp", "12 MP PNG", make_photo(4032, 3024, fmt="PNG", seed=3)),
+    ]
+    results = {}
+
+    print(f"{'case':<28} {'input':>9} {'legacy ms':>10} {'new ms':>8} {'speedup':>8} {'decoded px':>12}")
+    for case, name, data in cases:
+        legacy_ms, _ = _time(_legacy_ensure_jpeg, data, args.repeat)
+        new_ms, out = _time(lambda b: ensure_jpeg(b, "")[0], data, args.repeat)
+        results[case] = {"best_ms": round(new_ms, 2)}
+
+        probe = Image.open(io.BytesIO(data))
+        probe.draft("RGB", (MAX_DIM, MAX_DIM))
+        decoded = probe.size[0] * probe.size[1]
+
+        print(
+            f"{name:<28} {len(data) / 1e6:>7.1f}MB {legacy_ms:>10.1f} {new_ms:>8.1f} "
+            f"{legacy_ms / max(new_ms, 1e-6):>7.1f}x {decoded:>12,}"
+        )
+        Image.open(io.BytesIO(out)).verify()
+
+    sys.exit(handle_baseline(args, "preprocess", results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Shared benchmark helpers: latency percentiles, peak memory and saved
+baselines that make a later run fail when it regresses.
+
+A baseline is a JSON file of {case: {metric: value}}. Every metric is
+"lower is better" except those listed in HIGHER_IS_BETTER; any increase
+in a metric listed in COUNTS (failed requests, node pairs left too close)
+is a regression.
+"""
+
+import json
+import resource
+import sys
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+HIGHER_IS_BETTER = {"throughput"}
+COUNTS = {"errors", "left"}
+
+# Differences smaller than this (ms, MB, requests/s) are timer noise, never regressions
+MIN_DELTA = 1.0
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(latencies_ms: list[float]) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+    }
+
+
+def peak_rss_mb(pid: int | None = None) -> float | None:
+    """
+    Peak resident set size in MB of this process, or of `pid` (Linux
+    only, from /proc). None when it cannot be read.
+    """
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def add_baseline_arguments(parser, default_name: str) -> None:
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"Write the results to benchmarks/baselines/{default_name}.json",
+    )
+    parser.add_argument(
+        "--check-baseline",
+        action="store_true",
+        help="Compare with the saved baseline and exit 1 on a regression",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown before a metric counts as a regression (default: 0.25 = 25%%)",
+    )
+    parser.add_argument("--baseline", default=None, help="Baseline file (overrides the default path)")
+
+
+def handle_baseline(args, default_name: str, results: dict[str, dict]) -> int:
+    """Save or check a baseline as requested on the command line; returns the exit code."""
+    path = Path(args.baseline) if args.baseline else BASELINE_DIR / f"{default_name}.json"
+    if args.save_baseline:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"\nSaved baseline to {path}")
+    if not args.check_baseline:
+        return 0
+    if not path.exists():
+        print(f"\nNo baseline at {path}; run with --save-baseline first.", file=sys.stderr)
+        return 1
+
+    baseline = json.loads(path.read_text(encoding="utf-8"))
+    regressions = compare(baseline, results, args.tolerance)
+    if regressions:
+        print(f"\nREGRESSIONS against {path} (tolerance {args.tolerance:.0%}):", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print(f"\nNo regressions against {path} (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """Human-readable list of metrics that got worse by more than `tolerance`."""
+    regressions = []
+    for case, metrics in results.items():
+        if case not in baseline:
+            # Different arguments than the baseline was saved with
+            regressions.append(f"{case}: not in the baseline (saved cases: {', '.join(sorted(baseline))})")
+            continue
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if metric in COUNTS and isinstance(old, int) and isinstance(value, int):
+                if value > old:
+                    regressions.append(f"{case} {metric}: {old} -> {value}")
+                continue
+            if not isinstance(old, (int, float)) or not isinstance(value, (int, float)) or old <= 0:
+                continue
+            if abs(value - old) < MIN_DELTA:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value > old * (1 + tolerance)
+            if worse:
+                regressions.append(f"{case} {metric}: {old:g} -> {value:g}")
+    return regressions
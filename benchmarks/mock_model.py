@@ -0,0 +1,163 @@
+"""
+Mock model server: A local OpenAI-compatible stand-in for the inference
+endpoint, answering /v1/chat/completions (plain and streaming) with a
+synthetic flowchart after a configurable delay. Requests made with the
+compact system prompt (HAND2EXCAL_COMPACT_OUTPUT) get the compact format.
+
+Point the app at it with HAND2EXCAL_INFERENCE_BASE_URL=http://127.0.0.1:<port>/v1.
+Usage: python -m benchmarks.mock_model [--port 8765] [--latency 1.5] [--jitter 0.5] [--nodes 12]
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .synthetic import make_flowchart
+
+_SHAPE_CODES = {"rectangle": "R", "ellipse": "E", "diamond": "D"}
+
+
+def _compact(flowchart: dict) -> str:
+    """The flowchart in the HAND2EXCAL_COMPACT_OUTPUT line format."""
+    lines = []
+    for node in flowchart["nodes"]:
+        shape = "O" if node.get("rounded") and node["type"] == "rectangle" else _SHAPE_CODES[node["type"]]
+        lines.append(f"N {node['id'].removeprefix('node_')} {shape} {node['label']}")
+    for arrow in flowchart["arrows"]:
+        label = f" {arrow['label']}" if arrow["label"] else ""
+        lines.append(f"E {arrow['from_id'].removeprefix('node_')} {arrow['to_id'].removeprefix('node_')}{label}")
+    lines.append("END")
+    return "\n".join(lines)
+
+
+class MockModel:
+    """Response settings shared by every handler thread; counts requests served."""
+
+    def __init__(self, latency: float, jitter: float, nodes: int, chunk_delay: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.nodes = nodes
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def content_for(self, body: bytes, request: dict) -> str:
+        # Same request, same answer; different images get different charts
+        seed = int.from_bytes(hashlib.sha256(body).digest()[:4], "big")
+        flowchart = make_flowchart(self.nodes, seed=seed)
+        system = next((m.get("content") for m in request.get("messages", []) if m.get("role") == "system"), "")
+        return _compact(flowchart) if "compact line format" in str(system) else json.dumps(flowchart)
+
+    def delay(self) -> float:
+        with self._lock:
+            self.requests += 1
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+
+def _handler(model: MockModel):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._send_json({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request = json.loads(body or b"{}")
+            content = model.content_for(body, request)
+            time.sleep(model.delay())
+            usage = {
+                "prompt_tokens": len(body) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(body) + len(content)) // 4,
+            }
+            if request.get("stream"):
+                self._stream(request.get("model", "mock"), content, usage)
+                return
+            self._send_json({
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }],
+                "usage": usage,
+            })
+
+        def _send_json(self, payload: dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, model_name: str, content: str, usage: dict) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(payload: dict | str) -> None:
+                data = payload if isinstance(payload, str) else json.dumps(payload)
+                chunk = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+
+            base = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model_name}
+            for i in range(0, len(content), 16):
+                event({**base, "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}]})
+                if model.chunk_delay:
+                    time.sleep(model.chunk_delay)
+            event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            event({**base, "choices": [], "usage": usage})
+            event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_mock_model(
+    port: int = 0,
+    latency: float = 1.5,
+    jitter: float = 0.5,
+    nodes: int = 12,
+    chunk_delay: float = 0.0,
+) -> tuple[ThreadingHTTPServer, MockModel]:
+    """Serve the mock on a background thread; port 0 picks a free port (see server.server_port)."""
+    model = MockModel(latency, jitter, nodes, chunk_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(model))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-model", daemon=True).start()
+    return server, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock of the inference endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.5, help="Seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Random +/- seconds added to the latency")
+    parser.add_argument("--nodes", type=int, default=12, help="Nodes in each returned flowchart")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server, _ = start_mock_model(args.port, args.latency, args.jitter, args.nodes, args.chunk_delay)
+    print(f"Mock model on http://127.0.0.1:{server.server_port}/v1 (Ctrl-C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Synthetic flowcharts for the benchmarks: model-style flowchart dicts of
+any size and hand-drawn-looking images of them.
+Usage: python -m benchmarks.synthetic --nodes 50 -o chart.png
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+
+from PIL import Image, ImageDraw
+
+_WORDS = (
+    "start", "end", "load", "parse", "check", "valid", "retry", "send", "save", "user",
+    "input", "error", "done", "wait", "queue", "build", "render", "fetch", "update", "login",
+)
+_COLORS = ("#1e1e1e", "#1e1e1e", "#1e1e1e", "#e03131", "#1971c2", "#2f9e44")
+_FILLS = ("transparent", "transparent", "transparent", "#ffec99", "#a5d8ff")
+
+
+def make_flowchart(nodes: int, seed: int = 0, branching: float = 1.3) -> dict:
+    """
+    A flowchart as the model returns it: nodes laid out roughly top to
+    bottom on a 1200x900 canvas (crowded for big charts, as real output
+    is), a spine of arrows plus `branching - 1` extra arrows per node,
+    labels of one to three words and a mix of shapes and colours.
+    """
+    rng = random.Random(seed)
+    columns = max(1, round(math.sqrt(nodes / 1.5)))
+    rows = math.ceil(nodes / columns)
+    chart_nodes = []
+    for i in range(nodes):
+        shape = "ellipse" if i in (0, nodes - 1) else rng.choice(("rectangle",) * 4 + ("diamond",))
+        row, col = divmod(i, columns)
+        chart_nodes.append({
+            "id": f"node_{i + 1}",
+            "type": shape,
+            "label": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3))).capitalize(),
+            "x": round(50 + col * 1100 / columns + rng.uniform(-20, 20)),
+            "y": round(50 + row * 800 / rows + rng.uniform(-15, 15)),
+            "width": rng.choice((120, 150, 160, 200)),
+            "height": 80 if shape == "diamond" else rng.choice((60, 70)),
+            "strokeColor": rng.choice(_COLORS),
+            "backgroundColor": rng.choice(_FILLS),
+            "rounded": rng.random() < 0.3,
+        })
+
+    arrows = [
+        {"from_id": f"node_{i}", "to_id": f"node_{i + 1}", "label": rng.choice(("", "", "", "yes", "no"))}
+        for i in range(1, nodes)
+    ]
+    for _ in range(int(nodes * max(0.0, branching - 1))):
+        a, b = sorted(rng.sample(range(1, nodes + 1), 2)) if nodes > 1 else (1, 1)
+        arrows.append({"from_id": f"node_{a}", "to_id": f"node_{b}", "label": ""})
+    return {"nodes": chart_nodes, "arrows": arrows}
+
+
+def render_flowchart(flowchart: dict, scale: float = 1.0, seed: int = 0, fmt: str = "JPEG") -> bytes:
+    """Draw a flowchart the way a photo of a whiteboard sketch looks: wobbly pen strokes on off-white."""
+    rng = random.Random(seed)
+    nodes = flowchart["nodes"]
+    width = int((max((n["x"] + n["width"] for n in nodes), default=400) + 60) * scale)
+    height = int((max((n["y"] + n["height"] for n in nodes), default=300) + 60) * scale)
+    img = Image.new("RGB", (width, height), (238, 235, 226))
+    draw = ImageDraw.Draw(img)
+    pen = (35, 35, 45)
+    stroke = max(2, int(2 * scale))
+
+    def jitter(value: float) -> float:
+        return value * scale + rng.uniform(-2, 2) * scale
+
+    centres = {}
+    for n in nodes:
+        x0, y0 = jitter(n["x"]), jitter(n["y"])
+        x1, y1 = jitter(n["x"] + n["width"]), jitter(n["y"] + n["height"])
+        centres[n["id"]] = ((x0 + x1) / 2, (y0 + y1) / 2)
+        if n["type"] == "ellipse":
+            draw.ellipse([x0, y0, x1, y1], outline=pen, width=stroke)
+        elif n["type"] == "diamond":
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            draw.polygon([(cx, y0), (x1, cy), (cx, y1), (x0, cy)], outline=pen, width=stroke)
+        else:
+            draw.rectangle([x0, y0, x1, y1], outline=pen, width=stroke)
+        draw.text((x0 + 10 * scale, (y0 + y1) / 2 - 6 * scale), n["label"], fill=pen)
+
+    for a in flowchart["arrows"]:
+        (sx, sy), (ex, ey) = centres[a["from_id"]], centres[a["to_id"]]
+        draw.line([sx, sy, ex, ey], fill=pen, width=max(1, stroke - 1))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=85)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic flowchart image (and its JSON).")
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0, help="Image pixels per canvas unit")
+    parser.add_argument("-o", "--output", default="synthetic.png")
+    args = parser.parse_args()
+
+    flowchart = make_flowchart(args.nodes, seed=args.seed)
+    fmt = "PNG" if args.output.lower().endswith(".png") else "JPEG"
+    with open(args.output, "wb") as f:
+        f.write(render_flowchart(flowchart, scale=args.scale, seed=args.seed, fmt=fmt))
+    with open(args.output.rsplit(".", 1)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(flowchart, f, indent=2)
+    print(f"Wrote {args.output} ({args.nodes} nodes, {len(flowchart['arrows'])} arrows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,13 +15,60 @@ const STATES = {
   ERROR: 'error',
 };
 
-const PROCESSING_STEPS = [
-  '🔍 Analyzing your flowchart...',
-  '🤖 Extracting shapes & text...',
-  '📐 Detecting connections & arrows...',
-  '🔧 Building Excalidraw elements...',
-  '✨ Almost there...',
-];
+const STAGE_LABELS = {
+  uploading: '📤 Uploading...',
+  received: '🔍 Analyzing your flowchart...',
+  preprocessed: '🤖 Extracting shapes & text...',
+  model_streaming: '📐 Detecting shapes & connections...',
+  model_continuing: '📐 Large diagram, fetching the rest...',
+  model_escalating: '🔎 Tricky drawing, asking a larger model...',
+  parsed: '🔧 Building Excalidraw elements...',
+  built: '✨ Almost there...',
+};
+
+/**
+ * POST to a streaming endpoint and dispatch its Server-Sent Events.
+ * Resolves with the `result` payload, rejects on an `error` event.
+ */
+async function streamConversion(url, options, onEvent) {
+  const response = await fetch(url, options);
+  if (!response.ok) {
+    const errData = await response.json().catch(() => ({}));
+    throw new Error(errData.detail || `Server error (${response.status})`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'error') throw new Error(payload.detail || 'Conversion failed.');
+      if (event === 'result') result = payload;
+      else onEvent(event, payload);
+    }
+  }
+
+  if (!result) throw new Error('Connection closed before the conversion finished.');
+  return result;
+}
 
 export default function App() {
   const [state, setState] = useState(STATES.IDLE);
@@ -30,7 +77,9 @@ export default function App() {
   const [preview, setPreview] = useState(null);
   const [result, setResult] = useState(null);
   const [error, setError] = useState('');
-  const [processingStep, setProcessingStep] = useState(0);
+  const [stage, setStage] = useState('uploading');
+  const [liveShapes, setLiveShapes] = useState([]);
+  const [liveArrows, setLiveArrows] = useState(0);
   const [previewFailed, setPreviewFailed] = useState(false);
 
   const handleFileSelected = useCallback((selectedFile) => {
@@ -55,36 +104,29 @@ export default function App() {
     setState(STATES.PREVIEW);
   }, []);
 
-  const handleConvert = useCallback(async () => {
-    if (!file) return;
-
+  const runConversion = useCallback(async (url, options) => {
     setState(STATES.PROCESSING);
-    setProcessingStep(0);
-
-    // Cycle through processing steps for UX
-    const stepInterval = setInterval(() => {
-      setProcessingStep((prev) =>
-        prev < PROCESSING_STEPS.length - 1 ? prev + 1 : prev
-      );
-    }, 3000);
-
-    try {
-      const formData = new FormData();
-      formData.append('file', file);
-
-      const response = await fetch(`${API_URL}/api/convert`, {
-        method: 'POST',
-        body: formData,
-      });
-
-      clearInterval(stepInterval);
-
-      if (!response.ok) {
-        const errData = await response.json().catch(() => ({}));
-        throw new Error(errData.detail || `Server error (${response.status})`);
+    setStage('uploading');
+    setLiveShapes([]);
+    setLiveArrows(0);
+
+    const onEvent = (event, payload) => {
+      if (event === 'stage') {
+        setStage(payload.stage);
+        // The larger model reads the drawing from scratch
+        if (payload.stage === 'model_escalating') {
+          setLiveShapes([]);
+          setLiveArrows(0);
+        }
+      } else if (event === 'node') {
+        setLiveShapes((prev) => [...prev, payload]);
+      } else if (event === 'arrow') {
+        setLiveArrows((prev) => prev + 1);
       }
+    };
 
-      const data = await response.json();
+    try {
+      const data = await streamConversion(url, options, onEvent);
 
       if (data.success) {
         setResult(data);
@@ -93,52 +135,32 @@ export default function App() {
         throw new Error('Conversion failed. Please try again.');
       }
     } catch (err) {
-      clearInterval(stepInterval);
       setError(err.message || 'Something went wrong. Please try again.');
       setState(STATES.ERROR);
     }
-  }, [file]);
-
-  const handleTextConvert = useCallback(async (text) => {
-    setState(STATES.PROCESSING);
-    setProcessingStep(0);
+  }, []);
 
-    const stepInterval = setInterval(() => {
-      setProcessingStep((prev) =>
-        prev < PROCESSING_STEPS.length - 1 ? prev + 1 : prev
-      );
-    }, 3000);
+  const handleConvert = useCallback(async () => {
+    if (!file) return;
 
-    try {
-      const response = await fetch(`${API_URL}/api/convert-text`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ text }),
-      });
-
-      clearInterval(stepInterval);
-
-      if (!response.ok) {
-        const errData = await response.json().catch(() => ({}));
-        throw new Error(errData.detail || `Server error (${response.status})`);
-      }
+    const formData = new FormData();
+    formData.append('file', file);
 
-      const data = await response.json();
+    await runConversion(`${API_URL}/api/convert/stream`, {
+      method: 'POST',
+      body: formData,
+    });
+  }, [file, runConversion]);
 
-      if (data.success) {
-        setResult(data);
-        setState(STATES.DONE);
-      } else {
-        throw new Error('Conversion failed. Please try again.');
-      }
-    } catch (err) {
-      clearInterval(stepInterval);
-      setError(err.message || 'Something went wrong. Please try again.');
-      setState(STATES.ERROR);
-    }
-  }, []);
+  const handleTextConvert = useCallback(async (text) => {
+    await runConversion(`${API_URL}/api/convert-text/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ text }),
+    });
+  }, [runConversion]);
 
   const handleReset = useCallback(() => {
     if (preview) URL.revokeObjectURL(preview);
@@ -234,8 +256,23 @@ export default function App() {
               <div className="processing-spinner" />
               <h3 className="processing-title">Converting your flowchart</h3>
               <p className="processing-step">
-                {PROCESSING_STEPS[processingStep]}
+                {STAGE_LABELS[stage] || STAGE_LABELS.received}
               </p>
+              {liveShapes.length > 0 && (
+                <ul className="processing-shapes">
+                  {/* Model ids can repeat; the list only grows, so indexes are stable keys */}
+                  {liveShapes.map((node, index) => (
+                    <li key={index} className="processing-shape">
+                      🔷 {node.label || node.type}
+                    </li>
+                  ))}
+                </ul>
+              )}
+              {liveArrows > 0 && (
+                <p className="processing-arrows">
+                  ➡️ {liveArrows} {liveArrows === 1 ? 'connection' : 'connections'}
+                </p>
+              )}
             </div>
           </div>
         )}